@@ -0,0 +1,835 @@
+from contextlib import ExitStack
+import hashlib
+import json
+import os
+from pathlib import Path
+import subprocess
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from args import build_args
+from async_extraction import ConcurrentExtraction
+from buffer_model import analyse_buffer
+from calculate_bitrates import (
+    calculate_bitrates,
+    calculate_bitrates_from_packets,
+    calculate_bitrates_per_stream,
+)
+from calculate_gop_bitrates import calculate_gop_bitrates_from_packets
+from follow import STATE_FILE, LiveSession
+from gop_report import GOPReportWriter
+from index_packets import has_readable_index, read_index_packets
+from metadata_cache import DEFAULT_CACHE_FILE, MetadataCache
+from packet_cache import CACHED_FIELDS, PacketCache
+from packet_reader import (
+    PacketColumns,
+    ffprobe_command,
+    iter_packet_chunks,
+    read_packets,
+)
+from profiling import Profiler, stage
+from progress import create_progress
+from pyramid import build_pyramid, save_pyramid
+from series_export import write_second_series
+from sharded_extraction import extract_packets_sharded
+from utils import FileInfoProvider, VideoInfoProvider, line
+from viewer import save_viewer
+from windowing import window_peaks
+
+import numpy as np
+
+# The analysis modes of analyze().
+MODES = ("per-second", "gop", "all-streams")
+
+TRACE_FILE = "trace.json"
+
+
+class Result(NamedTuple):
+    """The outcome of analysing one file."""
+
+    # The contents of data.json.
+    data: Dict
+    # Seconds in per-second mode, or GOP end times in GOP mode.
+    x_axis_values: List[float]
+    bitrates: List[float]
+    # The x-axis values and bitrates of every stream, in all-streams mode only.
+    stream_bitrates: Dict[int, Tuple[List[float], List[float]]]
+    # None if nothing was saved.
+    output_dir: Optional[Path]
+
+
+def create_progress_bar(args, file_path: str, show_progress: bool):
+    """The progress sink chosen with --progress, or none if `show_progress` is false."""
+    return create_progress(args.progress if show_progress else "none", file_path)
+
+
+def choose_stream_specifier(args, is_video: bool) -> str:
+    if args.stream_specifier:
+        return args.stream_specifier
+
+    if is_video:
+        print("Video file detected. The first video stream will be analysed.")
+        return "V:0"
+
+    print(
+        "It seems like you have specified an audio file. The first audio stream will be analysed."
+    )
+    return "a:0"
+
+
+def packet_fields(args) -> List[str]:
+    """The packet fields that the analysis chosen with `args` reads."""
+    timestamp_field = "dts_time" if args.dts else "pts_time"
+
+    if args.all_streams:
+        return ["stream_index", timestamp_field, "size"]
+
+    fields = [timestamp_field, "size"]
+
+    if args.gop:
+        fields.append("flags")
+
+    # The buffer model always uses the DTS, so it is read alongside the PTS.
+    if args.vbv_maxrate is not None and not args.dts:
+        fields.append("dts_time")
+
+    return fields
+
+
+def can_extract_concurrently(file_path: str, args) -> bool:
+    """
+    Whether the packets will be extracted by a single FFprobe process that
+    can start before the file's metadata is known: not with --low-memory,
+    --shards or --packet-cache, or if the packets can be read from the
+    file's index instead.
+    """
+    return (
+        not args.low_memory
+        and args.shards == 1
+        and not args.packet_cache
+        and (args.no_native_index or not has_readable_index(file_path))
+    )
+
+
+def extract_packets(
+    file_path: str,
+    fields,
+    stream_specifier,
+    args,
+    file_info: FileInfoProvider,
+    progress_bar,
+    task,
+    extraction: Optional[ConcurrentExtraction] = None,
+) -> PacketColumns:
+    """
+    Extract the specified packet fields in one FFprobe pass, or with one
+    FFprobe process per time shard if --shards is more than 1.
+
+    The packets of MP4/MOV and Matroska/WebM files are read from their index
+    or block headers instead, unless --no-native-index is used.
+
+    With --packet-cache, every field is extracted and cached beside the
+    output folder, and later runs on the same file load the cache instead.
+
+    If `extraction` is given, its FFprobe process, which was started along
+    with the metadata probe, is waited for instead.
+    """
+    file_duration = file_info.get_duration()
+    packet_cache = None
+    timestamp_field = "dts_time" if args.dts else "pts_time"
+
+    def report_progress(chunk: PacketColumns):
+        progress_bar.update(
+            task, completed=float(np.nanmax(chunk[timestamp_field], initial=0))
+        )
+
+    if extraction is not None:
+        with stage("extract packets") as counter:
+            packets = extraction.packets(on_chunk=report_progress)
+            counter.items = len(packets)
+
+        progress_bar.update(task, completed=file_duration)
+        return packets
+
+    if not args.no_native_index:
+        packets = read_index_packets(
+            file_path, fields, stream_specifier, file_info.get_codec_types()
+        )
+
+        if packets is not None:
+            print("Read the packet data from the file's index.")
+            progress_bar.update(task, completed=file_duration)
+            return packets
+
+    if args.packet_cache:
+        # Entries are keyed on the file's identity, so files with the same
+        # name can share a cache folder.
+        packet_cache = PacketCache(
+            Path(args.output_root, f"[{Path(file_path).name}]", ".packet_cache")
+        )
+        with stage("load packet cache") as counter:
+            packets = packet_cache.load(file_path, stream_specifier)
+            counter.items = len(packets) if packets is not None else 0
+
+        if packets is not None:
+            print("Using cached packet data.")
+            progress_bar.update(task, completed=file_duration)
+            return packets
+
+        fields = CACHED_FIELDS
+
+    with stage("extract packets") as counter:
+        if args.shards > 1:
+            packets = extract_packets_sharded(
+                file_path,
+                fields,
+                stream_specifier,
+                file_info.get_start_time(),
+                file_duration,
+                args.shards,
+                threads=args.ffprobe_threads,
+                on_shard_complete=lambda shards_read: progress_bar.update(
+                    task, completed=file_duration * shards_read / args.shards
+                ),
+            )
+        else:
+            cmd = ffprobe_command(
+                file_path, fields, stream_specifier, args.ffprobe_threads
+            )
+            process = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+            packets = read_packets(process.stdout, fields, on_chunk=report_progress)
+            process.wait()
+
+        counter.items = len(packets)
+
+    progress_bar.update(task, completed=file_duration)
+
+    if packet_cache:
+        with stage("save packet cache", len(packets)):
+            packet_cache.save(file_path, stream_specifier, packets)
+
+    return packets
+
+
+def analyse_all_streams(
+    file_path: str,
+    args,
+    file_info: FileInfoProvider,
+    file_duration: float,
+    output_dir: Optional[Path],
+    show_progress: bool,
+    extraction: Optional[ConcurrentExtraction] = None,
+) -> Tuple[dict, Dict[int, Tuple[List[float], List[float]]]]:
+    """
+    Analyse every stream from a single FFprobe pass, saving a graph per stream
+    unless `output_dir` is None or --no-plot is used. Returns the data of
+    every stream, keyed on the stream index, and the bitrates of every stream.
+    """
+    fields = packet_fields(args)
+
+    with create_progress_bar(args, file_path, show_progress) as progress_bar:
+        task = progress_bar.add_task(
+            description="Retrieving packet data...",
+            total=file_duration,
+        )
+        packets = extract_packets(
+            file_path, fields, None, args, file_info, progress_bar, task, extraction
+        )
+
+    with stage("calculate per stream", len(packets)):
+        results = calculate_bitrates_per_stream(
+            packets, file_info.get_codec_types(), args.dts
+        )
+    filename = Path(file_path).name
+    streams = {}
+    stream_bitrates = {}
+    should_plot = output_dir is not None and not args.no_plot
+
+    if should_plot:
+        from rendering import save_bitrates_graph
+
+        print("Creating graphs...")
+
+    for stream_index, (x_axis_values, bitrates, data) in results.items():
+        streams[str(stream_index)] = data
+        stream_bitrates[stream_index] = (x_axis_values, bitrates)
+
+        if args.windows and bitrates:
+            is_stream = packets["stream_index"] == stream_index
+            with stage("window peaks", int(np.count_nonzero(is_stream))):
+                data["max_window_bitrates"] = window_peaks(
+                    packets[fields[1]][is_stream],
+                    packets["size"][is_stream],
+                    args.windows,
+                    data["output_unit"],
+                )
+
+        if not should_plot:
+            continue
+
+        if not bitrates:
+            print(f"Skipping stream {stream_index}: {data['error']}")
+            continue
+
+        save_bitrates_graph(
+            f"{filename} - Stream {stream_index} ({data['codec_type']})",
+            x_axis_values,
+            bitrates,
+            "Mbps" if data["output_unit"] == "mbps" else "Kbps",
+            args.graph_type,
+            output_dir.joinpath(f"bitrates_graph_stream_{stream_index}.png"),
+        )
+
+    data = {
+        "mode": "DTS" if args.dts else "PTS",
+        "total_packets": len(packets),
+        "rejection_reasons": packets.rejection_reasons,
+        "streams": streams,
+    }
+
+    return data, stream_bitrates
+
+
+def output_folder_name(file_path: str, disambiguate: bool = False) -> str:
+    """
+    [filename], or with `disambiguate`, [filename] followed by a hash of the
+    file's folder, so that files with the same name in different folders
+    get different output folders.
+    """
+    name = f"[{Path(file_path).name}]"
+
+    if disambiguate:
+        parent = str(Path(file_path).resolve().parent)
+        name += f" {hashlib.sha1(parent.encode()).hexdigest()[:8]}"
+
+    return name
+
+
+def default_output_dir(file_path: str, args, disambiguate: bool = False) -> Path:
+    """
+    The [filename] folder under --output-root, or its gop or all_streams
+    subfolder. See output_folder_name() for `disambiguate`.
+    """
+    output_dir = Path(args.output_root, output_folder_name(file_path, disambiguate))
+
+    if args.all_streams:
+        return output_dir.joinpath("all_streams")
+    if args.gop:
+        return output_dir.joinpath("gop")
+
+    return output_dir
+
+
+def analyse_file(
+    file_path: str, args, show_progress: bool = True, disambiguate: bool = False
+) -> dict:
+    """
+    Analyse one file, saving the graph, data.json and any GOP reports in the
+    [filename] output folder. Returns the contents of data.json.
+    """
+    return run_analysis(
+        file_path,
+        args,
+        default_output_dir(file_path, args, disambiguate),
+        show_progress,
+    ).data
+
+
+def run_analysis(
+    file_path: str, args, output_dir: Optional[Path], show_progress: bool = True
+) -> Result:
+    """
+    Analyse one file with the options in `args`. The graph, data.json and any
+    GOP reports are saved in `output_dir`, unless it is None.
+
+    The time and memory of every stage are recorded in the profile section
+    of data.json. With --trace, they are also saved as a Chrome trace.
+    """
+    profiler = Profiler()
+
+    with profiler.activate(), ExitStack() as exit_stack:
+        result = _analyse(file_path, args, output_dir, show_progress, exit_stack)
+
+    result.data["profile"] = profiler.summary()
+
+    if "total_packets" in result.data:
+        print(f"Number of Packets: {result.data['total_packets']}")
+
+    if output_dir is not None:
+        with open(output_dir.joinpath("data.json"), "w") as f:
+            json.dump(result.data, f, indent=4)
+
+        if args.trace:
+            profiler.write_chrome_trace(output_dir.joinpath(TRACE_FILE))
+
+        print(f"Done! Check out the '{output_dir}' folder.")
+
+    return result
+
+
+def _analyse(
+    file_path: str,
+    args,
+    output_dir: Optional[Path],
+    show_progress: bool,
+    exit_stack: ExitStack,
+) -> Result:
+    framerate = None
+    is_constant_framerate = None
+    is_integer_framerate = None
+    x_axis_values, bitrates, stream_bitrates = [], [], {}
+
+    filename = Path(file_path).name
+    should_plot = output_dir is not None and not args.no_plot
+
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+
+    timestamp_field = "dts_time" if args.dts else "pts_time"
+    fields = packet_fields(args)
+
+    line()
+
+    metadata_cache = MetadataCache(
+        None if args.no_metadata_cache else DEFAULT_CACHE_FILE
+    )
+    extraction = None
+    # The first video stream is analysed unless the file turns out to have none.
+    guessed_stream_specifier = (
+        None if args.all_streams else args.stream_specifier or "V:0"
+    )
+
+    if can_extract_concurrently(file_path, args):
+        # FFprobe starts reading packets while the metadata is being probed,
+        # and they are parsed as they arrive.
+        extraction = exit_stack.enter_context(
+            ConcurrentExtraction(
+                file_path,
+                fields,
+                guessed_stream_specifier,
+                metadata_cache,
+                args.ffprobe_threads,
+            )
+        )
+        extraction.metadata()
+
+    file_info = FileInfoProvider(file_path, metadata_cache)
+    is_video = file_info.is_video()
+
+    if is_video:
+        video_info = VideoInfoProvider(file_path, metadata_cache)
+
+    if args.all_streams:
+        print("Every stream will be analysed.")
+        stream_specifier = None
+    else:
+        stream_specifier = choose_stream_specifier(args, is_video)
+
+    if extraction is not None and stream_specifier != guessed_stream_specifier:
+        extraction.restart(stream_specifier)
+
+    line()
+    file_duration = file_info.get_duration()
+    print(f"Detected the following info about {file_path}:")
+    line()
+    print(f"Duration: {file_duration}s")
+
+    if is_video:
+        is_constant_framerate = video_info.is_constant_framerate()
+
+        if not is_constant_framerate:
+            framerate = video_info.get_average_framerate()
+            print(
+                f"This video has a variable framerate. Average framerate is {framerate} FPS"
+            )
+        else:
+            framerate = video_info.get_framerate_number()
+            is_integer_framerate = video_info.is_integer_framerate()
+            print(f"Framerate: {framerate} FPS")
+
+    line()
+
+    if args.all_streams:
+        data, stream_bitrates = analyse_all_streams(
+            file_path,
+            args,
+            file_info,
+            file_duration,
+            output_dir,
+            show_progress,
+            extraction,
+        )
+
+    elif args.gop:
+        # Without an output folder, the writer has no reports to write.
+        with GOPReportWriter(
+            output_dir or Path("."),
+            args.gop_report_formats if output_dir is not None else (),
+        ) as report_writer, create_progress_bar(
+            args, file_path, show_progress
+        ) as progress_bar:
+            task_1 = progress_bar.add_task(
+                description="Retrieving packet data...",
+                total=file_duration,
+            )
+            task_2 = progress_bar.add_task(
+                description="Retrieving GOPs...",
+                total=None,
+            )
+
+            packets = extract_packets(
+                file_path,
+                fields,
+                stream_specifier,
+                args,
+                file_info,
+                progress_bar,
+                task_1,
+                extraction,
+            )
+
+            x_axis_values, bitrates, data = calculate_gop_bitrates_from_packets(
+                packets[timestamp_field],
+                packets["size"],
+                packets["keyframe"],
+                packets.rejection_reasons,
+                framerate,
+                report_writer,
+                args.dts,
+                progress_bar=progress_bar,
+                task=task_2,
+            )
+
+        if should_plot:
+            from rendering import save_gop_bitrates_graph
+
+            save_gop_bitrates_graph(
+                f"{filename} - Full Video",
+                x_axis_values,
+                bitrates,
+                args.graph_type,
+                Path(output_dir).joinpath("GOP_bitrates_graph.png"),
+            )
+
+    else:
+        with create_progress_bar(args, file_path, show_progress) as progress_bar:
+            task_1 = progress_bar.add_task(
+                description="Retrieving packet data...",
+                total=file_duration,
+            )
+            task_2 = progress_bar.add_task(
+                description="Summing packet sizes...",
+                total=None,
+            )
+
+            output_unit = "mbps" if is_video else "kbps"
+            buffer_levels = None
+
+            on_buckets = None
+            if output_dir is not None and args.series_formats:
+
+                def on_buckets(buckets):
+                    with stage("write series", len(buckets.seconds)):
+                        write_second_series(buckets, output_dir, args.series_formats)
+
+            if args.low_memory:
+                # Packets are aggregated as FFprobe outputs them, so they are
+                # never all held in memory.
+                cmd = ffprobe_command(
+                    file_path, fields, stream_specifier, args.ffprobe_threads
+                )
+                process = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+
+                x_axis_values, bitrates, data = calculate_bitrates(
+                    process,
+                    progress_bar,
+                    task_1,
+                    task_2,
+                    args.dts,
+                    output_unit=output_unit,
+                    low_memory=True,
+                    on_buckets=on_buckets,
+                )
+                process.wait()
+            else:
+                packets = extract_packets(
+                    file_path,
+                    fields,
+                    stream_specifier,
+                    args,
+                    file_info,
+                    progress_bar,
+                    task_1,
+                    extraction,
+                )
+
+                x_axis_values, bitrates, data = (
+                    calculate_bitrates_from_packets(
+                        packets[timestamp_field],
+                        packets["size"],
+                        packets.rejection_reasons,
+                        args.dts,
+                        output_unit,
+                        progress_bar=progress_bar,
+                        task=task_2,
+                        on_buckets=on_buckets,
+                    )
+                )
+
+                if args.windows:
+                    with stage("window peaks", len(packets)):
+                        data["max_window_bitrates"] = window_peaks(
+                            packets[timestamp_field],
+                            packets["size"],
+                            args.windows,
+                            output_unit,
+                        )
+
+                if args.viewer and output_dir is not None:
+                    with stage("bitrate pyramid", len(packets)):
+                        pyramid = build_pyramid(packets[timestamp_field], packets["size"])
+                        save_pyramid(pyramid, output_dir.joinpath("bitrate_pyramid.npz"))
+                        save_viewer(
+                            filename,
+                            pyramid,
+                            output_unit,
+                            output_dir.joinpath("bitrate_viewer.html"),
+                        )
+
+                if args.vbv_maxrate is not None:
+                    with stage("buffer model", len(packets)):
+                        data["buffer_model"], buffer_levels = analyse_buffer(
+                            packets["dts_time"],
+                            packets["size"],
+                            args.vbv_maxrate,
+                            args.vbv_bufsize,
+                            args.vbv_init,
+                        )
+
+                    buffer_model = data["buffer_model"]
+                    print(
+                        f"Minimum bufsize at {args.vbv_maxrate:g} kbit/s: {buffer_model['min_bufsize_kbits']:.0f} kbit"
+                    )
+                    if buffer_levels is not None:
+                        print(
+                            f"Buffer underflows: {buffer_model['underflow_count']}, "
+                            f"overflows: {buffer_model['overflow_count']}"
+                        )
+
+        if should_plot:
+            from rendering import save_bitrates_graph
+
+            print("Creating a graph...")
+            save_bitrates_graph(
+                filename,
+                x_axis_values,
+                bitrates,
+                "Mbps" if is_video else "Kbps",
+                args.graph_type,
+                Path(output_dir).joinpath("bitrates_graph.png"),
+            )
+
+            if buffer_levels is not None:
+                from rendering import save_buffer_graph
+
+                save_buffer_graph(
+                    f"{filename} - Buffer model",
+                    buffer_levels.times,
+                    buffer_levels.fullness / 1000,
+                    args.vbv_bufsize,
+                    args.graph_type,
+                    Path(output_dir).joinpath("buffer_fullness_graph.png"),
+                )
+
+    return Result(data, x_axis_values, bitrates, stream_bitrates, output_dir)
+
+
+def save_follow_outputs(session: LiveSession, title: str, args, output_dir: Path) -> dict:
+    if not args.no_plot:
+        save_follow_graphs(session, title, args, output_dir)
+
+    data = session.data()
+
+    # data.json is replaced in one go, so anything watching it never reads
+    # a partially written file.
+    temp_file = output_dir.joinpath("data.json.tmp")
+    with open(temp_file, "w") as f:
+        json.dump(data, f, indent=4)
+    os.replace(temp_file, output_dir.joinpath("data.json"))
+
+    return data
+
+
+def save_follow_graphs(session: LiveSession, title: str, args, output_dir: Path):
+    from rendering import save_bitrates_graph, save_gop_bitrates_graph
+
+    x_axis_values, bitrates = session.bitrates()
+    if bitrates:
+        save_bitrates_graph(
+            title,
+            x_axis_values,
+            bitrates,
+            "Mbps" if session.output_unit == "mbps" else "Kbps",
+            args.graph_type,
+            output_dir.joinpath("bitrates_graph.png"),
+        )
+
+    gop_end_times, gop_bitrates = session.gop_bitrates()
+    if gop_bitrates:
+        save_gop_bitrates_graph(
+            f"{title} - GOPs",
+            gop_end_times,
+            gop_bitrates,
+            args.graph_type,
+            output_dir.joinpath("GOP_bitrates_graph.png"),
+        )
+
+
+def follow_file(file_path: str, args) -> dict:
+    """
+    Analyse a file that is still being written, or a stream piped to stdin if
+    `file_path` is "-", as its packets arrive. The graphs and data.json in the
+    [filename]/follow folder are refreshed every --refresh-interval seconds
+    until the input ends or Ctrl+C is pressed.
+
+    When following a file, the aggregated state is saved beside data.json,
+    and a later run on the same file resumes from where this one stopped.
+    """
+    is_pipe = file_path == "-"
+    filename = "stdin" if is_pipe else Path(file_path).name
+    output_dir = Path(args.output_root, f"[{filename}]", "follow")
+    os.makedirs(output_dir, exist_ok=True)
+
+    framerate = None
+    line()
+
+    if is_pipe:
+        # A pipe cannot be probed beforehand without consuming it.
+        stream_specifier = args.stream_specifier or "V:0"
+        is_video = not stream_specifier.startswith("a")
+        print(f"Following stdin. Stream {stream_specifier} will be analysed.")
+    else:
+        # The file is growing, so its metadata is never cached on disk.
+        metadata_cache = MetadataCache(None)
+        is_video = FileInfoProvider(file_path, metadata_cache).is_video()
+        stream_specifier = choose_stream_specifier(args, is_video)
+
+        if is_video:
+            video_info = VideoInfoProvider(file_path, metadata_cache)
+            if video_info.is_constant_framerate():
+                framerate = video_info.get_framerate_number()
+
+    session = LiveSession(
+        filename if is_pipe else str(Path(file_path).resolve()),
+        args.dts,
+        "mbps" if is_video else "kbps",
+        track_gops=is_video,
+        framerate=framerate,
+        history_seconds=args.history,
+    )
+
+    state_file = None if is_pipe else output_dir.joinpath(STATE_FILE)
+    input_options = []
+
+    if not is_pipe:
+        # The file protocol's follow option keeps reading as the file grows.
+        input_options += ["-follow", "1"]
+
+        if args.idle_timeout:
+            input_options += ["-rw_timeout", str(int(args.idle_timeout * 1_000_000))]
+
+        if not args.no_resume and session.load_state(state_file):
+            # Seek a little earlier so that packets which are reordered
+            # across the resume point are read again.
+            resume_point = max(session.resumed_from - session.reorder_window, 0)
+            input_options += ["-read_intervals", f"{resume_point:.6f}%"]
+            print(f"Resuming from {session.resumed_from:.3f}s.")
+
+    line()
+
+    cmd = ffprobe_command(
+        "pipe:0" if is_pipe else file_path,
+        session.fields,
+        stream_specifier,
+        args.ffprobe_threads,
+    )
+    cmd = cmd[:-1] + input_options + cmd[-1:]
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    last_refresh = time.monotonic()
+
+    try:
+        for chunk in iter_packet_chunks(process.stdout, session.fields, partial_reads=True):
+            session.add(chunk)
+
+            if time.monotonic() - last_refresh >= args.refresh_interval:
+                if state_file:
+                    session.save_state(state_file)
+
+                data = save_follow_outputs(session, filename, args, output_dir)
+                last_refresh = time.monotonic()
+                print(
+                    f"Updated: {data['total_packets']} packets up to {session.settled_until:.3f}s"
+                )
+    except KeyboardInterrupt:
+        print("Stopping...")
+        process.terminate()
+
+    process.wait()
+
+    # The state is saved before the packets still in the reorder buffer are
+    # aggregated, so that a later run reads them again in order.
+    if state_file:
+        session.save_state(state_file)
+
+    session.flush()
+    data = save_follow_outputs(session, filename, args, output_dir)
+
+    print(f"Number of Packets: {data['total_packets']}")
+    print(f"Done! Check out the '{output_dir}' folder.")
+
+    return data
+
+
+def analyze(
+    file_path: str,
+    mode: str = "per-second",
+    stream: Optional[str] = None,
+    use_dts: bool = False,
+    output_dir: Optional[str] = None,
+    plot: bool = True,
+    show_progress: bool = False,
+    **options,
+) -> Result:
+    """
+    Analyse one file in-process, for use as a library.
+
+    `mode` is one of MODES and `stream` is an FFmpeg stream specifier, as with
+    -s. Nothing is written unless `output_dir` is specified, in which case
+    data.json, any GOP reports and, if `plot` is true, the graphs are saved
+    there. Any other command line option can be passed by its argument name,
+    e.g. shards=4 or windows=[0.5, 2]. With `show_progress`, progress is
+    reported to the sink chosen with `progress`, which is rich by default.
+
+    Example:
+        result = analyze("video.mp4", mode="gop")
+        print(result.data["gop_count"])
+    """
+    if mode not in MODES:
+        raise ValueError(f"Invalid mode '{mode}'. Must be one of: {MODES}")
+
+    args = build_args(
+        file_path,
+        dts=use_dts,
+        gop=mode == "gop",
+        all_streams=mode == "all-streams",
+        stream_specifier=stream,
+        no_plot=not plot,
+        **options,
+    )
+
+    return run_analysis(
+        file_path,
+        args,
+        Path(output_dir) if output_dir is not None else None,
+        show_progress,
+    )
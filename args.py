@@ -1,4 +1,6 @@
-from argparse import ArgumentParser, RawTextHelpFormatter
+from argparse import ArgumentParser, Namespace, RawTextHelpFormatter
+import os
+from typing import Optional
 
 parser = ArgumentParser(formatter_class=RawTextHelpFormatter)
 
@@ -6,10 +8,14 @@ parser.add_argument(
     "-f",
     "--file-path",
     type=str,
+    nargs="+",
     required=True,
     help="Enter the path of the file that you want to analyse.\n"
     "If the path contains a space, it must be surrounded in double quotes.\n"
-    'Example: -f "C:/Users/H/Desktop/my file.mp4"',
+    'Example: -f "C:/Users/H/Desktop/my file.mp4"\n'
+    "Multiple files, glob patterns and directories can be specified to analyse many files in one go.\n"
+    'Example: -f "renditions/*.mp4" "D:/Encodes"\n'
+    "With --follow, specify - to read a stream that is piped to stdin.",
 )
 
 parser.add_argument(
@@ -24,6 +30,28 @@ parser.add_argument(
     help="Output information about every Group Of Pictures (GOP).\nOnly applicable if analysing a video file.",
 )
 
+parser.add_argument(
+    "--gop-report-formats",
+    nargs="+",
+    choices=["text", "csv", "ndjson", "npy"],
+    default=["text"],
+    help="The formats that the per-GOP statistics should be saved in. The default is text.\n"
+    "text: gop_statistics.txt, csv: gop_statistics.csv, ndjson: gop_statistics.ndjson (one JSON object per line),\n"
+    "npy: a gop_statistics folder with one NumPy array per statistic.\n"
+    "Only applicable if using -gop.",
+)
+
+parser.add_argument(
+    "--series-formats",
+    nargs="+",
+    choices=["npy", "csv", "ndjson"],
+    default=[],
+    help="Also save the bytes, packets and completeness of every second in these formats.\n"
+    "npy: a bitrate_series folder with one NumPy array per column, csv: bitrate_series.csv,\n"
+    "ndjson: bitrate_series.ndjson (one JSON object per line).\n"
+    "Not applicable if using -gop, --all-streams, --follow or --ladder.",
+)
+
 parser.add_argument(
     "-g",
     "--graph-type",
@@ -33,6 +61,39 @@ parser.add_argument(
     "To see the difference between a filled and unfilled graph, check out the example graph files.",
 )
 
+parser.add_argument(
+    "--no-plot",
+    action="store_true",
+    help="Do not create any graphs. data.json and any GOP reports are still saved,\n"
+    "and matplotlib is never imported, which makes the analysis start faster.",
+)
+
+parser.add_argument(
+    "--output-root",
+    default=".",
+    metavar="DIR",
+    help="The folder that the [filename] output folders, [ladder] and batch_summary.json are saved in.\n"
+    "The default is the current folder.",
+)
+
+parser.add_argument(
+    "--progress",
+    choices=["rich", "jsonl", "none"],
+    default="rich",
+    help="How progress is reported. The default is rich.\n"
+    "rich: progress bars in the terminal. Not shown when analysing multiple files.\n"
+    "jsonl: one JSON object per line on stderr, with the file, task, completed and total, at most once a second per task.\n"
+    "none: no progress, e.g. for headless runs.",
+)
+
+parser.add_argument(
+    "--trace",
+    action="store_true",
+    help="Also save trace.json, a Chrome trace of every stage of the analysis, in the output folder.\n"
+    "It can be opened in chrome://tracing or https://ui.perfetto.dev. The totals of every stage\n"
+    "are always saved in the profile section of data.json.",
+)
+
 parser.add_argument(
     "-s",
     "--stream-specifier",
@@ -43,4 +104,265 @@ parser.add_argument(
     "As an example, to target the 2nd audio stream: --stream-specifier a:1",
 )
 
-args = parser.parse_args()
+parser.add_argument(
+    "--all-streams",
+    action="store_true",
+    help="Analyse every stream of the file with a single FFprobe pass, creating a graph per stream.\n"
+    "Video streams are in Mbps and other streams are in Kbps. Cannot be used with -gop or -s.",
+)
+
+parser.add_argument(
+    "--ladder",
+    action="store_true",
+    help="Compare the renditions of an ABR ladder, specified with -f. Up to --jobs renditions are analysed at once,\n"
+    "with one pass over each. Their per-second bitrates (in Mbps) are overlaid on one graph, and the GOP boundaries\n"
+    "that are not shared by every video rendition are listed in [ladder]/data.json.",
+)
+
+parser.add_argument(
+    "--alignment-tolerance",
+    type=float,
+    default=0.001,
+    metavar="SECONDS",
+    help="How far apart the keyframes of two renditions can be for their GOP boundaries to be considered aligned.\n"
+    "Only applicable if using --ladder. The default is 0.001.",
+)
+
+parser.add_argument(
+    "--windows",
+    type=float,
+    nargs="+",
+    metavar="SECONDS",
+    help="Also calculate the peak bitrate over windows of these sizes, in seconds, and save them in data.json.\n"
+    "For each size, the peak of consecutive (fixed) windows and of a window sliding packet by packet is calculated.\n"
+    "Example: --windows 0.1 0.5 2. Not applicable if using -gop or --low-memory.",
+)
+
+parser.add_argument(
+    "--viewer",
+    action="store_true",
+    help="Also save the min, max and mean bitrate over 0.1s to 1h bins in bitrate_pyramid.npz, and\n"
+    "bitrate_viewer.html, a self-contained page for zooming into them that works offline.\n"
+    "Not applicable if using -gop or --low-memory.",
+)
+
+parser.add_argument(
+    "--vbv-maxrate",
+    type=float,
+    metavar="KBPS",
+    help="Run the packets through a VBV/HRD buffer model that fills at this rate, in kbit/s, as with FFmpeg's -maxrate.\n"
+    "The smallest -bufsize that never underflows is saved in data.json. The model always uses the DTS.\n"
+    "Not applicable if using -gop or --low-memory.",
+)
+
+parser.add_argument(
+    "--vbv-bufsize",
+    type=float,
+    metavar="KBITS",
+    help="The buffer size, in kbit, as with FFmpeg's -bufsize. Every underflow and overflow is saved in data.json\n"
+    "and the buffer fullness is plotted in buffer_fullness_graph.png. Requires --vbv-maxrate.",
+)
+
+parser.add_argument(
+    "--vbv-init",
+    type=float,
+    default=0.9,
+    metavar="FRACTION",
+    help="How full the buffer is at the first packet, as a fraction of its size. The default is 0.9.",
+)
+
+parser.add_argument(
+    "--low-memory",
+    action="store_true",
+    help="Aggregate packets as they are read instead of keeping every packet in memory.\n"
+    "Memory usage is then proportional to the duration rather than the number of packets.\n"
+    "Only applicable when not using -gop.",
+)
+
+parser.add_argument(
+    "--follow",
+    action="store_true",
+    help="Follow a file that is still being written, e.g. a live recording, or a stream piped to stdin (-f -).\n"
+    "Packets are aggregated per second and per GOP as they arrive, and the graphs and data.json in the\n"
+    "[filename]/follow folder are refreshed until the input ends or Ctrl+C is pressed.\n"
+    "When following a file, the next run on the same file resumes from the last processed timestamp.",
+)
+
+parser.add_argument(
+    "--refresh-interval",
+    type=float,
+    default=5,
+    metavar="SECONDS",
+    help="How often the graphs and data.json are refreshed when using --follow. The default is 5 seconds.",
+)
+
+parser.add_argument(
+    "--history",
+    type=float,
+    default=3600,
+    metavar="SECONDS",
+    help="How many seconds of the stream the graphs and statistics cover when using --follow.\n"
+    "Older seconds and GOPs are discarded so that memory usage stays bounded. The default is 3600.",
+)
+
+parser.add_argument(
+    "--idle-timeout",
+    type=float,
+    metavar="SECONDS",
+    help="When using --follow on a file, stop once the file has not grown for this many seconds.\n"
+    "By default, the file is followed until Ctrl+C is pressed.",
+)
+
+parser.add_argument(
+    "--no-resume",
+    action="store_true",
+    help="When using --follow on a file, start from the beginning instead of resuming the previous run.",
+)
+
+parser.add_argument(
+    "--shards",
+    type=int,
+    default=1,
+    help="Split the file into this many time ranges and extract their packets with one FFprobe process each.\n"
+    "Packets read by more than one FFprobe process are removed, so the results are the same as with one process.\n"
+    "If the time ranges do not meet, or the packets have no byte positions, they are read in a single pass instead.\n"
+    "Cannot be used with --low-memory. The default is 1.",
+)
+
+parser.add_argument(
+    "--packet-cache",
+    action="store_true",
+    help="Cache the extracted packet data in the [filename] folder and reuse it on later runs,\n"
+    "so that switching between PTS and DTS, graph types or -gop does not run FFprobe again.\n"
+    "The cache is invalidated when the file's size or modification time changes. Cannot be used with --low-memory.",
+)
+
+parser.add_argument(
+    "--no-native-index",
+    action="store_true",
+    help="Always extract packets with FFprobe. By default, the packets of MP4/MOV files are read straight from\n"
+    "their sample tables (including fragmented MP4), and those of Matroska/WebM files from their block headers,\n"
+    "which only reads a small part of the file instead of all of it.",
+)
+
+parser.add_argument(
+    "--no-metadata-cache",
+    action="store_true",
+    help="Do not read or write the persistent metadata cache.\n"
+    "By default, FFprobe metadata is cached in ~/.cache/bitrate-plotter/metadata.json\n"
+    "and reused until the file's size or modification time changes.",
+)
+
+parser.add_argument(
+    "-j",
+    "--jobs",
+    type=int,
+    default=os.cpu_count() or 1,
+    help="The maximum number of files that are analysed at the same time when multiple files are specified,\n"
+    "which is also the maximum number of concurrent FFprobe processes. The default is the number of CPU cores.",
+)
+
+parser.add_argument(
+    "--ffprobe-threads",
+    type=int,
+    help="The number of threads that each FFprobe process should use. By default, FFprobe decides.",
+)
+
+
+def _validation_error(args) -> Optional[str]:
+    """Return why the combination of options in `args` is invalid, if it is."""
+    if args.all_streams and (args.gop or args.stream_specifier):
+        return "--all-streams cannot be used with -gop or -s/--stream-specifier"
+
+    if args.shards < 1:
+        return f"--shards must be at least 1, got {args.shards}"
+
+    if args.shards > 1 and args.low_memory:
+        return "--shards cannot be used with --low-memory"
+
+    if args.packet_cache and args.low_memory:
+        return "--packet-cache cannot be used with --low-memory"
+
+    if args.windows and (args.gop or args.low_memory):
+        return "--windows cannot be used with -gop or --low-memory"
+
+    if args.windows and any(window <= 0 for window in args.windows):
+        return "--windows sizes must be positive"
+
+    if args.vbv_bufsize is not None and args.vbv_maxrate is None:
+        return "--vbv-bufsize requires --vbv-maxrate"
+
+    if args.vbv_maxrate is not None:
+        if args.gop or args.low_memory or args.all_streams or args.follow or args.ladder:
+            return "--vbv-maxrate cannot be used with -gop, --low-memory, --all-streams, --follow or --ladder"
+
+        if args.vbv_maxrate <= 0 or (args.vbv_bufsize is not None and args.vbv_bufsize <= 0):
+            return "--vbv-maxrate and --vbv-bufsize must be positive"
+
+        if not 0 < args.vbv_init <= 1:
+            return "--vbv-init must be greater than 0 and at most 1"
+
+    if args.follow:
+        if len(args.file_path) > 1:
+            return "--follow takes a single file, or - for stdin"
+
+        if (
+            args.gop
+            or args.all_streams
+            or args.low_memory
+            or args.shards > 1
+            or args.packet_cache
+            or args.windows
+        ):
+            return "--follow cannot be used with -gop, --all-streams, --low-memory, --shards, --packet-cache or --windows"
+
+        if args.refresh_interval <= 0 or args.history <= 0:
+            return "--refresh-interval and --history must be positive"
+
+    if args.ladder:
+        if args.gop or args.all_streams or args.low_memory or args.follow or args.windows:
+            return "--ladder cannot be used with -gop, --all-streams, --low-memory, --follow or --windows"
+
+        if args.alignment_tolerance < 0:
+            return "--alignment-tolerance must not be negative"
+
+    if args.viewer and (args.gop or args.low_memory or args.all_streams or args.follow or args.ladder):
+        return "--viewer cannot be used with -gop, --low-memory, --all-streams, --follow or --ladder"
+
+    if args.series_formats and (args.gop or args.all_streams or args.follow or args.ladder):
+        return "--series-formats cannot be used with -gop, --all-streams, --follow or --ladder"
+
+    if args.jobs < 1:
+        return f"--jobs must be at least 1, got {args.jobs}"
+
+    return None
+
+
+def parse_args(argv=None):
+    args = parser.parse_args(argv)
+
+    error = _validation_error(args)
+    if error:
+        parser.error(error)
+
+    return args
+
+
+def build_args(file_path: str, **options) -> Namespace:
+    """
+    The arguments for analysing `file_path` with the command line defaults,
+    overridden by `options`, which are keyed on argument names such as
+    gop=True or stream_specifier="a:1". Raises ValueError if they are invalid.
+    """
+    args = parser.parse_args([f"--file-path={file_path}"])
+
+    for name, value in options.items():
+        if not hasattr(args, name):
+            raise TypeError(f"Unknown option: {name}")
+        setattr(args, name, value)
+
+    error = _validation_error(args)
+    if error:
+        raise ValueError(error)
+
+    return args
@@ -0,0 +1,238 @@
+import asyncio
+from concurrent.futures import Future
+import contextvars
+import json
+import queue
+import threading
+from typing import Callable, Dict, List, Optional, Sequence
+
+from metadata_cache import MetadataCache
+from packet_reader import (
+    CHUNK_SIZE,
+    PacketColumns,
+    ffprobe_command,
+    parse_chunk,
+    split_complete_lines,
+)
+from profiling import stage
+
+import ffmpeg
+
+
+async def probe_async(file_path: str) -> Dict:
+    """The same metadata as `ffmpeg.probe()`, from an asyncio subprocess."""
+    cmd = ["ffprobe", "-show_format", "-show_streams", "-of", "json", file_path]
+    process = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    out, err = await process.communicate()
+
+    if process.returncode != 0:
+        raise ffmpeg.Error("ffprobe", out, err)
+
+    return json.loads(out.decode("utf-8"))
+
+
+async def read_packets_async(
+    cmd: List[str],
+    fields: Sequence[str],
+    on_chunk: Callable[[PacketColumns], None],
+    chunk_size: int = CHUNK_SIZE,
+) -> PacketColumns:
+    """
+    Run an FFprobe packet command as an asyncio subprocess and parse its
+    output as soon as it arrives, rather than in full blocks. Every chunk of
+    packets is passed to `on_chunk`. The subprocess is killed if this is
+    cancelled.
+    """
+    process = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE)
+    parts = []
+    remainder = b""
+
+    try:
+        while True:
+            block = await process.stdout.read(chunk_size)
+            if not block:
+                break
+
+            chunk, remainder = split_complete_lines(remainder + block)
+
+            if chunk.strip():
+                with stage("parse") as counter:
+                    packets = parse_chunk(chunk, fields)
+                    counter.items = len(packets)
+
+                parts.append(packets)
+                on_chunk(packets)
+
+        if remainder.strip():
+            with stage("parse") as counter:
+                packets = parse_chunk(remainder, fields)
+                counter.items = len(packets)
+
+            parts.append(packets)
+            on_chunk(packets)
+
+        await process.wait()
+    except asyncio.CancelledError:
+        process.kill()
+        await process.wait()
+        raise
+
+    if process.returncode != 0:
+        raise RuntimeError(
+            f"FFprobe exited with code {process.returncode}: {' '.join(cmd)}"
+        )
+
+    with stage("concatenate packets") as counter:
+        packets = PacketColumns.concatenate(parts, fields)
+        counter.items = len(packets)
+
+    return packets
+
+
+class ConcurrentExtraction:
+    """
+    Probes a file's metadata and extracts its packets with FFprobe at the
+    same time, as asyncio subprocesses on an event loop in a background
+    thread. Packets are parsed as they arrive while the caller waits for
+    the metadata and sets up the analysis.
+
+    The packets are extracted with `stream_specifier`, which is a guess until
+    the metadata is known, e.g. the first video stream. If the guess turns
+    out to be wrong, call restart() with the right one.
+
+    Use it as a context manager so that FFprobe is stopped if the analysis
+    fails.
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        fields: Sequence[str],
+        stream_specifier: Optional[str],
+        metadata_cache: MetadataCache,
+        threads: Optional[int] = None,
+    ):
+        self._file_path = file_path
+        self._fields = fields
+        self._threads = threads
+        self._metadata_cache = metadata_cache
+        # The task that extracts the packets, which is only used on the loop.
+        self._task: Optional[asyncio.Task] = None
+        self._metadata: Optional[Future] = None
+        self._packets: Optional[Future] = None
+        # Checked before the loop starts, as it can raise OSError.
+        is_cached = metadata_cache.get(file_path) is not None
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+
+        try:
+            if not is_cached:
+                self._metadata = self._submit(probe_async(file_path))
+
+            self._start_packets(stream_specifier)
+        except BaseException:
+            self.close()
+            raise
+
+    def __enter__(self) -> "ConcurrentExtraction":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _submit(self, coroutine) -> Future:
+        # The task runs in a copy of the caller's context, as the shards do in
+        # sharded_extraction.py, so that its stages are recorded by the active
+        # profiler.
+        return contextvars.copy_context().run(
+            asyncio.run_coroutine_threadsafe, coroutine, self._loop
+        )
+
+    def _start_packets(self, stream_specifier: Optional[str]):
+        # Chunks are passed back to the thread that calls packets() through a
+        # queue, which ends with None, so that progress is reported from that
+        # thread only.
+        self._chunks: "queue.Queue[Optional[PacketColumns]]" = queue.Queue()
+        self._packets = self._submit(self._read_packets(stream_specifier, self._chunks))
+
+    async def _read_packets(
+        self,
+        stream_specifier: Optional[str],
+        chunks: "queue.Queue[Optional[PacketColumns]]",
+    ) -> PacketColumns:
+        self._task = asyncio.current_task()
+        cmd = ffprobe_command(
+            self._file_path, self._fields, stream_specifier, self._threads
+        )
+
+        try:
+            return await read_packets_async(cmd, self._fields, chunks.put)
+        finally:
+            chunks.put(None)
+
+    async def _stop_packets(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def metadata(self) -> Dict:
+        """
+        Wait for the metadata and add it to the metadata cache, so that
+        FileInfoProvider and VideoInfoProvider do not probe the file again.
+        """
+        if self._metadata is not None:
+            with stage("probe metadata", 1):
+                metadata = self._metadata.result()
+
+            self._metadata_cache.put(self._file_path, metadata)
+            self._metadata = None
+
+        return self._metadata_cache.probe(self._file_path)
+
+    def restart(self, stream_specifier: Optional[str]):
+        """Stop extracting packets and start again with `stream_specifier`."""
+        self._submit(self._stop_packets()).result()
+        self._start_packets(stream_specifier)
+
+    def packets(
+        self, on_chunk: Optional[Callable[[PacketColumns], None]] = None
+    ) -> PacketColumns:
+        """
+        Wait for every packet. `on_chunk` is called in this thread with every
+        chunk, as it arrives.
+        """
+        while True:
+            chunk = self._chunks.get()
+            if chunk is None:
+                break
+
+            if on_chunk is not None:
+                on_chunk(chunk)
+
+        return self._packets.result()
+
+    def close(self):
+        if self._packets is not None:
+            self._packets.cancel()
+        if self._metadata is not None:
+            self._metadata.cancel()
+
+        # Let the cancelled tasks kill their subprocesses before stopping.
+        async def drain():
+            tasks = [
+                task for task in asyncio.all_tasks() if task is not asyncio.current_task()
+            ]
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        # The loop may not have started running yet, but callbacks that are
+        # scheduled before it does are still run.
+        if self._thread.is_alive():
+            asyncio.run_coroutine_threadsafe(drain(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+
+        self._loop.close()
@@ -0,0 +1,142 @@
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import glob
+import json
+import os
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Set
+
+# The files that are analysed when a directory is specified.
+MEDIA_EXTENSIONS = {
+    ".aac",
+    ".ac3",
+    ".avi",
+    ".flac",
+    ".flv",
+    ".m2ts",
+    ".m4a",
+    ".m4v",
+    ".mka",
+    ".mkv",
+    ".mov",
+    ".mp3",
+    ".mp4",
+    ".mpg",
+    ".mts",
+    ".mxf",
+    ".ogg",
+    ".opus",
+    ".ts",
+    ".wav",
+    ".webm",
+}
+
+SUMMARY_FILE = "batch_summary.json"
+
+
+def expand_inputs(inputs: Sequence[str]) -> List[str]:
+    """
+    Turn a list of files, glob patterns and directories into a list of files.
+    Directories are searched recursively for files with a media file extension.
+    """
+    file_paths = []
+
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, files in sorted(os.walk(item)):
+                file_paths.extend(
+                    os.path.join(root, name)
+                    for name in sorted(files)
+                    if Path(name).suffix.lower() in MEDIA_EXTENSIONS
+                )
+        elif glob.has_magic(item):
+            file_paths.extend(
+                path for path in sorted(glob.glob(item, recursive=True)) if os.path.isfile(path)
+            )
+        else:
+            file_paths.append(item)
+
+    # Remove duplicates while preserving the order.
+    return list(dict.fromkeys(file_paths))
+
+
+def duplicate_names(file_paths: Sequence[str]) -> Set[str]:
+    """The filenames that more than one of `file_paths` share."""
+    counts = Counter(Path(file_path).name for file_path in file_paths)
+    return {name for name, count in counts.items() if count > 1}
+
+
+def _analyse(analyse: Callable, file_path: str, args, disambiguate: bool) -> Dict:
+    try:
+        # Progress bars of concurrent files would overwrite each other, but
+        # JSON lines can be told apart by their file.
+        data = analyse(
+            file_path,
+            args,
+            show_progress=args.progress == "jsonl",
+            disambiguate=disambiguate,
+        )
+    except Exception as e:
+        return {"file": file_path, "status": "failed", "error": f"{type(e).__name__}: {e}"}
+
+    return {"file": file_path, "status": "succeeded", "data": data}
+
+
+def run_batch(
+    file_paths: Sequence[str],
+    args,
+    analyse: Callable,
+    summary_path: Optional[Path] = None,
+) -> Dict:
+    """
+    Analyse many files over a process pool.
+
+    `args.jobs` caps the number of files that are analysed at once, and
+    therefore the number of FFprobe processes that run concurrently. Each
+    file still gets its own [filename] output folder, which is followed by a
+    hash of the file's folder if other files have the same name. A combined
+    summary is saved to `summary_path`, which is batch_summary.json in
+    --output-root by default.
+    """
+    if summary_path is None:
+        summary_path = Path(args.output_root, SUMMARY_FILE)
+
+    jobs = max(1, min(args.jobs, len(file_paths)))
+    duplicates = duplicate_names(file_paths)
+    print(f"Analysing {len(file_paths)} files, {jobs} at a time.")
+
+    results = {}
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(
+                _analyse, analyse, file_path, args, Path(file_path).name in duplicates
+            ): file_path
+            for file_path in file_paths
+        }
+
+        for future in as_completed(futures):
+            result = future.result()
+            results[result["file"]] = result
+            print(f"[{len(results)}/{len(file_paths)}] {result['status']}: {result['file']}")
+
+    ordered_results = [results[file_path] for file_path in file_paths]
+    failed = [result for result in ordered_results if result["status"] == "failed"]
+
+    summary = {
+        "files": len(file_paths),
+        "succeeded": len(file_paths) - len(failed),
+        "failed": len(failed),
+        "results": ordered_results,
+    }
+
+    os.makedirs(Path(summary_path).parent, exist_ok=True)
+    with open(summary_path, "w") as f:
+        json.dump(summary, f, indent=4)
+
+    for result in failed:
+        print(f"Failed to analyse {result['file']}: {result['error']}")
+
+    print(f"Done! Check out '{summary_path}' for a summary of every file.")
+
+    return summary
@@ -0,0 +1,461 @@
+from argparse import ArgumentParser, RawTextHelpFormatter
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import io
+import itertools
+import json
+import multiprocessing
+import os
+from pathlib import Path
+import platform
+import tempfile
+import time
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence
+
+from packet_reader import order_fields
+from profiling import peak_rss_mb
+
+import numpy as np
+
+DEFAULT_BASELINE_FILE = "benchmark_baseline.json"
+
+# The packet fields that each stage reads, as main.py requests them.
+STAGE_FIELDS = {
+    "parse": ("pts_time", "size"),
+    "bitrates": ("pts_time", "size"),
+    "bitrates-low-memory": ("pts_time", "size"),
+    "gop": ("pts_time", "size", "flags"),
+}
+
+FIELD_FORMATS = {
+    "stream_index": "%d",
+    "pts_time": "%.6f",
+    "dts_time": "%.6f",
+    "size": "%d",
+    "pos": "%d",
+    "flags": "%s",
+}
+
+
+class StreamConfig(NamedTuple):
+    """The shape of a synthetic video stream."""
+
+    fps: float = 24.0
+    gop_length: int = 48
+    # The number of B-frames between reference frames, which reorders PTS.
+    b_frames: int = 2
+    # Each frame interval varies randomly by up to this fraction (VFR).
+    vfr_jitter: float = 0.0
+    # Every `gap_interval` seconds, the timestamps jump forward by `gap_seconds`.
+    gap_interval: float = 0.0
+    gap_seconds: float = 0.5
+    # One packet in every `malformed_every` is output as a malformed line.
+    malformed_every: int = 0
+    seed: int = 0
+
+
+def _display_order(frame_indices: np.ndarray, gop_length: int, b_frames: int) -> np.ndarray:
+    """
+    The display index, within its GOP, of each frame in decode order.
+
+    Each GOP is an I-frame followed by groups of a reference frame and its
+    B-frames. The reference frame is decoded first but displayed last.
+    """
+    k = frame_indices % gop_length
+    group_size = b_frames + 1
+    # Position within the group of a reference frame and its B-frames.
+    j = np.where(k == 0, 0, (k - 1) % group_size)
+    group_start = k - j
+    # The final group of a GOP can be shorter.
+    group_size = np.minimum(group_size, gop_length - group_start)
+
+    return np.where(
+        k == 0, 0, np.where(j == 0, group_start + group_size - 1, group_start + j - 1)
+    )
+
+
+def iter_packet_csv(
+    packets: int,
+    fields: Sequence[str],
+    config: StreamConfig = StreamConfig(),
+    chunk_packets: int = 1 << 16,
+) -> Iterator[bytes]:
+    """
+    Generate FFprobe's CSV output for `packets` packets of a synthetic
+    stream, in decode order, in blocks of `chunk_packets` lines. The output
+    only depends on the arguments.
+    """
+    fields = order_fields(fields)
+    rng = np.random.default_rng(config.seed)
+    frame_duration = 1 / config.fps
+    field_formats = dict(FIELD_FORMATS)
+    if config.malformed_every:
+        # Sizes are formatted as strings so that some can be made malformed.
+        field_formats["size"] = "%s"
+    line_format = ",".join(field_formats[field] for field in fields) + "\n"
+
+    next_dts = 0.0
+    position = 0
+
+    for first in range(0, packets, chunk_packets):
+        count = min(chunk_packets, packets - first)
+        indices = np.arange(first, first + count)
+
+        intervals = np.full(count, frame_duration)
+        if config.vfr_jitter:
+            intervals *= 1 + config.vfr_jitter * rng.uniform(-1, 1, count)
+
+        # DTS starts B-frames' worth of frames before 0, as encoders do, so
+        # that PTS is never earlier than DTS.
+        dts = next_dts + np.concatenate(([0.0], np.cumsum(intervals[:-1])))
+        next_dts = float(dts[-1] + intervals[-1])
+
+        display = _display_order(indices, config.gop_length, config.b_frames)
+        pts = dts + (display - indices % config.gop_length) * frame_duration
+        dts = dts - config.b_frames * frame_duration
+
+        if config.gap_interval:
+            pts += config.gap_seconds * np.floor(np.maximum(pts, 0) / config.gap_interval)
+            dts += config.gap_seconds * np.floor(np.maximum(dts, 0) / config.gap_interval)
+
+        is_keyframe = indices % config.gop_length == 0
+        is_reference = (display == indices % config.gop_length + config.b_frames) | (
+            display == config.gop_length - 1
+        )
+        sizes = np.where(
+            is_keyframe,
+            rng.integers(100_000, 200_000, count),
+            np.where(
+                is_reference,
+                rng.integers(20_000, 60_000, count),
+                rng.integers(5_000, 20_000, count),
+            ),
+        )
+        positions = position + np.concatenate(([0], np.cumsum(sizes[:-1])))
+        position = int(positions[-1] + sizes[-1])
+
+        columns = {
+            "stream_index": np.zeros(count, dtype=np.int64),
+            "pts_time": pts,
+            "dts_time": dts,
+            "size": sizes,
+            "pos": positions,
+            "flags": np.where(is_keyframe, "K__", "___"),
+        }
+
+        values = [columns[field].tolist() for field in fields]
+
+        if config.malformed_every and "size" in fields:
+            size_values = values[fields.index("size")]
+            for i in np.flatnonzero(indices % config.malformed_every == 0).tolist():
+                size_values[i] = "corrupt"
+
+        # Formatting every line with one % operation is much faster than
+        # formatting them one by one.
+        yield ((line_format * count) % tuple(itertools.chain.from_iterable(zip(*values)))).encode()
+
+
+def write_packet_csv(
+    path: Path, packets: int, fields: Sequence[str], config: StreamConfig = StreamConfig()
+):
+    with open(path, "wb") as f:
+        for block in iter_packet_csv(packets, fields, config):
+            f.write(block)
+
+
+class FakePopen:
+    """
+    Stands in for the subprocess.Popen of FFprobe, with a file of CSV output
+    as its stdout.
+    """
+
+    def __init__(self, csv_path: Path):
+        self.stdout = open(csv_path, "rb")
+        self.returncode = None
+
+    def poll(self) -> Optional[int]:
+        return self.returncode
+
+    def wait(self, timeout=None) -> int:
+        self.stdout.close()
+        self.returncode = 0
+        return self.returncode
+
+
+def _run_stage(stage: str, csv_path: str, framerate: float) -> Dict:
+    """Run one stage in this (fresh) process and measure it."""
+    from calculate_bitrates import calculate_bitrates
+    from calculate_gop_bitrates import calculate_gop_bitrates
+    from gop_report import GOPReportWriter
+    from packet_reader import read_packets
+    from progress import NullProgress
+
+    rss_before = peak_rss_mb()
+    process = FakePopen(Path(csv_path))
+    progress = NullProgress()
+
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+
+    # The analysis prints a line per incomplete second, which is not under test.
+    with contextlib.redirect_stdout(io.StringIO()), tempfile.TemporaryDirectory() as report_dir:
+        if stage == "parse":
+            packets = read_packets(process.stdout, STAGE_FIELDS[stage])
+            items = len(packets)
+        elif stage in ("bitrates", "bitrates-low-memory"):
+            _, _, data = calculate_bitrates(
+                process,
+                progress,
+                0,
+                1,
+                use_dts=False,
+                output_unit="mbps",
+                low_memory=stage == "bitrates-low-memory",
+            )
+            items = data["total_packets"]
+        elif stage == "gop":
+            with GOPReportWriter(Path(report_dir)) as report_writer:
+                _, _, data = calculate_gop_bitrates(
+                    process, progress, 0, 1, framerate, report_writer, use_dts=False
+                )
+            items = data["total_packets"]
+        else:
+            raise ValueError(f"Unknown stage: {stage}")
+
+    wall_seconds = time.perf_counter() - start_wall
+    cpu_seconds = time.process_time() - start_cpu
+    process.wait()
+
+    return {
+        "wall_seconds": wall_seconds,
+        "cpu_seconds": cpu_seconds,
+        "packets_processed": items,
+        "packets_per_second": items / wall_seconds if wall_seconds else None,
+        "startup_rss_mb": rss_before,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run_benchmarks(
+    sizes: Sequence[int],
+    stages: Sequence[str],
+    config: StreamConfig = StreamConfig(),
+    repeat: int = 1,
+) -> List[Dict]:
+    """
+    Benchmark every stage at every size. The CSV for each size is generated
+    before any stage is timed. With `repeat`, the fastest run is kept.
+    """
+    results = []
+    # Each stage runs in a new process, so that peak RSS is not inherited.
+    context = multiprocessing.get_context("spawn")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for size in sizes:
+            csv_paths = {}
+
+            for fields in sorted({STAGE_FIELDS[stage] for stage in stages}):
+                csv_path = Path(temp_dir).joinpath(f"{size}_{'_'.join(fields)}.csv")
+                write_packet_csv(csv_path, size, fields, config)
+                csv_paths[fields] = csv_path
+
+            for stage in stages:
+                runs = []
+
+                for _ in range(repeat):
+                    with ProcessPoolExecutor(1, mp_context=context) as executor:
+                        runs.append(
+                            executor.submit(
+                                _run_stage,
+                                stage,
+                                str(csv_paths[STAGE_FIELDS[stage]]),
+                                config.fps,
+                            ).result()
+                        )
+
+                result = {
+                    "stage": stage,
+                    "packets": size,
+                    **min(runs, key=lambda run: run["wall_seconds"]),
+                }
+                results.append(result)
+                print(format_result(result))
+
+            for csv_path in csv_paths.values():
+                os.remove(csv_path)
+
+    return results
+
+
+def format_result(result: Dict) -> str:
+    peak_rss = result["peak_rss_mb"]
+    return (
+        f"{result['stage']:<20} {result['packets']:>11,} packets  "
+        f"{result['wall_seconds']:>8.3f}s  {result['packets_per_second'] or 0:>13,.0f} packets/s  "
+        f"peak RSS {'n/a' if peak_rss is None else f'{peak_rss:,.1f} MB'}"
+    )
+
+
+def compare_to_baseline(
+    results: Sequence[Dict], baseline: Dict, tolerance: float
+) -> List[str]:
+    """
+    Return a description of every result that is more than `tolerance`
+    slower, or uses more than `tolerance` more peak memory, than the baseline.
+    """
+    baseline_results = {
+        (result["stage"], result["packets"]): result for result in baseline["results"]
+    }
+    regressions = []
+
+    for result in results:
+        previous = baseline_results.get((result["stage"], result["packets"]))
+        if previous is None:
+            continue
+
+        label = f"{result['stage']} at {result['packets']:,} packets"
+
+        if result["packets_per_second"] < previous["packets_per_second"] * (1 - tolerance):
+            regressions.append(
+                f"{label}: {result['packets_per_second']:,.0f} packets/s, "
+                f"baseline {previous['packets_per_second']:,.0f} packets/s"
+            )
+
+        if (
+            result["peak_rss_mb"] is not None
+            and previous["peak_rss_mb"] is not None
+            and result["peak_rss_mb"] > previous["peak_rss_mb"] * (1 + tolerance)
+        ):
+            regressions.append(
+                f"{label}: peak RSS {result['peak_rss_mb']:,.1f} MB, "
+                f"baseline {previous['peak_rss_mb']:,.1f} MB"
+            )
+
+    return regressions
+
+
+def parse_benchmark_args(argv=None):
+    parser = ArgumentParser(
+        description="Benchmark packet parsing and the analysis stages on synthetic FFprobe output.",
+        formatter_class=RawTextHelpFormatter,
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[10_000, 100_000, 1_000_000],
+        help="The numbers of packets to benchmark. The default is 10000 100000 1000000.\n"
+        "Sizes up to 10^8 work, but the CSV is written to a temporary file first (about 3 GB at 10^8).",
+    )
+    parser.add_argument(
+        "--stages",
+        nargs="+",
+        choices=list(STAGE_FIELDS),
+        default=list(STAGE_FIELDS),
+        help="The stages to benchmark. By default, every stage is benchmarked.",
+    )
+    parser.add_argument("--fps", type=float, default=24.0)
+    parser.add_argument("--gop-length", type=int, default=48)
+    parser.add_argument("--b-frames", type=int, default=2)
+    parser.add_argument(
+        "--vfr-jitter",
+        type=float,
+        default=0.0,
+        help="Vary each frame interval randomly by up to this fraction.",
+    )
+    parser.add_argument(
+        "--gap-interval",
+        type=float,
+        default=0.0,
+        help="Make the timestamps jump forward by --gap-seconds every this many seconds.",
+    )
+    parser.add_argument("--gap-seconds", type=float, default=0.5)
+    parser.add_argument(
+        "--malformed-every",
+        type=int,
+        default=0,
+        help="Output one packet in every this many as a malformed line.",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=1,
+        help="Run each stage this many times and keep the fastest run.",
+    )
+    parser.add_argument(
+        "--baseline",
+        type=Path,
+        default=Path(DEFAULT_BASELINE_FILE),
+        help=f"The baseline to compare against, and to write with --save-baseline.\n"
+        f"The default is {DEFAULT_BASELINE_FILE}.",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Save the results as the new baseline instead of comparing against it.",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="The fraction by which throughput may drop, or peak RSS may rise,\n"
+        "before a result counts as a regression. The default is 0.2.",
+    )
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_benchmark_args()
+    config = StreamConfig(
+        fps=args.fps,
+        gop_length=args.gop_length,
+        b_frames=args.b_frames,
+        vfr_jitter=args.vfr_jitter,
+        gap_interval=args.gap_interval,
+        gap_seconds=args.gap_seconds,
+        malformed_every=args.malformed_every,
+        seed=args.seed,
+    )
+
+    results = run_benchmarks(args.sizes, args.stages, config, args.repeat)
+    report = {
+        "machine": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "cpu_count": os.cpu_count(),
+        },
+        "config": config._asdict(),
+        "results": results,
+    }
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=4)
+        print(f"Saved the baseline to {args.baseline}")
+        return
+
+    if not args.baseline.is_file():
+        print(f"No baseline at {args.baseline}. Use --save-baseline to create one.")
+        return
+
+    with open(args.baseline, "r") as f:
+        baseline = json.load(f)
+
+    if baseline["config"] != report["config"]:
+        print("Warning: The baseline was recorded with a different stream configuration.")
+
+    regressions = compare_to_baseline(results, baseline, args.tolerance)
+
+    if regressions:
+        print("Regressions compared to the baseline:")
+        for regression in regressions:
+            print(f"- {regression}")
+        raise SystemExit(1)
+
+    print("No regressions compared to the baseline.")
+
+
+if __name__ == "__main__":
+    main()
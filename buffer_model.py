@@ -0,0 +1,163 @@
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+# The most underflows and overflows that are listed individually in data.json.
+MAX_LISTED_EVENTS = 100
+
+
+class BufferLevels(NamedTuple):
+    """The decoder buffer, sampled just before each packet is removed from it."""
+
+    # The DTS of every packet, in ascending order.
+    times: np.ndarray
+    sizes: np.ndarray  # Bits
+    fullness: np.ndarray  # Bits
+
+
+def simulate_buffer(
+    times: np.ndarray,
+    sizes: np.ndarray,
+    maxrate: float,
+    bufsize: float,
+    initial_fullness: float,
+) -> BufferLevels:
+    """
+    Run packets through a leaky bucket decoder model, as used by the VBV and
+    HRD. Bits arrive at `maxrate` bits per second until the buffer holds
+    `bufsize` bits, and each packet is removed in one go at its DTS.
+
+    `times` must be sorted in ascending order and `sizes` must be in bytes.
+    The buffer starts `initial_fullness` bits full at the first DTS.
+
+    Without the size limit, the fullness before packet i would be the initial
+    fullness plus G_i, the bits that have arrived less the bits removed
+    before it. Each time the buffer fills up, the bits that cannot arrive
+    lower the level of every later packet by the same amount, so the fullness
+    is G_i + min(initial_fullness, bufsize - max(G_0..G_i)), which is one
+    cumulative sum and one running maximum rather than a loop over packets.
+    """
+    if maxrate <= 0 or bufsize <= 0:
+        raise ValueError(
+            f"maxrate and bufsize must be positive, got {maxrate} and {bufsize}"
+        )
+
+    if not 0 <= initial_fullness <= bufsize:
+        raise ValueError(
+            f"initial_fullness must be between 0 and bufsize, got {initial_fullness}"
+        )
+
+    bits = sizes.astype(np.float64) * 8
+    unbounded_fullness = unbounded_buffer_fullness(times, bits, maxrate)
+    fullness = unbounded_fullness + np.minimum(
+        initial_fullness, bufsize - np.maximum.accumulate(unbounded_fullness)
+    )
+
+    return BufferLevels(times, bits, fullness)
+
+
+def unbounded_buffer_fullness(
+    times: np.ndarray, bits: np.ndarray, maxrate: float
+) -> np.ndarray:
+    """G_i: the bits that arrive by the DTS of packet i, less the bits of the packets before it."""
+    removed_before = np.zeros(len(bits))
+    np.cumsum(bits[:-1], out=removed_before[1:])
+    return (times - times[0]) * maxrate - removed_before
+
+
+def minimum_bufsize(
+    times: np.ndarray, sizes: np.ndarray, maxrate: float, initial_fraction: float
+) -> float:
+    """
+    The smallest buffer, in bits, that never underflows at `maxrate` when it
+    starts `initial_fraction` full.
+
+    Packet i is in the buffer in time if G_i + min(f * B, B - M_i) >= s_i,
+    where M_i is the running maximum of G, i.e. if B >= M_i - G_i + s_i and
+    B >= (s_i - G_i) / f. The smallest B is the largest of these bounds.
+    """
+    if not 0 < initial_fraction <= 1:
+        raise ValueError(
+            f"initial_fraction must be greater than 0 and at most 1, got {initial_fraction}"
+        )
+
+    bits = sizes.astype(np.float64) * 8
+    unbounded_fullness = unbounded_buffer_fullness(times, bits, maxrate)
+    running_max = np.maximum.accumulate(unbounded_fullness)
+
+    return float(
+        max(
+            np.max(running_max - unbounded_fullness + bits),
+            np.max(bits - unbounded_fullness) / initial_fraction,
+        )
+    )
+
+
+def analyse_buffer(
+    times: np.ndarray,
+    sizes: np.ndarray,
+    maxrate_kbps: float,
+    bufsize_kbits: Optional[float],
+    initial_fraction: float,
+) -> Tuple[Dict, Optional[BufferLevels]]:
+    """
+    Check the packets against a maxrate and bufsize in kbit/s and kbit, as in
+    FFmpeg's -maxrate and -bufsize. `times` are DTS and are sorted here.
+
+    Reports the smallest bufsize that never underflows at `maxrate_kbps` and,
+    if `bufsize_kbits` is given, every underflow (a packet that has not fully
+    arrived by its DTS) and overflow (the buffer filling up, which a constant
+    bitrate stream has to avoid by padding). Returns the data
+    for data.json and the simulated buffer, which is None if `bufsize_kbits`
+    is not given.
+    """
+    has_time = ~np.isnan(times)
+    times = times[has_time]
+    sizes = sizes[has_time]
+
+    if not len(times):
+        raise ValueError("No packets with a DTS found")
+
+    order = np.argsort(times, kind="stable")
+    times = times[order]
+    sizes = sizes[order]
+    maxrate = maxrate_kbps * 1000
+
+    data = {
+        "maxrate_kbps": maxrate_kbps,
+        "initial_fullness": initial_fraction,
+        "min_bufsize_kbits": minimum_bufsize(times, sizes, maxrate, initial_fraction)
+        / 1000,
+    }
+
+    if bufsize_kbits is None:
+        return data, None
+
+    bufsize = bufsize_kbits * 1000
+    levels = simulate_buffer(times, sizes, maxrate, bufsize, initial_fraction * bufsize)
+    # A tolerance keeps rounding in the cumulative sums from being reported.
+    tolerance = 1e-9 * max(bufsize, float(levels.sizes.sum()))
+    underflows = np.flatnonzero(levels.fullness < levels.sizes - tolerance)
+    overflows = np.flatnonzero(levels.fullness >= bufsize - tolerance)
+
+    data.update(
+        {
+            "bufsize_kbits": bufsize_kbits,
+            "compliant": not len(underflows),
+            "min_fullness_kbits": float(levels.fullness.min()) / 1000,
+            "mean_fullness_kbits": float(levels.fullness.mean()) / 1000,
+            "underflow_count": len(underflows),
+            "underflows": [
+                {
+                    "dts": float(levels.times[i]),
+                    "packet_kbits": float(levels.sizes[i]) / 1000,
+                    "shortfall_kbits": float(levels.sizes[i] - levels.fullness[i]) / 1000,
+                }
+                for i in underflows[:MAX_LISTED_EVENTS]
+            ],
+            "overflow_count": len(overflows),
+            "overflow_dts": levels.times[overflows[:MAX_LISTED_EVENTS]].tolist(),
+        }
+    )
+
+    return data, levels
@@ -1,15 +1,26 @@
-import io
 import subprocess
-from typing import Tuple, List, Dict, NamedTuple
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
 
-from utils import process_timestamp_and_size
+from packet_reader import PacketColumns, iter_packet_chunks, read_packets
+from profiling import stage
 
 import numpy as np
 
+UNIT_MULTIPLIERS = {
+    "kbps": 0.001,
+    "mbps": 0.000001,
+    "gbps": 0.000000001,
+}
 
-class Packet(NamedTuple):
-    timestamp: float
-    size: int
+
+class SecondBuckets(NamedTuple):
+    """Per-second totals, one element per second that contains at least one packet."""
+
+    seconds: np.ndarray
+    bytes: np.ndarray
+    packets: np.ndarray
+    first_timestamps: np.ndarray
+    last_timestamps: np.ndarray
 
 
 def validate_parameters(
@@ -27,6 +38,271 @@ def validate_parameters(
         )
 
 
+def validate_output_unit(output_unit: str) -> None:
+    if output_unit not in UNIT_MULTIPLIERS:
+        raise ValueError(
+            f"Invalid output unit '{output_unit}'. Must be one of: {set(UNIT_MULTIPLIERS)}"
+        )
+
+
+def bucket_by_second(timestamps: np.ndarray, sizes: np.ndarray) -> SecondBuckets:
+    """Group packets by second. `timestamps` must be sorted in ascending order."""
+    # np.trunc matches int(), which rounds negative timestamps towards zero.
+    seconds = np.trunc(timestamps).astype(np.int64)
+    unique_seconds, first_indices, packet_counts = np.unique(
+        seconds, return_index=True, return_counts=True
+    )
+    last_indices = first_indices + packet_counts - 1
+
+    return SecondBuckets(
+        seconds=unique_seconds,
+        bytes=np.add.reduceat(sizes.astype(np.int64), first_indices),
+        packets=packet_counts,
+        first_timestamps=timestamps[first_indices],
+        last_timestamps=timestamps[last_indices],
+    )
+
+
+# The most seconds that StreamingSecondAggregator keeps in dense arrays. Seconds
+# further away, e.g. from an MPEG-TS timestamp wrap, are kept in a dict.
+MAX_DENSE_SECONDS = 1 << 18
+
+
+class StreamingSecondAggregator:
+    """
+    Builds up per-second totals chunk by chunk, using memory proportional to
+    the number of seconds rather than the number of packets.
+
+    Packets are held in a reorder buffer until the newest timestamp seen is
+    more than `reorder_window` seconds ahead of them, which absorbs the
+    out-of-order PTS of B-frames. The totals of every second before
+    `settled_until` will not change unless a packet arrives later than that.
+
+    The totals are kept in arrays indexed by second, which span at most
+    MAX_DENSE_SECONDS, so one outlier timestamp cannot make them huge.
+    Seconds outside that span are kept in a dict instead.
+    """
+
+    def __init__(self, reorder_window: float = 2.0):
+        if reorder_window < 0:
+            raise ValueError(f"reorder_window must not be negative, got {reorder_window}")
+
+        self.reorder_window = reorder_window
+        self.late_packets = 0
+        # Running totals of every committed packet, including discarded seconds.
+        self.total_packets = 0
+        self.total_bytes = 0
+        self._newest_timestamp = -np.inf
+        self._committed_until = -np.inf
+        self._pending_timestamps = np.empty(0, dtype=np.float64)
+        self._pending_sizes = np.empty(0, dtype=np.int64)
+        # Per-second state, indexed by second - self._first_second.
+        self._first_second = 0
+        self._bytes = np.zeros(0, dtype=np.int64)
+        self._packets = np.zeros(0, dtype=np.int64)
+        self._first_timestamps = np.zeros(0, dtype=np.float64)
+        self._last_timestamps = np.zeros(0, dtype=np.float64)
+        # Seconds outside the arrays, mapped to [bytes, packets, first, last].
+        self._outliers: Dict[int, List] = {}
+
+    @property
+    def settled_until(self) -> float:
+        return self._committed_until
+
+    def _grow(self, first_second: int, last_second: int):
+        if not len(self._bytes):
+            self._first_second = first_second
+
+        new_first = min(self._first_second, first_second)
+        new_length = max(self._first_second + len(self._bytes), last_second + 1) - new_first
+
+        if new_first == self._first_second and new_length <= len(self._bytes):
+            return
+
+        # Grow geometrically so that appending seconds is amortised O(1).
+        if new_first == self._first_second:
+            new_length = max(new_length, min(2 * len(self._bytes), MAX_DENSE_SECONDS))
+
+        offset = self._first_second - new_first
+
+        def grow(array, fill):
+            grown = np.full(new_length, fill, dtype=array.dtype)
+            grown[offset : offset + len(array)] = array
+            return grown
+
+        self._bytes = grow(self._bytes, 0)
+        self._packets = grow(self._packets, 0)
+        self._first_timestamps = grow(self._first_timestamps, np.inf)
+        self._last_timestamps = grow(self._last_timestamps, -np.inf)
+        self._first_second = new_first
+
+    def _dense_range(self, seconds: np.ndarray) -> np.ndarray:
+        # Which of `seconds` can be added to the arrays without them spanning
+        # more than MAX_DENSE_SECONDS.
+        if len(self._bytes):
+            first = self._first_second
+            last = first + len(self._bytes) - 1
+        else:
+            # The median is not thrown off by a few outliers.
+            first = last = int(np.median(seconds))
+
+        forward_limit = first + MAX_DENSE_SECONDS - 1
+        newest = max(last, int(seconds[seconds <= forward_limit].max(initial=last)))
+
+        return (
+            (seconds > newest - MAX_DENSE_SECONDS)
+            & (seconds <= forward_limit)
+            & ~np.isin(seconds, list(self._outliers))
+        )
+
+    def _store(self, buckets: SecondBuckets):
+        is_dense = self._dense_range(buckets.seconds)
+
+        if is_dense.any():
+            dense_seconds = buckets.seconds[is_dense]
+            self._grow(int(dense_seconds[0]), int(dense_seconds[-1]))
+
+            # Seconds are unique within the buckets, so fancy indexing is safe.
+            indices = dense_seconds - self._first_second
+            self._bytes[indices] += buckets.bytes[is_dense]
+            self._packets[indices] += buckets.packets[is_dense]
+            self._first_timestamps[indices] = np.minimum(
+                self._first_timestamps[indices], buckets.first_timestamps[is_dense]
+            )
+            self._last_timestamps[indices] = np.maximum(
+                self._last_timestamps[indices], buckets.last_timestamps[is_dense]
+            )
+
+        for second, size, packets, first, last in zip(
+            *(column[~is_dense].tolist() for column in buckets)
+        ):
+            totals = self._outliers.setdefault(second, [0, 0, np.inf, -np.inf])
+            totals[0] += size
+            totals[1] += packets
+            totals[2] = min(totals[2], first)
+            totals[3] = max(totals[3], last)
+
+    def _commit(self, timestamps: np.ndarray, sizes: np.ndarray):
+        if not len(timestamps):
+            return
+
+        self.late_packets += int(np.count_nonzero(timestamps < self._committed_until))
+        self.total_packets += len(timestamps)
+        self.total_bytes += int(sizes.sum())
+
+        order = np.argsort(timestamps, kind="stable")
+        self._store(bucket_by_second(timestamps[order], sizes[order]))
+
+    def add(self, timestamps: np.ndarray, sizes: np.ndarray):
+        """Add packets in any order. Timestamps must not be NaN."""
+        if not len(timestamps):
+            return
+
+        self._newest_timestamp = max(self._newest_timestamp, float(timestamps.max()))
+        watermark = self._newest_timestamp - self.reorder_window
+
+        timestamps = np.concatenate((self._pending_timestamps, timestamps))
+        sizes = np.concatenate((self._pending_sizes, sizes))
+        is_ready = timestamps < watermark
+
+        self._commit(timestamps[is_ready], sizes[is_ready])
+        self._committed_until = max(self._committed_until, watermark)
+        self._pending_timestamps = timestamps[~is_ready]
+        self._pending_sizes = sizes[~is_ready]
+
+    def flush(self):
+        """Commit every packet in the reorder buffer."""
+        self._commit(self._pending_timestamps, self._pending_sizes)
+        self._committed_until = max(self._committed_until, self._newest_timestamp)
+        self._pending_timestamps = self._pending_timestamps[:0]
+        self._pending_sizes = self._pending_sizes[:0]
+
+    def discard_before(self, second: int):
+        """Forget the totals of every second before `second`, to bound memory."""
+        for outlier in [outlier for outlier in self._outliers if outlier < second]:
+            del self._outliers[outlier]
+
+        if not len(self._bytes) or second <= self._first_second:
+            return
+
+        offset = min(second - self._first_second, len(self._bytes))
+        self._bytes = self._bytes[offset:]
+        self._packets = self._packets[offset:]
+        self._first_timestamps = self._first_timestamps[offset:]
+        self._last_timestamps = self._last_timestamps[offset:]
+        self._first_second += offset
+
+    def get_state(self) -> Dict:
+        """
+        The committed totals as a JSON-serialisable dict. Packets in the
+        reorder buffer are not included, so a restored aggregator should be
+        given every packet from `settled_until` onwards again.
+        """
+        buckets = self.buckets()
+
+        return {
+            "settled_until": self._committed_until,
+            "late_packets": self.late_packets,
+            "total_packets": self.total_packets,
+            "total_bytes": self.total_bytes,
+            "seconds": buckets.seconds.tolist(),
+            "bytes": buckets.bytes.tolist(),
+            "packets": buckets.packets.tolist(),
+            "first_timestamps": buckets.first_timestamps.tolist(),
+            "last_timestamps": buckets.last_timestamps.tolist(),
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict, reorder_window: float = 2.0):
+        aggregator = cls(reorder_window)
+        aggregator.late_packets = state["late_packets"]
+        aggregator.total_packets = state["total_packets"]
+        aggregator.total_bytes = state["total_bytes"]
+        aggregator._committed_until = state["settled_until"]
+        aggregator._newest_timestamp = state["settled_until"] + reorder_window
+
+        if state["seconds"]:
+            aggregator._store(
+                SecondBuckets(
+                    seconds=np.array(state["seconds"], dtype=np.int64),
+                    bytes=np.array(state["bytes"], dtype=np.int64),
+                    packets=np.array(state["packets"], dtype=np.int64),
+                    first_timestamps=np.array(state["first_timestamps"], dtype=np.float64),
+                    last_timestamps=np.array(state["last_timestamps"], dtype=np.float64),
+                )
+            )
+
+        return aggregator
+
+    def buckets(self) -> SecondBuckets:
+        """The totals of every committed second that contains at least one packet."""
+        has_packets = self._packets > 0
+        buckets = SecondBuckets(
+            seconds=np.flatnonzero(has_packets) + self._first_second,
+            bytes=self._bytes[has_packets],
+            packets=self._packets[has_packets],
+            first_timestamps=self._first_timestamps[has_packets],
+            last_timestamps=self._last_timestamps[has_packets],
+        )
+
+        if not self._outliers:
+            return buckets
+
+        seconds, totals = zip(*sorted(self._outliers.items()))
+        outliers = SecondBuckets(
+            np.array(seconds, dtype=np.int64),
+            *(np.array(column) for column in zip(*totals)),
+        )
+        order = np.argsort(np.concatenate((buckets.seconds, outliers.seconds)))
+
+        return SecondBuckets(
+            *(
+                np.concatenate((dense, sparse))[order]
+                for dense, sparse in zip(buckets, outliers)
+            )
+        )
+
+
 def calculate_bitrates(
     process: subprocess.Popen,
     progress_bar,
@@ -36,134 +312,271 @@ def calculate_bitrates(
     output_unit: str,
     min_coverage_seconds: float = 0.9,
     max_gap_seconds: float = 0.1,
+    low_memory: bool = False,
+    on_buckets: Optional[Callable[[SecondBuckets], None]] = None,
 ) -> Tuple[List[int], List[float], Dict]:
     """
     Calculate bitrates from packet timestamps and sizes.
+
+    If `low_memory` is true, packets are aggregated as they are read instead of
+    being kept in memory, which gives the same results in O(seconds) memory.
+    `on_buckets`, if given, is called with the per-second totals.
     """
     if not process or not hasattr(process, "stdout"):
         raise ValueError("Invalid process object provided")
 
-    valid_units = {"kbps", "mbps", "gbps"}
-    if output_unit not in valid_units:
-        raise ValueError(
-            f"Invalid output unit '{output_unit}'. Must be one of: {valid_units}"
-        )
-
+    validate_output_unit(output_unit)
     validate_parameters(min_coverage_seconds, max_gap_seconds)
 
-    unit_multipliers = {
-        "kbps": 0.001,
-        "mbps": 0.000001,
-        "gbps": 0.000000001,
-    }
+    timestamp_field = "dts_time" if use_dts else "pts_time"
+    # Packets are only read once, so progress is reported against the file's
+    # duration using the furthest timestamp seen so far.
+    furthest_timestamp = 0.0
 
-    packets: List[Packet] = []
-    packets_processed = 0
+    def report_progress(chunk: PacketColumns):
+        nonlocal furthest_timestamp
+        if len(chunk):
+            furthest_timestamp = max(
+                furthest_timestamp, float(np.nanmax(chunk[timestamp_field], initial=0))
+            )
+            progress_bar.update(task_1, completed=furthest_timestamp)
+
+    if low_memory:
+        return _calculate_bitrates_streaming(
+            process,
+            progress_bar,
+            task_1,
+            task_2,
+            use_dts,
+            output_unit,
+            min_coverage_seconds,
+            max_gap_seconds,
+            on_buckets,
+        )
+
+    packets = read_packets(
+        process.stdout, (timestamp_field, "size"), on_chunk=report_progress
+    )
+    progress_bar.update(task_1, total=furthest_timestamp, completed=furthest_timestamp)
+
+    return calculate_bitrates_from_packets(
+        packets[timestamp_field],
+        packets["size"],
+        packets.rejection_reasons,
+        use_dts,
+        output_unit,
+        min_coverage_seconds,
+        max_gap_seconds,
+        progress_bar=progress_bar,
+        task=task_2,
+        on_buckets=on_buckets,
+    )
+
+
+def _calculate_bitrates_streaming(
+    process: subprocess.Popen,
+    progress_bar,
+    task_1,
+    task_2,
+    use_dts: bool,
+    output_unit: str,
+    min_coverage_seconds: float,
+    max_gap_seconds: float,
+    on_buckets: Optional[Callable[[SecondBuckets], None]],
+) -> Tuple[List[int], List[float], Dict]:
+    timestamp_field = "dts_time" if use_dts else "pts_time"
+    aggregator = StreamingSecondAggregator()
     rejection_reasons: Dict[str, int] = {}
-    total_bytes = 0
+    furthest_timestamp = 0.0
 
-    for line in io.TextIOWrapper(process.stdout, encoding="utf-8"):
-        if not line.strip():
-            continue
+    for chunk in iter_packet_chunks(process.stdout, (timestamp_field, "size")):
+        for reason, count in chunk.rejection_reasons.items():
+            rejection_reasons[reason] = rejection_reasons.get(reason, 0) + count
 
-        result = process_timestamp_and_size(line.strip().split(",", 2))
+        timestamps = chunk[timestamp_field]
+        sizes = chunk["size"]
 
-        if not result:
-            rejection_reasons["invalid format"] = (
-                rejection_reasons.get("invalid format", 0) + 1
-            )
-            continue
+        # Packets with a timestamp of N/A cannot be assigned to a second.
+        has_timestamp = ~np.isnan(timestamps)
+        if not has_timestamp.all():
+            rejection_reasons["invalid format"] = rejection_reasons.get(
+                "invalid format", 0
+            ) + int(np.count_nonzero(~has_timestamp))
+            timestamps = timestamps[has_timestamp]
+            sizes = sizes[has_timestamp]
+
+        with stage("aggregate seconds", len(timestamps)):
+            aggregator.add(timestamps, sizes)
+
+        if len(timestamps):
+            furthest_timestamp = max(furthest_timestamp, float(timestamps.max()))
+            progress_bar.update(task_1, completed=furthest_timestamp)
+
+    with stage("aggregate seconds"):
+        aggregator.flush()
+        buckets = aggregator.buckets()
 
-        timestamp, packet_size = result
-        total_bytes += packet_size
-        packets.append(Packet(timestamp, packet_size))
-        packets_processed += 1
-        progress_bar.update(task_1, completed=packets_processed)
+    progress_bar.update(task_1, total=furthest_timestamp, completed=furthest_timestamp)
 
-    if not packets:
+    if not len(buckets.seconds):
         reasons = ", ".join(f"{k}: {v}" for k, v in rejection_reasons.items())
         raise ValueError(f"No valid packets found. Rejection reasons: {reasons}")
 
+    progress_bar.update(task_2, total=1, completed=1)
+
+    if on_buckets is not None:
+        on_buckets(buckets)
+
+    with stage("summarise seconds", len(buckets.seconds)):
+        return summarise_seconds(
+            buckets,
+            rejection_reasons,
+            use_dts,
+            output_unit,
+            min_coverage_seconds,
+            max_gap_seconds,
+        )
+
+
+def calculate_bitrates_from_packets(
+    timestamps: np.ndarray,
+    sizes: np.ndarray,
+    rejection_reasons: Dict[str, int],
+    use_dts: bool,
+    output_unit: str,
+    min_coverage_seconds: float = 0.9,
+    max_gap_seconds: float = 0.1,
+    progress_bar=None,
+    task=None,
+    on_buckets: Optional[Callable[[SecondBuckets], None]] = None,
+) -> Tuple[List[int], List[float], Dict]:
+    """
+    Calculate bitrates from arrays of packet timestamps and sizes.
+    `on_buckets`, if given, is called with the per-second totals.
+    """
+    validate_output_unit(output_unit)
+    validate_parameters(min_coverage_seconds, max_gap_seconds)
+
+    rejection_reasons = dict(rejection_reasons)
+
+    # Packets with a timestamp of N/A cannot be assigned to a second.
+    has_timestamp = ~np.isnan(timestamps)
+    if not has_timestamp.all():
+        rejection_reasons["invalid format"] = rejection_reasons.get(
+            "invalid format", 0
+        ) + int(np.count_nonzero(~has_timestamp))
+        timestamps = timestamps[has_timestamp]
+        sizes = sizes[has_timestamp]
+
+    if not len(timestamps):
+        reasons = ", ".join(f"{k}: {v}" for k, v in rejection_reasons.items())
+        raise ValueError(f"No valid packets found. Rejection reasons: {reasons}")
+
+    if progress_bar is not None:
+        progress_bar.update(task, total=len(timestamps))
+
     # Sort timestamps in ascending order
-    packets.sort(key=lambda x: x.timestamp)
-    min_timestamp = packets[0].timestamp
-    max_timestamp = packets[-1].timestamp
-
-    # Group packets by second
-    bytes_per_second = {}
-    packets_per_second = {}
-    timestamp_bounds_per_second = {}
-
-    packets_processed = 0
-
-    for packet in packets:
-        second = int(packet.timestamp)
-        bytes_per_second[second] = bytes_per_second.get(second, 0) + packet.size
-        packets_per_second[second] = packets_per_second.get(second, 0) + 1
-
-        if second not in timestamp_bounds_per_second:
-            timestamp_bounds_per_second[second] = {
-                "min": packet.timestamp,
-                "max": packet.timestamp,
-            }
-        else:
-            timestamp_bounds_per_second[second]["max"] = packet.timestamp
+    with stage("sort packets", len(timestamps)):
+        order = np.argsort(timestamps, kind="stable")
+        timestamps = timestamps[order]
+        sizes = sizes[order]
+
+    with stage("aggregate seconds", len(timestamps)):
+        buckets = bucket_by_second(timestamps, sizes)
+
+    if progress_bar is not None:
+        progress_bar.update(task, completed=len(timestamps))
+
+    if on_buckets is not None:
+        on_buckets(buckets)
+
+    with stage("summarise seconds", len(buckets.seconds)):
+        return summarise_seconds(
+            buckets,
+            rejection_reasons,
+            use_dts,
+            output_unit,
+            min_coverage_seconds,
+            max_gap_seconds,
+        )
+
 
-        packets_processed += 1
-        progress_bar.update(task_2, completed=packets_processed)
+def find_complete_seconds(
+    buckets: SecondBuckets,
+    min_coverage_seconds: float = 0.9,
+    max_gap_seconds: float = 0.1,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Return a mask of the complete seconds, along with the coverage of every
+    second but the last and the gap between each second and the next.
+
+    The final second is never complete because there is no following second
+    to check the gap against.
+    """
+    coverage = np.abs(buckets.last_timestamps - buckets.first_timestamps)[:-1]
+    gap = np.abs(buckets.first_timestamps[1:] - buckets.last_timestamps[:-1])
+    is_complete = np.zeros(len(buckets.seconds), dtype=bool)
+    is_complete[:-1] = (coverage >= min_coverage_seconds) & (gap < max_gap_seconds)
+
+    return is_complete, coverage, gap
+
+
+def summarise_seconds(
+    buckets: SecondBuckets,
+    rejection_reasons: Dict[str, int],
+    use_dts: bool,
+    output_unit: str,
+    min_coverage_seconds: float = 0.9,
+    max_gap_seconds: float = 0.1,
+) -> Tuple[List[int], List[float], Dict]:
+    """
+    Work out which seconds are complete and calculate their bitrates.
+    """
+    min_timestamp = float(buckets.first_timestamps[0])
+    max_timestamp = float(buckets.last_timestamps[-1])
+    total_packets = int(buckets.packets.sum())
+    total_bytes = int(buckets.bytes.sum())
 
     duration = int(max_timestamp) - int(min_timestamp)
     # Round up to the next integer
     if max_timestamp > int(max_timestamp):
         duration += 1
 
-    # Identify complete seconds
-    complete_seconds = set()
-    incomplete_reasons = {}
-
-    all_seconds = sorted(bytes_per_second.keys())
-    for i in range(len(all_seconds) - 1):
-        current_second = all_seconds[i]
-        next_second = all_seconds[i + 1]
+    is_complete, coverage, gap = find_complete_seconds(
+        buckets, min_coverage_seconds, max_gap_seconds
+    )
 
-        curr_bounds = timestamp_bounds_per_second[current_second]
-        next_bounds = timestamp_bounds_per_second[next_second]
-
-        coverage = abs(curr_bounds["max"] - curr_bounds["min"])
-        gap = abs(next_bounds["min"] - curr_bounds["max"])
+    incomplete_reasons = {}
 
-        if coverage >= min_coverage_seconds and gap < max_gap_seconds:
-            complete_seconds.add(current_second)
+    for i in np.flatnonzero(~is_complete[:-1]):
+        print(f"{buckets.first_timestamps[i + 1]} to {buckets.last_timestamps[i + 1]}")
+        if coverage[i] < min_coverage_seconds:
+            incomplete_reasons[int(buckets.seconds[i])] = (
+                f"insufficient coverage: {coverage[i]:.3f}s"
+            )
         else:
-            print(f"{next_bounds["min"]} to {next_bounds["max"]}")
-            if coverage < min_coverage_seconds:
-                incomplete_reasons[current_second] = (
-                    f"insufficient coverage: {coverage:.3f}s"
-                )
-            else:
-                incomplete_reasons[current_second] = f"gap too large: {gap:.3f}s"
+            incomplete_reasons[int(buckets.seconds[i])] = (
+                f"gap too large: {gap[i]:.3f}s"
+            )
 
-    if not complete_seconds:
+    if not is_complete.any():
         reasons = "\n".join(f"Second {s}: {r}" for s, r in incomplete_reasons.items())
         raise ValueError(
             "No complete seconds found for bitrate calculation.\n"
-            f"Total seconds: {len(all_seconds)}\n"
+            f"Total seconds: {len(buckets.seconds)}\n"
             f"Time range: {min_timestamp:.3f}s to {max_timestamp:.3f}s\n"
-            f"Total packets: {len(packets)}\n"
+            f"Total packets: {total_packets}\n"
             f"Reasons:\n{reasons}"
         )
 
-    complete_seconds_list = sorted(complete_seconds)
-    x_axis_values = complete_seconds_list
-
-    bitrates = []
-    for second in complete_seconds_list:
-        bytes_this_second = bytes_per_second[second]
-        bitrate = (bytes_this_second * 8) * unit_multipliers[output_unit]
-        bitrates.append(bitrate)
+    x_axis_values = buckets.seconds[is_complete].tolist()
+    bitrates = (
+        (buckets.bytes[is_complete] * 8) * UNIT_MULTIPLIERS[output_unit]
+    ).tolist()
+    complete_packets_per_second = buckets.packets[is_complete]
 
-    num_complete_seconds = len(complete_seconds)
-    num_incomplete_seconds = duration - len(complete_seconds)
+    num_complete_seconds = len(x_axis_values)
+    num_incomplete_seconds = duration - num_complete_seconds
 
     data = {
         "mode": "DTS" if use_dts else "PTS",
@@ -172,16 +585,15 @@ def calculate_bitrates(
         f"max_bitrate_{output_unit}": np.max(bitrates),
         "complete_seconds": num_complete_seconds,
         "num_incomplete_seconds": num_incomplete_seconds,
-        "total_packets": len(packets),
+        "total_packets": total_packets,
         "total_bytes": total_bytes,
         "rejected_packets": sum(rejection_reasons.values()),
         "rejection_reasons": rejection_reasons,
         "incomplete_reasons": incomplete_reasons,
         "packets_per_second": {
-            "min": min(packets_per_second[s] for s in complete_seconds),
-            "max": max(packets_per_second[s] for s in complete_seconds),
-            "avg": sum(packets_per_second[s] for s in complete_seconds)
-            / len(complete_seconds),
+            "min": int(complete_packets_per_second.min()),
+            "max": int(complete_packets_per_second.max()),
+            "avg": int(complete_packets_per_second.sum()) / num_complete_seconds,
         },
         "timing": {
             "first_timestamp": min_timestamp,
@@ -199,21 +611,69 @@ def calculate_bitrates(
             f"Using {num_complete_seconds} complete seconds for bitrate calculations."
         )
 
-        packets_excluded: List[Packet] = []
+        # A packet's timestamp is at least num_complete_seconds exactly when
+        # its second is, so the excluded range can be read from the buckets.
+        is_excluded = buckets.seconds >= num_complete_seconds
+
+        if is_excluded.any():
+            unused_timestamp_range_min = float(
+                buckets.first_timestamps[is_excluded][0]
+            )
+            unused_timestamp_range_max = float(
+                buckets.last_timestamps[is_excluded][-1]
+            )
+
+            print(
+                f"Unused {'DTS' if use_dts else 'PTS'} range: {unused_timestamp_range_min} to {unused_timestamp_range_max}"
+            )
 
-        for packet in packets:
-            if packet.timestamp >= len(complete_seconds):
-                packets_excluded.append(packet)
+            data["unused_timestamp_range"] = (
+                f"{unused_timestamp_range_min} to {unused_timestamp_range_max}"
+            )
 
-        unused_timestamp_range_min = packets_excluded[0].timestamp
-        unused_timestamp_range_max = packets_excluded[-1].timestamp
+    return x_axis_values, bitrates, data
 
-        print(
-            f"Unused {'DTS' if use_dts else 'PTS'} range: {unused_timestamp_range_min} to {unused_timestamp_range_max}"
-        )
 
-        data["unused_timestamp_range"] = (
-            f"{unused_timestamp_range_min} to {unused_timestamp_range_max}"
+def calculate_bitrates_per_stream(
+    packets: PacketColumns,
+    codec_types: Dict[int, str],
+    use_dts: bool,
+    min_coverage_seconds: float = 0.9,
+    max_gap_seconds: float = 0.1,
+) -> Dict[int, Tuple[List[int], List[float], Dict]]:
+    """
+    Calculate the bitrates of every stream in `packets`, which must have a
+    stream_index column. Video streams are in Mbps and other streams in kbps.
+
+    A stream whose bitrates cannot be calculated, e.g. cover art that only
+    has one packet, gets empty bitrates and an "error" in its data.
+    """
+    timestamp_field = "dts_time" if use_dts else "pts_time"
+    stream_indices = packets["stream_index"]
+    results = {}
+
+    for stream_index in np.unique(stream_indices).tolist():
+        codec_type = codec_types.get(stream_index, "unknown")
+        output_unit = "mbps" if codec_type == "video" else "kbps"
+        is_stream = stream_indices == stream_index
+
+        try:
+            x_axis_values, bitrates, data = calculate_bitrates_from_packets(
+                packets[timestamp_field][is_stream],
+                packets["size"][is_stream],
+                {},
+                use_dts,
+                output_unit,
+                min_coverage_seconds,
+                max_gap_seconds,
+            )
+        except ValueError as e:
+            x_axis_values, bitrates, data = [], [], {"error": str(e)}
+
+        results[stream_index] = (
+            x_axis_values,
+            bitrates,
+            {"codec_type": codec_type, "output_unit": output_unit, **data},
         )
 
-    return x_axis_values, bitrates, data
+    return results
@@ -1,234 +1,394 @@
-from dataclasses import dataclass
-import json
-import io
-from typing import List, Tuple, TextIO, NamedTuple
+import subprocess
+from typing import Dict, List, NamedTuple, Optional, Tuple
 
-from utils import append_to_file
+from packet_reader import PacketColumns, read_packets
+from profiling import stage
 
 import numpy as np
 
 
-@dataclass
-class Packet:
-    time: float  # PTS or DTS time
-    size: float  # Size in megabits
-    flags: str  # Packet flag (e.g. 'K__')
+class GOPTable(NamedTuple):
+    """Statistics of every GOP, stored as one array per statistic."""
+
+    start_times: np.ndarray
+    end_times: np.ndarray
+    durations: np.ndarray
+    sizes: np.ndarray  # Megabits
+    bitrates: np.ndarray  # Mbps
+    packet_counts: np.ndarray
+    avg_packet_sizes: np.ndarray  # Megabits
+
+    def __len__(self) -> int:
+        return len(self.start_times)
+
+
+def find_gop_boundaries(keyframes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return the start and (exclusive) end index of every GOP.
+
+    A GOP starts at each keyframe and ends just before the next one. Packets
+    before the first keyframe do not belong to a GOP.
+    """
+    starts = np.flatnonzero(keyframes)
+    ends = np.append(starts[1:], len(keyframes))
+    return starts, ends
+
+
+def calculate_gop_stats(
+    times: np.ndarray, sizes: np.ndarray, keyframes: np.ndarray, framerate: float
+) -> GOPTable:
+    """
+    Calculate the statistics of every GOP in one pass over the packets.
+
+    `times` must be sorted in ascending order and `sizes` must be in bytes.
+    """
+    starts, ends = find_gop_boundaries(keyframes)
+
+    if not len(starts):
+        empty = np.empty(0)
+        return GOPTable(empty, empty, empty, empty, empty, empty.astype(np.int64), empty)
+
+    # Summing bytes, rather than megabits, keeps the per-GOP totals exact.
+    gop_bytes = np.add.reduceat(sizes[starts[0] :].astype(np.int64), starts - starts[0])
+
+    return build_gop_table(
+        times[starts], times[ends - 1], gop_bytes, ends - starts, framerate
+    )
+
+
+def build_gop_table(
+    start_times: np.ndarray,
+    end_times: np.ndarray,
+    gop_bytes: np.ndarray,
+    packet_counts: np.ndarray,
+    framerate: Optional[float],
+) -> GOPTable:
+    """
+    Build a GOPTable from the first and last timestamp, total bytes and
+    packet count of every GOP.
+
+    A GOP lasts until one frame after its last packet. If the framerate is
+    not known, each GOP's mean packet interval is used as its frame duration.
+    """
+    gop_sizes = (gop_bytes * 8) / 1_000_000
+
+    if framerate:
+        frame_durations = 1 / framerate
+    else:
+        frame_durations = (end_times - start_times) / np.maximum(packet_counts - 1, 1)
+
+    durations = end_times - start_times + frame_durations
+
+    if (durations <= 0).any():
+        raise ValueError(f"Invalid GOP duration: {durations[durations <= 0][0]:.3f}s")
+
+    return GOPTable(
+        start_times=start_times,
+        end_times=end_times,
+        durations=durations,
+        sizes=gop_sizes,
+        bitrates=gop_sizes / durations,
+        packet_counts=packet_counts,
+        avg_packet_sizes=gop_sizes / packet_counts,
+    )
+
+
+class StreamingGOPAggregator:
+    """
+    Splits packets into GOPs chunk by chunk, keeping only the totals of each
+    GOP rather than its packets.
+
+    Like StreamingSecondAggregator, packets wait in a reorder buffer until
+    the newest timestamp seen is more than `reorder_window` seconds ahead of
+    them, and are then added to the open GOP in timestamp order. A GOP is
+    closed when the next keyframe is added.
+    """
+
+    def __init__(self, reorder_window: float = 2.0):
+        if reorder_window < 0:
+            raise ValueError(f"reorder_window must not be negative, got {reorder_window}")
+
+        self.reorder_window = reorder_window
+        self._newest_timestamp = -np.inf
+        self._committed_until = -np.inf
+        self._pending_timestamps = np.empty(0, dtype=np.float64)
+        self._pending_sizes = np.empty(0, dtype=np.int64)
+        self._pending_keyframes = np.empty(0, dtype=np.bool_)
+        # The first and last timestamp, bytes and packet count of the GOP that
+        # has not been closed yet, or None before the first keyframe.
+        self._open_gop: Optional[List] = None
+        self._closed_gops: List[Tuple[float, float, int, int]] = []
 
     @property
-    def is_keyframe(self) -> bool:
-        return "K" in self.flags
+    def settled_until(self) -> float:
+        return self._committed_until
 
+    def _commit(self, timestamps: np.ndarray, sizes: np.ndarray, keyframes: np.ndarray):
+        if not len(timestamps):
+            return
 
-class GOPStats(NamedTuple):
-    duration: float
-    size: float
-    bitrate: float
-    packet_count: int
-    avg_packet_size: float
+        order = np.argsort(timestamps, kind="stable")
+        timestamps = timestamps[order]
+        sizes = sizes[order].astype(np.int64)
+        keyframes = keyframes[order]
 
+        starts = np.flatnonzero(keyframes)
+        # The packets before the first keyframe belong to the open GOP.
+        lead = starts[0] if len(starts) else len(timestamps)
 
-class GOP:
-    def __init__(self, start_time: float, packets: List[Packet]):
-        self.start_time = start_time
-        self.packets = packets
+        if self._open_gop is not None and lead:
+            self._open_gop[1] = float(timestamps[lead - 1])
+            self._open_gop[2] += int(sizes[:lead].sum())
+            self._open_gop[3] += int(lead)
 
-    @property
-    def end_time(self) -> float:
-        return self.packets[-1].time
+        if not len(starts):
+            return
 
-    @property
-    def size(self) -> float:
-        return sum(packet.size for packet in self.packets)
+        if self._open_gop is not None:
+            self._closed_gops.append(tuple(self._open_gop))
 
-    @property
-    def packet_count(self) -> int:
-        return len(self.packets)
+        ends = np.append(starts[1:], len(timestamps))
+        gop_bytes = np.add.reduceat(sizes[lead:], starts - lead)
 
-    @property
-    def avg_packet_size(self) -> float:
-        return self.size / self.packet_count
-
-    def calculate_stats(self, framerate: float) -> GOPStats:
-        """Calculate GOP statistics"""
-        duration = self.end_time - self.start_time + (1 / framerate)
-        if duration <= 0:
-            raise ValueError(f"Invalid GOP duration: {duration:.3f}s")
-        bitrate = self.size / duration
-        return GOPStats(
-            duration=duration,
-            size=self.size,
-            bitrate=bitrate,
-            packet_count=self.packet_count,
-            avg_packet_size=self.avg_packet_size,
+        for start, end, total in zip(starts[:-1], ends[:-1], gop_bytes[:-1]):
+            self._closed_gops.append(
+                (float(timestamps[start]), float(timestamps[end - 1]), int(total), int(end - start))
+            )
+
+        self._open_gop = [
+            float(timestamps[starts[-1]]),
+            float(timestamps[-1]),
+            int(gop_bytes[-1]),
+            int(ends[-1] - starts[-1]),
+        ]
+
+    def add(self, timestamps: np.ndarray, sizes: np.ndarray, keyframes: np.ndarray):
+        """Add packets in any order. Timestamps must not be NaN."""
+        if not len(timestamps):
+            return
+
+        self._newest_timestamp = max(self._newest_timestamp, float(timestamps.max()))
+        watermark = self._newest_timestamp - self.reorder_window
+
+        timestamps = np.concatenate((self._pending_timestamps, timestamps))
+        sizes = np.concatenate((self._pending_sizes, sizes))
+        keyframes = np.concatenate((self._pending_keyframes, keyframes))
+        is_ready = timestamps < watermark
+
+        self._commit(timestamps[is_ready], sizes[is_ready], keyframes[is_ready])
+        self._committed_until = max(self._committed_until, watermark)
+        self._pending_timestamps = timestamps[~is_ready]
+        self._pending_sizes = sizes[~is_ready]
+        self._pending_keyframes = keyframes[~is_ready]
+
+    def flush(self):
+        """Commit every packet in the reorder buffer and close the open GOP."""
+        self._commit(self._pending_timestamps, self._pending_sizes, self._pending_keyframes)
+        self._committed_until = max(self._committed_until, self._newest_timestamp)
+        self._pending_timestamps = self._pending_timestamps[:0]
+        self._pending_sizes = self._pending_sizes[:0]
+        self._pending_keyframes = self._pending_keyframes[:0]
+
+        if self._open_gop is not None:
+            self._closed_gops.append(tuple(self._open_gop))
+            self._open_gop = None
+
+    def discard_before(self, time: float):
+        """Forget the GOPs that ended before `time`, to bound memory."""
+        keep_from = 0
+        while keep_from < len(self._closed_gops) and self._closed_gops[keep_from][1] < time:
+            keep_from += 1
+
+        del self._closed_gops[:keep_from]
+
+    def gops(self, framerate: Optional[float] = None) -> GOPTable:
+        """The statistics of every closed GOP."""
+        if not self._closed_gops:
+            empty = np.empty(0)
+            return GOPTable(empty, empty, empty, empty, empty, empty.astype(np.int64), empty)
+
+        start_times, end_times, gop_bytes, packet_counts = (
+            np.array(column) for column in zip(*self._closed_gops)
         )
 
+        return build_gop_table(start_times, end_times, gop_bytes, packet_counts, framerate)
+
+    def get_state(self) -> Dict:
+        """
+        The committed GOPs as a JSON-serialisable dict. Packets in the reorder
+        buffer are not included, so a restored aggregator should be given
+        every packet from `settled_until` onwards again.
+        """
+        return {
+            "settled_until": self._committed_until,
+            "open_gop": self._open_gop,
+            "closed_gops": self._closed_gops,
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict, reorder_window: float = 2.0):
+        aggregator = cls(reorder_window)
+        aggregator._committed_until = state["settled_until"]
+        aggregator._newest_timestamp = state["settled_until"] + reorder_window
+        aggregator._open_gop = state["open_gop"]
+        aggregator._closed_gops = [tuple(gop) for gop in state["closed_gops"]]
+        return aggregator
+
 
 class VideoStats:
-    def __init__(self, packets: List[Packet], gops: List[GOP], framerate: float):
-        self.packets = packets
+    def __init__(self, times: np.ndarray, sizes: np.ndarray, gops: GOPTable):
+        self.times = times
+        self.sizes = sizes  # Megabits
         self.gops = gops
-        self.framerate = framerate
-        self.gop_stats = [gop.calculate_stats(framerate) for gop in gops]
 
     @property
     def first_time(self) -> float:
-        return self.packets[0].time if self.packets else 0
+        return float(self.times[0]) if len(self.times) else 0
 
     @property
     def final_time(self) -> float:
-        return self.packets[-1].time if self.packets else 0
+        return float(self.times[-1]) if len(self.times) else 0
 
     @property
     def packets_processed(self) -> int:
-        return len(self.packets)
-
-    def calculate_time_intervals(self) -> List[float]:
-        """Calculate time intervals between consecutive packets"""
-        return [
-            self.packets[i + 1].time - self.packets[i].time
-            for i in range(len(self.packets) - 1)
-            if self.packets[i + 1].time - self.packets[i].time > 0
-        ]
+        return len(self.times)
+
+    def calculate_time_intervals(self) -> np.ndarray:
+        """Calculate the positive time intervals between consecutive packets"""
+        intervals = np.diff(self.times)
+        return intervals[intervals > 0]
 
     def get_packet_size_range(self) -> Tuple[float, float]:
         """Get min and max packet sizes"""
-        sizes = [packet.size for packet in self.packets]
-        return np.min(sizes), np.max(sizes)
+        return np.min(self.sizes), np.max(self.sizes)
 
     def get_gop_stats_range(self) -> dict:
         """Calculate min/max/avg of various GOP statistics"""
-        if not self.gop_stats:
+        if not len(self.gops):
             return {}
 
+        def value_range(values: np.ndarray) -> Tuple[float, float, float]:
+            return np.min(values), np.max(values), np.mean(values)
+
         return {
-            "duration": (
-                np.min([s.duration for s in self.gop_stats]),
-                np.max([s.duration for s in self.gop_stats]),
-                np.mean([s.duration for s in self.gop_stats]),
-            ),
-            "size": (
-                np.min([s.size for s in self.gop_stats]),
-                np.max([s.size for s in self.gop_stats]),
-                np.mean([s.size for s in self.gop_stats]),
-            ),
-            "bitrate": (
-                np.min([s.bitrate for s in self.gop_stats]),
-                np.max([s.bitrate for s in self.gop_stats]),
-                np.mean([s.bitrate for s in self.gop_stats]),
-            ),
-            "avg_packets": np.mean([s.packet_count for s in self.gop_stats]),
+            "duration": value_range(self.gops.durations),
+            "size": value_range(self.gops.sizes),
+            "bitrate": value_range(self.gops.bitrates),
+            "avg_packets": np.mean(self.gops.packet_counts),
         }
 
 
 def calculate_gop_bitrates(
-    process: TextIO,
+    process: subprocess.Popen,
     progress_bar,
     task_1,
     task_2,
     framerate,
-    data_file: str,
+    report_writer,
     use_dts: bool,
-) -> Tuple[List[float], List[float]]:
-    def collect_packets() -> List[Packet]:
-        packets = []
-        packets_processed = 0
-
-        for line in io.TextIOWrapper(process.stdout, encoding="utf-8"):
-            try:
-                parts = line.strip().split(",")
-                if len(parts) != 3:
-                    print(f"Warning: Invalid line format: {line}")
-                    continue
-
-                time = float(parts[0])
-                size = (int(parts[1]) * 8) / 1_000_000  # Convert to megabits
-                flags = parts[2]
-
-                packets.append(Packet(time, size, flags))
-
-            except (ValueError, IndexError) as e:
-                append_to_file(
-                    data_file,
-                    f"Warning: Error processing packet {packets_processed}: {str(e)}",
-                )
-
-            packets_processed += 1
-            progress_bar.update(task_1, completed=packets_processed)
+) -> Tuple[List[float], List[float], Dict]:
+    timestamp_field = "dts_time" if use_dts else "pts_time"
+    # Progress is reported against the file's duration, using the furthest
+    # timestamp seen so far, so that packets only have to be read once.
+    furthest_time = 0.0
+
+    def report_progress(chunk: PacketColumns):
+        nonlocal furthest_time
+        if len(chunk):
+            furthest_time = max(
+                furthest_time, float(np.nanmax(chunk[timestamp_field], initial=0))
+            )
+            progress_bar.update(task_1, completed=furthest_time)
+
+    packets = read_packets(
+        process.stdout, (timestamp_field, "size", "flags"), on_chunk=report_progress
+    )
+    progress_bar.update(task_1, total=furthest_time, completed=furthest_time)
+
+    return calculate_gop_bitrates_from_packets(
+        packets[timestamp_field],
+        packets["size"],
+        packets["keyframe"],
+        packets.rejection_reasons,
+        framerate,
+        report_writer,
+        use_dts,
+        progress_bar=progress_bar,
+        task=task_2,
+    )
+
+
+def calculate_gop_bitrates_from_packets(
+    times: np.ndarray,
+    sizes: np.ndarray,
+    keyframes: np.ndarray,
+    rejection_reasons: Dict[str, int],
+    framerate,
+    report_writer,
+    use_dts: bool,
+    progress_bar=None,
+    task=None,
+) -> Tuple[List[float], List[float], Dict]:
+    """
+    Calculate GOP statistics from arrays of packet timestamps, sizes (in bytes)
+    and keyframe flags. Per-GOP statistics are written to `report_writer`,
+    a GOPReportWriter.
+    """
+    timing_type = "DTS" if use_dts else "PTS"
+    rejection_reasons = dict(rejection_reasons)
+
+    # Packets with a timestamp of N/A cannot be placed in the timeline.
+    has_time = ~np.isnan(times)
+    if not has_time.all():
+        rejection_reasons["invalid format"] = rejection_reasons.get(
+            "invalid format", 0
+        ) + int(np.count_nonzero(~has_time))
+        times = times[has_time]
+        sizes = sizes[has_time]
+        keyframes = keyframes[has_time]
+
+    for reason, count in rejection_reasons.items():
+        print(f"Warning: {count} packets were skipped ({reason})")
+        report_writer.write_warning(f"{count} packets were skipped ({reason})")
 
-        if not packets:
+    try:
+        if not len(times):
             raise RuntimeError("No valid packets found in input")
 
-        return sorted(packets, key=lambda f: f.time)
-
-    def process_gops(packets: List[Packet]) -> List[GOP]:
-        """Process packets into GOPs."""
-        gops = []
-        current_gop_packets = []
-        first_keyframe_found = False
-        packets_processed = 0
-
-        for packet in packets:
-            if packet.is_keyframe:
-                if first_keyframe_found and current_gop_packets:
-                    gops.append(GOP(current_gop_packets[0].time, current_gop_packets))
-                first_keyframe_found = True
-                current_gop_packets = [packet]
-            elif first_keyframe_found:
-                current_gop_packets.append(packet)
-
-            packets_processed += 1
-            progress_bar.update(task_2, completed=packets_processed)
-
-        # Add final GOP
-        if first_keyframe_found and current_gop_packets:
-            gops.append(GOP(current_gop_packets[0].time, current_gop_packets))
-
-        return gops
-
-    def write_gop_stats(gop_index: int, gop: GOP, stats: GOPStats):
-        prefix = "Final GOP" if gop_index == len(gops) else "GOP"
-        append_to_file(data_file, f"{prefix} {gop_index} statistics:")
-        append_to_file(data_file, f"\nStart {timing_type}: {gop.start_time:.3f}s")
-        append_to_file(data_file, f"\nEnd {timing_type}: {gop.end_time:.3f}s")
-        append_to_file(data_file, f"\nDuration: {stats.duration:.3f}s")
-        append_to_file(data_file, f"\nSize: {stats.size:.2f} Megabits")
-        append_to_file(data_file, f"\nBitrate: {stats.bitrate:.2f} Mbps")
-        append_to_file(data_file, f"\nPackets: {stats.packet_count}")
-        append_to_file(
-            data_file, f"\nAverage frame size: {stats.avg_packet_size:.3f} Megabits\n\n"
-        )
+        if progress_bar is not None:
+            progress_bar.update(task, total=len(times))
 
-    timing_type = "DTS" if use_dts else "PTS"
+        with stage("sort packets", len(times)):
+            order = np.argsort(times, kind="stable")
+            times = times[order]
+            keyframes = keyframes[order]
+            sizes = sizes[order]
 
-    try:
-        # Collect and process packets
-        packets = collect_packets()
-        gops = process_gops(packets)
+        with stage("GOP statistics", len(times)) as counter:
+            gops = calculate_gop_stats(times, sizes, keyframes, framerate)
+            counter.items = len(gops)
+
+        if progress_bar is not None:
+            progress_bar.update(task, completed=len(times))
 
-        if not gops:
+        if not len(gops):
             print("\nNo GOPs found in video!")
-            return [], []
+            return [], [], {"mode": timing_type, "total_packets": len(times), "gop_count": "0"}
 
         # Calculate statistics
-        video_stats = VideoStats(packets, gops, framerate)
+        video_stats = VideoStats(times, (sizes * 8) / 1_000_000, gops)
         time_intervals = video_stats.calculate_time_intervals()
         gop_stats_range = video_stats.get_gop_stats_range()
         min_packet_size, max_packet_size = video_stats.get_packet_size_range()
 
-        # Write individual GOP statistics
-        for i, (gop, stats) in enumerate(zip(gops, video_stats.gop_stats), 1):
-            write_gop_stats(i, gop, stats)
-
-        # Packet statistics
-        append_to_file(data_file, "\n\nPacket Statistics:")
-        append_to_file(
-            data_file,
-            f"\Packet size range: {min_packet_size:.6f} to {max_packet_size:.6f} Megabits",
-        )
+        with stage("write GOP reports", len(gops)):
+            report_writer.write_gops(gops, timing_type)
+            report_writer.write_packet_stats(min_packet_size, max_packet_size)
 
         data = {
             "mode": timing_type,
             f"{timing_type}_range": f"{video_stats.first_time:.3f}s to {video_stats.final_time:.3f}s",
+            "total_packets": video_stats.packets_processed,
             "gop_count": f"{len(gops)}",
             "mean_packets_per_gop": f"{gop_stats_range['avg_packets']:.1f}",
             "gop_duration_range_seconds": {
@@ -248,7 +408,7 @@ def calculate_gop_bitrates(
             "packet_size_range": f"{min_packet_size:.6f} to {max_packet_size:.6f} Megabits",
         }
 
-        if time_intervals:
+        if len(time_intervals) > 0:
             min_interval = np.min(time_intervals)
             max_interval = np.max(time_intervals)
             mean_interval = np.mean(time_intervals)
@@ -259,8 +419,6 @@ def calculate_gop_bitrates(
 
             data[f"average_{timing_type}_interval"] = f"{mean_interval:.6f}s"
 
-        if len(time_intervals) > 0:
-            mean_interval = np.mean(time_intervals)
             if abs(mean_interval == (1 / framerate)) < 0.000_000_001:
                 print(f"✓ Average {timing_type} interval matches expected frame rate")
             else:
@@ -283,10 +441,7 @@ def calculate_gop_bitrates(
                 f"[Info] GOP durations are inconsistent:\nMin: {min_duration}\nMean: {mean_duration}\nMax: {max_duration}"
             )
 
-        gop_end_times = [gop.end_time for gop in gops]
-        gop_bitrates = [stats.bitrate for stats in video_stats.gop_stats]
-
-        return gop_end_times, gop_bitrates, data
+        return gops.end_times.tolist(), gops.bitrates.tolist(), data
 
     except Exception as e:
         raise RuntimeError(f"Error processing video data: {str(e)}")
@@ -0,0 +1,230 @@
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from calculate_bitrates import (
+    UNIT_MULTIPLIERS,
+    StreamingSecondAggregator,
+    find_complete_seconds,
+    validate_output_unit,
+    validate_parameters,
+)
+from calculate_gop_bitrates import StreamingGOPAggregator
+from packet_reader import PacketColumns
+
+import numpy as np
+
+STATE_FILE = "follow_state.json"
+
+STATE_VERSION = 1
+
+
+class LiveSession:
+    """
+    Aggregates the packets of a live source per second and per GOP as they
+    arrive, without keeping the packets themselves.
+
+    Only the seconds and GOPs of the last `history_seconds` are kept for the
+    graphs and statistics, so memory usage does not grow with the length of
+    the stream. The packet and byte totals cover the whole stream.
+    """
+
+    def __init__(
+        self,
+        source: str,
+        use_dts: bool,
+        output_unit: str,
+        track_gops: bool,
+        framerate: Optional[float] = None,
+        history_seconds: float = 3600,
+        reorder_window: float = 2.0,
+        min_coverage_seconds: float = 0.9,
+        max_gap_seconds: float = 0.1,
+    ):
+        validate_output_unit(output_unit)
+        validate_parameters(min_coverage_seconds, max_gap_seconds)
+
+        if history_seconds <= 0:
+            raise ValueError(f"history_seconds must be positive, got {history_seconds}")
+
+        self.source = source
+        self.use_dts = use_dts
+        self.output_unit = output_unit
+        self.framerate = framerate
+        self.history_seconds = history_seconds
+        self.reorder_window = reorder_window
+        self.min_coverage_seconds = min_coverage_seconds
+        self.max_gap_seconds = max_gap_seconds
+        self.timestamp_field = "dts_time" if use_dts else "pts_time"
+
+        self.seconds = StreamingSecondAggregator(reorder_window)
+        self.gops = StreamingGOPAggregator(reorder_window) if track_gops else None
+        self.rejection_reasons: Dict[str, int] = {}
+        # Packets before this timestamp were aggregated by a previous run.
+        self.resumed_from: Optional[float] = None
+
+    @property
+    def fields(self) -> List[str]:
+        fields = [self.timestamp_field, "size"]
+        if self.gops:
+            fields.append("flags")
+        return fields
+
+    @property
+    def settled_until(self) -> float:
+        return self.seconds.settled_until
+
+    def add(self, chunk: PacketColumns):
+        for reason, count in chunk.rejection_reasons.items():
+            self.rejection_reasons[reason] = self.rejection_reasons.get(reason, 0) + count
+
+        timestamps = chunk[self.timestamp_field]
+
+        # Packets with a timestamp of N/A cannot be assigned to a second.
+        has_timestamp = ~np.isnan(timestamps)
+        if not has_timestamp.all():
+            self.rejection_reasons["invalid format"] = self.rejection_reasons.get(
+                "invalid format", 0
+            ) + int(np.count_nonzero(~has_timestamp))
+
+        is_new = has_timestamp
+        if self.resumed_from is not None:
+            is_new = is_new & (timestamps >= self.resumed_from)
+
+        timestamps = timestamps[is_new]
+        sizes = chunk["size"][is_new]
+
+        self.seconds.add(timestamps, sizes)
+        if self.gops:
+            self.gops.add(timestamps, sizes, chunk["keyframe"][is_new])
+
+        self._discard_old_history()
+
+    def flush(self):
+        """Aggregate every remaining packet, once the source has ended."""
+        self.seconds.flush()
+        if self.gops:
+            self.gops.flush()
+
+    def _discard_old_history(self):
+        history_start = self.settled_until - self.history_seconds
+
+        if np.isfinite(history_start):
+            self.seconds.discard_before(int(np.floor(history_start)))
+            if self.gops:
+                self.gops.discard_before(history_start)
+
+    def bitrates(self) -> Tuple[List[int], List[float]]:
+        """The bitrate of every complete second in the history."""
+        buckets = self.seconds.buckets()
+
+        if not len(buckets.seconds):
+            return [], []
+
+        is_complete, _, _ = find_complete_seconds(
+            buckets, self.min_coverage_seconds, self.max_gap_seconds
+        )
+
+        return (
+            buckets.seconds[is_complete].tolist(),
+            (buckets.bytes[is_complete] * 8 * UNIT_MULTIPLIERS[self.output_unit]).tolist(),
+        )
+
+    def gop_bitrates(self) -> Tuple[List[float], List[float]]:
+        """The end time and bitrate (in Mbps) of every closed GOP in the history."""
+        if not self.gops:
+            return [], []
+
+        gops = self.gops.gops(self.framerate)
+        return gops.end_times.tolist(), gops.bitrates.tolist()
+
+    def data(self) -> Dict:
+        """The contents of data.json."""
+        x_axis_values, bitrates = self.bitrates()
+
+        data = {
+            "mode": "DTS" if self.use_dts else "PTS",
+            "source": self.source,
+            "resumed_from": self.resumed_from,
+            "settled_until": self.settled_until if np.isfinite(self.settled_until) else None,
+            "history_seconds": self.history_seconds,
+            "total_packets": self.seconds.total_packets,
+            "total_bytes": self.seconds.total_bytes,
+            "late_packets": self.seconds.late_packets,
+            "rejected_packets": sum(self.rejection_reasons.values()),
+            "rejection_reasons": self.rejection_reasons,
+            "complete_seconds": len(x_axis_values),
+        }
+
+        if bitrates:
+            data[f"min_bitrate_{self.output_unit}"] = np.min(bitrates)
+            data[f"mean_bitrate_{self.output_unit}"] = np.mean(bitrates)
+            data[f"max_bitrate_{self.output_unit}"] = np.max(bitrates)
+
+        if self.gops:
+            _, gop_bitrates = self.gop_bitrates()
+            data["gop_count"] = f"{len(gop_bitrates)}"
+
+            if gop_bitrates:
+                data["gop_bitrate_range_mbps"] = {
+                    "min": f"{np.min(gop_bitrates):.2f}",
+                    "max": f"{np.max(gop_bitrates):.2f}",
+                    "mean": f"{np.mean(gop_bitrates):.2f}",
+                }
+
+        return data
+
+    def _state_key(self) -> Dict:
+        return {
+            "version": STATE_VERSION,
+            "source": self.source,
+            "mode": "DTS" if self.use_dts else "PTS",
+            "gops": self.gops is not None,
+        }
+
+    def save_state(self, state_file: Path):
+        """
+        Save the aggregated seconds and GOPs, so that a later run on the same
+        source can resume from `settled_until`. The state is written to a
+        temporary file and renamed into place, so it is never partially written.
+        """
+        state = {
+            **self._state_key(),
+            "rejection_reasons": self.rejection_reasons,
+            "seconds": self.seconds.get_state(),
+            "gop_state": self.gops.get_state() if self.gops else None,
+        }
+
+        temp_file = Path(state_file).with_name(f"{Path(state_file).name}.tmp")
+        with open(temp_file, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(temp_file, state_file)
+
+    def load_state(self, state_file: Path) -> bool:
+        """
+        Restore the state saved by a previous run on the same source with the
+        same settings. Returns False, leaving the session empty, otherwise.
+        """
+        try:
+            with open(state_file, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        if {key: state.get(key) for key in self._state_key()} != self._state_key():
+            return False
+
+        self.rejection_reasons = state["rejection_reasons"]
+        self.seconds = StreamingSecondAggregator.from_state(
+            state["seconds"], self.reorder_window
+        )
+        if self.gops:
+            self.gops = StreamingGOPAggregator.from_state(
+                state["gop_state"], self.reorder_window
+            )
+
+        if np.isfinite(self.settled_until):
+            self.resumed_from = self.settled_until
+
+        return True
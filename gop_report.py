@@ -0,0 +1,169 @@
+import csv
+import json
+import os
+from pathlib import Path
+from typing import Dict, Sequence
+
+from calculate_gop_bitrates import GOPTable
+
+import numpy as np
+
+REPORT_FORMATS = ("text", "csv", "ndjson", "npy")
+
+REPORT_FILENAMES = {
+    "text": "gop_statistics.txt",
+    "csv": "gop_statistics.csv",
+    "ndjson": "gop_statistics.ndjson",
+    # A folder with one .npy file per column.
+    "npy": "gop_statistics",
+}
+
+# Large enough that network-mounted output volumes see a few big writes.
+BUFFER_SIZE = 1024 * 1024
+
+
+class GOPReportWriter:
+    """
+    Writes the per-GOP statistics in one or more formats.
+
+    Each report is opened once and written through a buffered handle:
+    - text: the human-readable gop_statistics.txt layout.
+    - csv: one row per GOP.
+    - ndjson: one JSON object per GOP, per line.
+    - npy: one .npy file per statistic, which np.load() can memory-map.
+
+    Use it as a context manager so that every report is flushed and closed.
+    """
+
+    def __init__(self, output_dir: Path, formats: Sequence[str] = ("text",)):
+        unknown = set(formats) - set(REPORT_FORMATS)
+        if unknown:
+            raise ValueError(
+                f"Unsupported report formats: {sorted(unknown)}. Must be one of: {REPORT_FORMATS}"
+            )
+
+        self._output_dir = Path(output_dir)
+        self._formats = list(dict.fromkeys(formats))
+        self._files: Dict[str, object] = {}
+
+    @property
+    def paths(self) -> Dict[str, Path]:
+        return {
+            report_format: self._output_dir.joinpath(REPORT_FILENAMES[report_format])
+            for report_format in self._formats
+        }
+
+    def __enter__(self) -> "GOPReportWriter":
+        for report_format, path in self.paths.items():
+            if report_format == "npy":
+                os.makedirs(path, exist_ok=True)
+                continue
+
+            self._files[report_format] = open(
+                path, "w", buffering=BUFFER_SIZE, encoding="utf-8", newline=""
+            )
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+    def write_warning(self, message: str):
+        """Warnings only appear in the text report."""
+        if "text" in self._files:
+            self._files["text"].write(f"Warning: {message}\n\n")
+
+    def write_gops(self, gops: GOPTable, timing_type: str):
+        if "text" in self._files:
+            self._write_text(gops, timing_type)
+        if "csv" in self._files:
+            self._write_csv(gops, timing_type)
+        if "ndjson" in self._files:
+            self._write_ndjson(gops, timing_type)
+        if "npy" in self._formats:
+            self._write_npy(gops, timing_type)
+
+    def write_packet_stats(self, min_packet_size: float, max_packet_size: float):
+        if "text" in self._files:
+            self._files["text"].write(
+                "\n\nPacket Statistics:"
+                f"\nPacket size range: {min_packet_size:.6f} to {max_packet_size:.6f} Megabits"
+            )
+
+    @staticmethod
+    def _records(gops: GOPTable, timing_type: str):
+        timing_type = timing_type.lower()
+        columns = zip(
+            gops.start_times.tolist(),
+            gops.end_times.tolist(),
+            gops.durations.tolist(),
+            gops.sizes.tolist(),
+            gops.bitrates.tolist(),
+            gops.packet_counts.tolist(),
+            gops.avg_packet_sizes.tolist(),
+        )
+
+        for index, values in enumerate(columns, 1):
+            yield {
+                "gop": index,
+                f"start_{timing_type}": values[0],
+                f"end_{timing_type}": values[1],
+                "duration_seconds": values[2],
+                "size_megabits": values[3],
+                "bitrate_mbps": values[4],
+                "packets": values[5],
+                "avg_packet_size_megabits": values[6],
+            }
+
+    def _write_text(self, gops: GOPTable, timing_type: str):
+        f = self._files["text"]
+        start_key = f"start_{timing_type.lower()}"
+        end_key = f"end_{timing_type.lower()}"
+
+        for record in self._records(gops, timing_type):
+            prefix = "Final GOP" if record["gop"] == len(gops) else "GOP"
+            f.write(
+                f"{prefix} {record['gop']} statistics:"
+                f"\nStart {timing_type}: {record[start_key]:.3f}s"
+                f"\nEnd {timing_type}: {record[end_key]:.3f}s"
+                f"\nDuration: {record['duration_seconds']:.3f}s"
+                f"\nSize: {record['size_megabits']:.2f} Megabits"
+                f"\nBitrate: {record['bitrate_mbps']:.2f} Mbps"
+                f"\nPackets: {record['packets']}"
+                f"\nAverage frame size: {record['avg_packet_size_megabits']:.3f} Megabits\n\n"
+            )
+
+    def _write_csv(self, gops: GOPTable, timing_type: str):
+        writer = None
+
+        for record in self._records(gops, timing_type):
+            if writer is None:
+                writer = csv.DictWriter(self._files["csv"], fieldnames=list(record))
+                writer.writeheader()
+            writer.writerow(record)
+
+    def _write_ndjson(self, gops: GOPTable, timing_type: str):
+        f = self._files["ndjson"]
+
+        for record in self._records(gops, timing_type):
+            f.write(json.dumps(record))
+            f.write("\n")
+
+    def _write_npy(self, gops: GOPTable, timing_type: str):
+        timing_type = timing_type.lower()
+        columns = {
+            f"start_{timing_type}": gops.start_times,
+            f"end_{timing_type}": gops.end_times,
+            "duration_seconds": gops.durations,
+            "size_megabits": gops.sizes,
+            "bitrate_mbps": gops.bitrates,
+            "packets": gops.packet_counts,
+            "avg_packet_size_megabits": gops.avg_packet_sizes,
+        }
+
+        for name, values in columns.items():
+            np.save(self.paths["npy"].joinpath(f"{name}.npy"), values)
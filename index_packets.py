@@ -0,0 +1,163 @@
+import re
+import struct
+from typing import Dict, List, Optional, Sequence
+
+from matroska_index import EBML
+from matroska_index import read_tracks as read_matroska_tracks
+from mp4_index import LEADING_BOX_TYPES
+from mp4_index import read_tracks as read_mp4_tracks
+from packet_reader import COLUMN_NAMES, PacketColumns, order_fields
+from profiling import stage
+
+import numpy as np
+
+# The stream specifiers that can be resolved from the tracks alone, e.g. 1, V:0 or a.
+STREAM_SPECIFIER_PATTERN = re.compile(r"^(?:(\d+)|([vVasd])(?::(\d+))?)$")
+
+CODEC_TYPE_LETTERS = {
+    "v": "video",
+    "V": "video",
+    "a": "audio",
+    "s": "subtitle",
+    "d": "data",
+}
+
+# Each reader returns the tracks of a file in its container, or None if the
+# file is in another container.
+TRACK_READERS = (read_mp4_tracks, read_matroska_tracks)
+
+
+def has_readable_index(file_path: str) -> bool:
+    """
+    Whether the file looks like an MP4/MOV or Matroska/WebM file, from its
+    first bytes, so that read_index_packets() will try to read it.
+    """
+    try:
+        with open(file_path, "rb") as f:
+            header = f.read(8)
+    except OSError:
+        return False
+
+    return header[4:] in LEADING_BOX_TYPES or header[:4] == EBML.to_bytes(4, "big")
+
+
+def select_tracks(tracks: List, stream_specifier: Optional[str]) -> Optional[List]:
+    """
+    The tracks that `stream_specifier` selects, as FFmpeg numbers its streams
+    in the order of the tracks in the file. Returns None for the stream
+    specifiers that are not supported, e.g. those that select by program or
+    metadata.
+    """
+    if stream_specifier is None:
+        return tracks
+
+    match = STREAM_SPECIFIER_PATTERN.match(stream_specifier)
+    if not match:
+        return None
+
+    index, codec_letter, number = match.groups()
+    if index is not None:
+        return [track for track in tracks if track.index == int(index)]
+
+    matching = [
+        track for track in tracks if track.codec_type == CODEC_TYPE_LETTERS[codec_letter]
+    ]
+    return matching if number is None else matching[int(number) : int(number) + 1]
+
+
+def _matches_codec_types(tracks: List, codec_types: Dict[int, str]) -> bool:
+    """
+    Whether the tracks are the streams that FFprobe reports. FFmpeg adds the
+    streams of Matroska attachments after the tracks, so those are ignored.
+    """
+    return all(
+        codec_types.get(track.index) == track.codec_type for track in tracks
+    ) and all(index >= len(tracks) for index in set(codec_types) - {
+        track.index for track in tracks
+    })
+
+
+def read_index_packets(
+    file_path: str,
+    fields: Sequence[str],
+    stream_specifier: Optional[str] = None,
+    codec_types: Optional[Dict[int, str]] = None,
+) -> Optional[PacketColumns]:
+    """
+    Read the packets of an MP4/MOV or Matroska/WebM file from its index or
+    block headers instead of demuxing it with FFprobe, which only reads a
+    small part of the file. The columns are the same as FFprobe's.
+
+    Returns None if FFprobe has to be used instead: if the file is in
+    another container or cannot be read, if the stream specifier is not
+    supported, if the tracks do not match `codec_types`, the streams that
+    FFprobe reports, or if the DTS is requested from a track that does not
+    store it.
+    """
+    tracks = None
+
+    try:
+        for read_tracks in TRACK_READERS:
+            tracks = read_tracks(file_path)
+            if tracks is not None:
+                break
+    except (OSError, ValueError, struct.error) as e:
+        print(f"Unable to read the file's index ({e}), so FFprobe will be used.")
+        return None
+
+    if tracks is None:
+        return None
+
+    if codec_types is not None and not _matches_codec_types(tracks, codec_types):
+        return None
+
+    selected = select_tracks(tracks, stream_specifier)
+    if not selected:
+        return None
+
+    if "dts_time" in fields and not all(track.has_dts for track in selected):
+        print("The DTS of this file is not stored in its index, so FFprobe will be used.")
+        return None
+
+    with stage("build index packets") as counter:
+        parts = []
+
+        for track in selected:
+            if not track.parts or not track.timescale:
+                continue
+
+            dts, composition_offsets, sizes, keyframes, positions = (
+                np.concatenate(column) for column in zip(*track.parts)
+            )
+            dts = dts + track.edit_shift
+
+            # FFprobe outputs timestamps with 6 decimal places, so they are
+            # rounded the same way for the results to match.
+            parts.append(
+                {
+                    "stream_index": np.full(len(dts), track.index, dtype=np.int64),
+                    "pts_time": np.round((dts + composition_offsets) / track.timescale, 6),
+                    "dts_time": np.round(dts / track.timescale, 6),
+                    "size": sizes,
+                    "pos": positions,
+                    "flags": keyframes,
+                }
+            )
+
+        if not parts:
+            return PacketColumns.empty(fields)
+
+        values = {
+            field: np.concatenate([part[field] for part in parts]) for field in parts[0]
+        }
+
+        # The packets of different tracks are interleaved in file order.
+        if len(parts) > 1:
+            order = np.argsort(values["pos"], kind="stable")
+            values = {field: column[order] for field, column in values.items()}
+
+        counter.items = len(values["size"])
+
+    return PacketColumns(
+        {COLUMN_NAMES[field]: values[field] for field in order_fields(fields)}
+    )
@@ -0,0 +1,268 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+from analysis import choose_stream_specifier, extract_packets
+from calculate_bitrates import calculate_bitrates_from_packets
+from calculate_gop_bitrates import calculate_gop_stats
+from metadata_cache import DEFAULT_CACHE_FILE, MetadataCache
+from profiling import Profiler
+from progress import NullProgress
+from utils import FileInfoProvider, VideoInfoProvider, line
+
+import numpy as np
+
+LADDER_DIR = Path("[ladder]")
+
+
+class Rendition(NamedTuple):
+    """The per-second bitrates and GOP boundaries of one rendition."""
+
+    file_path: str
+    x_axis_values: List[int]
+    bitrates: List[float]
+    # The start time of every GOP, or None if the rendition is not a video.
+    gop_start_times: Optional[np.ndarray]
+    # The per-second statistics, as in data.json.
+    data: Dict
+
+
+def analyse_rendition(file_path: str, args) -> Rendition:
+    """
+    Extract the packets of one rendition in a single pass and calculate both
+    its per-second bitrates and the start time of each of its GOPs.
+    """
+    profiler = Profiler()
+
+    with profiler.activate():
+        metadata_cache = MetadataCache(
+            None if args.no_metadata_cache else DEFAULT_CACHE_FILE
+        )
+        file_info = FileInfoProvider(file_path, metadata_cache)
+        is_video = file_info.is_video()
+        stream_specifier = choose_stream_specifier(args, is_video)
+        timestamp_field = "dts_time" if args.dts else "pts_time"
+
+        framerate = None
+        if is_video:
+            video_info = VideoInfoProvider(file_path, metadata_cache)
+            framerate = (
+                video_info.get_framerate_number()
+                if video_info.is_constant_framerate()
+                else None
+            )
+
+        with NullProgress() as progress_bar:
+            packets = extract_packets(
+                file_path,
+                [timestamp_field, "size", "flags"],
+                stream_specifier,
+                args,
+                file_info,
+                progress_bar,
+                0,
+            )
+
+        x_axis_values, bitrates, data = calculate_bitrates_from_packets(
+            packets[timestamp_field],
+            packets["size"],
+            packets.rejection_reasons,
+            args.dts,
+            # Every rendition is in the same unit, so that they can share a graph.
+            "mbps",
+        )
+
+        gop_start_times = None
+        if is_video:
+            # The same keyframe detection as -gop, on the packets in timestamp order.
+            times = packets[timestamp_field]
+            has_time = ~np.isnan(times)
+            order = np.argsort(times[has_time], kind="stable")
+            gops = calculate_gop_stats(
+                times[has_time][order],
+                packets["size"][has_time][order],
+                packets["keyframe"][has_time][order],
+                framerate,
+            )
+            gop_start_times = gops.start_times
+            data["gop_count"] = len(gops)
+
+    data["profile"] = profiler.summary()
+
+    return Rendition(file_path, x_axis_values, bitrates, gop_start_times, data)
+
+
+def check_gop_alignment(
+    gop_start_times: Dict[str, np.ndarray], tolerance: float
+) -> Dict:
+    """
+    Find the GOP boundaries that are not shared by every rendition.
+
+    The start times of every rendition's GOPs are merged and sorted, and
+    times that are no more than `tolerance` seconds apart are treated as the
+    same boundary. A boundary is aligned if every rendition has a GOP that
+    starts there.
+    """
+    names = list(gop_start_times)
+    times = np.concatenate([gop_start_times[name] for name in names])
+    owners = np.concatenate(
+        [np.full(len(gop_start_times[name]), i) for i, name in enumerate(names)]
+    )
+
+    if not len(times):
+        return {
+            "tolerance_seconds": tolerance,
+            "boundaries": 0,
+            "aligned_boundaries": 0,
+            "misaligned_boundaries": [],
+            "misaligned_per_rendition": {name: 0 for name in names},
+        }
+
+    order = np.argsort(times, kind="stable")
+    times = times[order]
+    owners = owners[order]
+
+    # A new boundary starts wherever the gap to the previous time is too large.
+    boundary_ids = np.cumsum(np.diff(times, prepend=-np.inf) > tolerance) - 1
+    boundary_count = int(boundary_ids[-1]) + 1
+
+    # Which renditions have a GOP starting at each boundary.
+    present = np.zeros((boundary_count, len(names)), dtype=np.bool_)
+    present[boundary_ids, owners] = True
+
+    boundary_starts = np.flatnonzero(np.diff(boundary_ids, prepend=-1))
+    is_aligned = present.all(axis=1)
+
+    misaligned = [
+        {
+            "time": float(times[boundary_starts[i]]),
+            "present_in": [name for j, name in enumerate(names) if present[i, j]],
+            "missing_from": [name for j, name in enumerate(names) if not present[i, j]],
+        }
+        for i in np.flatnonzero(~is_aligned)
+    ]
+
+    return {
+        "tolerance_seconds": tolerance,
+        "boundaries": boundary_count,
+        "aligned_boundaries": int(np.count_nonzero(is_aligned)),
+        "misaligned_boundaries": misaligned,
+        "misaligned_per_rendition": {
+            name: int(np.count_nonzero(present[~is_aligned, j]))
+            for j, name in enumerate(names)
+        },
+    }
+
+
+def _rendition_names(file_paths: Sequence[str]) -> List[str]:
+    """Label every rendition by its filename, or by its path if filenames repeat."""
+    names = [Path(file_path).name for file_path in file_paths]
+
+    if len(set(names)) < len(names):
+        return list(file_paths)
+
+    return names
+
+
+def run_ladder(
+    file_paths: Sequence[str], args, output_dir: Path = LADDER_DIR
+) -> Dict:
+    """
+    Analyse the renditions of an ABR ladder concurrently, one pass per
+    rendition, and compare them.
+
+    Up to `args.jobs` renditions are extracted at once. The per-second
+    bitrates of every rendition are overlaid on one graph, and the GOP
+    boundaries that are not shared by every video rendition are reported
+    in data.json.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    names = dict(zip(file_paths, _rendition_names(file_paths)))
+    jobs = max(1, min(args.jobs, len(file_paths)))
+
+    line()
+    print(f"Analysing a ladder of {len(file_paths)} renditions, {jobs} at a time.")
+    line()
+
+    renditions = {}
+    failed = {}
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(analyse_rendition, file_path, args): file_path
+            for file_path in file_paths
+        }
+
+        for future in as_completed(futures):
+            file_path = futures[future]
+
+            try:
+                renditions[file_path] = future.result()
+                status = "succeeded"
+            except Exception as e:
+                failed[file_path] = f"{type(e).__name__}: {e}"
+                status = "failed"
+
+            print(
+                f"[{len(renditions) + len(failed)}/{len(file_paths)}] {status}: {file_path}"
+            )
+
+    # Keep the order in which the renditions were specified.
+    renditions = {
+        file_path: renditions[file_path]
+        for file_path in file_paths
+        if file_path in renditions
+    }
+
+    gop_start_times = {
+        names[file_path]: rendition.gop_start_times
+        for file_path, rendition in renditions.items()
+        if rendition.gop_start_times is not None
+    }
+
+    data = {
+        "mode": "DTS" if args.dts else "PTS",
+        "renditions": {
+            names[file_path]: {"file": file_path, **rendition.data}
+            for file_path, rendition in renditions.items()
+        },
+        "failed": {names[file_path]: error for file_path, error in failed.items()},
+    }
+
+    if len(gop_start_times) > 1:
+        alignment = check_gop_alignment(gop_start_times, args.alignment_tolerance)
+        data["gop_alignment"] = alignment
+
+        misaligned = len(alignment["misaligned_boundaries"])
+        if misaligned:
+            print(
+                f"! {misaligned} of {alignment['boundaries']} GOP boundaries are not shared by every rendition."
+            )
+        else:
+            print(f"✓ All {alignment['boundaries']} GOP boundaries are aligned.")
+
+    if renditions and not args.no_plot:
+        from rendering import save_ladder_graph
+
+        print("Creating a graph...")
+        save_ladder_graph(
+            "Bitrate ladder",
+            {
+                names[file_path]: (rendition.x_axis_values, rendition.bitrates)
+                for file_path, rendition in renditions.items()
+            },
+            args.graph_type,
+            output_dir.joinpath("ladder_bitrates_graph.png"),
+        )
+
+    with open(output_dir.joinpath("data.json"), "w") as f:
+        json.dump(data, f, indent=4)
+
+    for file_path, error in failed.items():
+        print(f"Failed to analyse {file_path}: {error}")
+
+    print(f"Done! Check out the '{output_dir}' folder.")
+
+    return data
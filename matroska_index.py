@@ -0,0 +1,545 @@
+import os
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from profiling import stage
+
+import numpy as np
+
+# The IDs of the EBML elements that are read.
+EBML = 0x1A45DFA3
+SEGMENT = 0x18538067
+SEEK_HEAD = 0x114D9B74
+INFO = 0x1549A966
+TIMESTAMP_SCALE = 0x2AD7B1
+TRACKS = 0x1654AE6B
+TRACK_ENTRY = 0xAE
+TRACK_NUMBER = 0xD7
+TRACK_TYPE = 0x83
+DEFAULT_DURATION = 0x23E383
+CODEC_DELAY = 0x56AA
+CONTENT_ENCODINGS = 0x6D80
+CONTENT_ENCODING = 0x6240
+CONTENT_COMPRESSION = 0x5034
+CONTENT_COMP_ALGO = 0x4254
+CONTENT_COMP_SETTINGS = 0x4255
+CLUSTER = 0x1F43B675
+CLUSTER_TIMESTAMP = 0xE7
+SIMPLE_BLOCK = 0xA3
+BLOCK_GROUP = 0xA0
+BLOCK = 0xA1
+BLOCK_DURATION = 0x9B
+REFERENCE_BLOCK = 0xFB
+CUES = 0x1C53BB6B
+CHAPTERS = 0x1043A770
+TAGS = 0x1254C367
+ATTACHMENTS = 0x1941A469
+
+# A cluster of unknown size, as written by live encoders, ends where the
+# next top-level element starts.
+TOP_LEVEL_IDS = {SEEK_HEAD, INFO, TRACKS, CLUSTER, CUES, CHAPTERS, TAGS, ATTACHMENTS}
+
+# FFmpeg's codec type for each track type.
+TRACK_TYPE_CODEC_TYPES = {1: "video", 2: "audio", 0x11: "subtitle"}
+
+# Header stripping, where bytes that every frame starts with are stored once
+# in the track header. Any other content encoding changes the frame sizes
+# in a way that cannot be known without reading the frames.
+HEADER_STRIPPING = 3
+
+# Enough bytes for the ID and size of an element, and the header of a block.
+HEADER_READ_SIZE = 16
+
+
+class MatroskaTrack:
+    """The timestamp, size, keyframe flag and position of every frame of one track."""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.number = None
+        self.codec_type = "data"
+        self.default_duration_ns = 0
+        self.codec_delay_ns = 0
+        # The bytes that header stripping removed from the start of every frame.
+        self.stripped_size = 0
+        # Ticks per second, set from the segment's timestamp scale.
+        self.timescale = None
+        # FFmpeg subtracts the codec delay from every timestamp.
+        self.edit_shift = 0
+        # Matroska only stores the PTS. The DTS equals it unless frames are
+        # reordered, in which case FFmpeg derives it from the codec headers.
+        self.has_dts = True
+        # The same columns as the parts of an MP4 track: DTS, composition
+        # offset, size, keyframe flag and position.
+        self.parts: List[Tuple[np.ndarray, ...]] = []
+        self._timestamps: List[float] = []
+        self._sizes: List[int] = []
+        self._keyframes: List[bool] = []
+        self._positions: List[int] = []
+
+    def add_block(
+        self,
+        timestamp: Optional[int],
+        frame_sizes: List[int],
+        keyframe: bool,
+        position: int,
+        block_duration: Optional[int],
+        timestamp_scale: int,
+    ):
+        """
+        Add the frames of a block. Like FFmpeg, the frames of a laced block
+        are spread over the block's duration, and have no timestamp if the
+        duration is unknown.
+        """
+        laces = len(frame_sizes)
+
+        if not block_duration and self.default_duration_ns:
+            block_duration = self.default_duration_ns * laces // timestamp_scale
+
+        for n, frame_size in enumerate(frame_sizes):
+            self._timestamps.append(float("nan") if timestamp is None else timestamp)
+            self._sizes.append(frame_size + self.stripped_size)
+            self._keyframes.append(keyframe)
+            self._positions.append(position)
+
+            if timestamp is not None:
+                lace_duration = (
+                    block_duration * (n + 1) // laces - block_duration * n // laces
+                    if block_duration
+                    else 0
+                )
+                timestamp = timestamp + lace_duration if lace_duration else None
+
+    def finish(self, timestamp_scale: int):
+        self.timescale = 1_000_000_000 / timestamp_scale
+        # Rounded to the nearest tick, with halves rounded up, as FFmpeg does.
+        self.edit_shift = -((self.codec_delay_ns * 2 + timestamp_scale) // (2 * timestamp_scale))
+
+        if not self._sizes:
+            return
+
+        timestamps = np.array(self._timestamps, dtype=np.float64)
+        known = timestamps[~np.isnan(timestamps)]
+        self.has_dts = bool(np.all(np.diff(known) >= 0))
+
+        self.parts.append(
+            (
+                timestamps,
+                np.zeros(len(timestamps), dtype=np.int64),
+                np.array(self._sizes, dtype=np.int64),
+                np.array(self._keyframes, dtype=np.bool_),
+                np.array(self._positions, dtype=np.int64),
+            )
+        )
+        self._timestamps, self._sizes, self._keyframes, self._positions = [], [], [], []
+
+
+def _read_vint(data: bytes, offset: int, keep_marker: bool = False) -> Tuple[Optional[int], int]:
+    """
+    Read a variable-length integer. Returns its value, or None if every
+    value bit is set (an unknown size), and its length in bytes.
+    """
+    first = data[offset]
+    if first == 0:
+        raise ValueError("Invalid EBML variable-length integer")
+
+    length = 9 - first.bit_length()
+    if offset + length > len(data):
+        raise IndexError("Truncated EBML variable-length integer")
+
+    value = first if keep_marker else first & (0xFF >> length)
+    for byte in data[offset + 1 : offset + length]:
+        value = (value << 8) | byte
+
+    if not keep_marker and value == (1 << (7 * length)) - 1:
+        return None, length
+
+    return value, length
+
+
+def _read_element_header(data: bytes, offset: int = 0) -> Tuple[int, Optional[int], int]:
+    """The ID and size of the element at `offset`, and the length of its header."""
+    element_id, id_length = _read_vint(data, offset, keep_marker=True)
+    size, size_length = _read_vint(data, offset + id_length)
+    return element_id, size, id_length + size_length
+
+
+def iter_elements(data: bytes) -> Iterator[Tuple[int, bytes]]:
+    """Yield the ID and data of every element in `data`."""
+    position = 0
+
+    while position < len(data):
+        element_id, size, header_length = _read_element_header(data, position)
+        start = position + header_length
+
+        if size is None or start + size > len(data):
+            raise ValueError(f"Invalid size of the element {element_id:#x}")
+
+        yield element_id, data[start : start + size]
+        position = start + size
+
+
+def _uint(data: bytes) -> int:
+    return int.from_bytes(data, "big")
+
+
+class _Reader:
+    """Reads small parts of a file by position, counting the bytes read."""
+
+    def __init__(self, f: BinaryIO, file_size: int):
+        self._f = f
+        self.file_size = file_size
+        self.bytes_read = 0
+
+    def read(self, position: int, size: int) -> bytes:
+        self._f.seek(position)
+        data = self._f.read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+def _read_track_entry(index: int, data: bytes) -> MatroskaTrack:
+    track = MatroskaTrack(index)
+
+    for element_id, value in iter_elements(data):
+        if element_id == TRACK_NUMBER:
+            track.number = _uint(value)
+        elif element_id == TRACK_TYPE:
+            track.codec_type = TRACK_TYPE_CODEC_TYPES.get(_uint(value), "data")
+        elif element_id == DEFAULT_DURATION:
+            track.default_duration_ns = _uint(value)
+        elif element_id == CODEC_DELAY:
+            track.codec_delay_ns = _uint(value)
+        elif element_id == CONTENT_ENCODINGS:
+            track.stripped_size = _stripped_size(value)
+
+    return track
+
+
+def _stripped_size(content_encodings: bytes) -> int:
+    stripped_size = 0
+
+    for _, content_encoding in iter_elements(content_encodings):
+        compression = dict(iter_elements(content_encoding)).get(CONTENT_COMPRESSION)
+        settings = dict(iter_elements(compression or b""))
+
+        # The default compression algorithm is zlib.
+        if compression is None or _uint(settings.get(CONTENT_COMP_ALGO, b"")) != HEADER_STRIPPING:
+            raise ValueError("Tracks that are compressed or encrypted are not supported")
+
+        stripped_size += len(settings.get(CONTENT_COMP_SETTINGS, b""))
+
+    return stripped_size
+
+
+def _lace_sizes(reader: _Reader, position: int, size: int, lacing: int) -> List[int]:
+    """The size of every frame in a laced block, from the lace header at `position`."""
+    read_size = min(size, 256)
+
+    while True:
+        data = reader.read(position, read_size)
+
+        try:
+            return _parse_lace_sizes(data, size, lacing)
+        except IndexError:
+            if read_size >= size:
+                raise ValueError("Invalid lace header")
+            read_size = min(size, read_size * 4)
+
+
+def _parse_lace_sizes(data: bytes, size: int, lacing: int) -> List[int]:
+    count = data[0] + 1
+    offset = 1
+    sizes = []
+
+    if lacing == 2:
+        # Fixed-size lacing.
+        return [(size - 1) // count] * count
+
+    if lacing == 1:
+        # Xiph lacing, where each size is a run of 255s and the byte after them.
+        for _ in range(count - 1):
+            frame_size = 0
+            while True:
+                byte = data[offset]
+                offset += 1
+                frame_size += byte
+                if byte != 255:
+                    break
+            sizes.append(frame_size)
+    else:
+        # EBML lacing, where each size after the first is a signed difference.
+        frame_size, length = _read_vint(data, offset)
+        offset += length
+        sizes.append(frame_size)
+
+        for _ in range(count - 2):
+            raw, length = _read_vint(data, offset, keep_marker=True)
+            offset += length
+            frame_size += (raw & ((1 << (7 * length)) - 1)) - ((1 << (7 * length - 1)) - 1)
+            sizes.append(frame_size)
+
+    sizes.append(size - offset - sum(sizes))
+    if min(sizes) < 0:
+        raise ValueError("Invalid lace sizes")
+
+    return sizes
+
+
+def _read_block(
+    reader: _Reader,
+    header: bytes,
+    position: int,
+    size: int,
+    cluster_timestamp: Optional[int],
+    tracks: Dict[int, MatroskaTrack],
+    timestamp_scale: int,
+    keyframe: Optional[bool] = None,
+    block_duration: Optional[int] = None,
+):
+    """
+    Add the frames of the block whose data starts at `position`, from its
+    first bytes, `header`. `keyframe` is None for a SimpleBlock, which has a
+    keyframe flag.
+    """
+    track_number, track_length = _read_vint(header, 0)
+    track = tracks.get(track_number)
+    if track is None:
+        return
+
+    relative_timestamp = int.from_bytes(
+        header[track_length : track_length + 2], "big", signed=True
+    )
+    flags = header[track_length + 2]
+    header_length = track_length + 3
+
+    timestamp = None
+    if cluster_timestamp is not None and cluster_timestamp + relative_timestamp >= 0:
+        timestamp = cluster_timestamp + relative_timestamp
+
+    if keyframe is None:
+        keyframe = bool(flags & 0x80)
+
+    lacing = (flags >> 1) & 3
+    frame_sizes = (
+        [size - header_length]
+        if lacing == 0
+        else _lace_sizes(reader, position + header_length, size - header_length, lacing)
+    )
+
+    track.add_block(
+        timestamp, frame_sizes, keyframe, position, block_duration, timestamp_scale
+    )
+
+
+def _read_element_data(
+    reader: _Reader, header: bytes, header_length: int, position: int, size: int
+) -> bytes:
+    """The data of a small element, from its header's bytes if they include it."""
+    if header_length + size <= len(header):
+        return header[header_length : header_length + size]
+
+    return reader.read(position + header_length, size)
+
+
+def _read_block_group(
+    reader: _Reader,
+    position: int,
+    size: int,
+    cluster_timestamp: Optional[int],
+    tracks: Dict[int, MatroskaTrack],
+    timestamp_scale: int,
+):
+    """
+    Read the elements of a BlockGroup, seeking past the data of its Block.
+    A block without a ReferenceBlock is a keyframe.
+    """
+    end = position + size
+    block = None
+    block_duration = None
+    keyframe = True
+
+    while position < end:
+        header = reader.read(position, min(HEADER_READ_SIZE, end - position))
+        element_id, element_size, header_length = _read_element_header(header)
+
+        if element_size is None or position + header_length + element_size > end:
+            raise ValueError("Invalid size of an element in a BlockGroup")
+
+        if element_id == BLOCK:
+            block = (header[header_length:], position + header_length, element_size)
+        elif element_id == BLOCK_DURATION:
+            block_duration = _uint(
+                _read_element_data(reader, header, header_length, position, element_size)
+            )
+        elif element_id == REFERENCE_BLOCK:
+            keyframe = False
+
+        position += header_length + element_size
+
+    if block is not None:
+        block_header, block_position, block_size = block
+        _read_block(
+            reader,
+            block_header,
+            block_position,
+            block_size,
+            cluster_timestamp,
+            tracks,
+            timestamp_scale,
+            keyframe,
+            block_duration,
+        )
+
+
+def _scan_cluster(
+    reader: _Reader,
+    start: int,
+    size: Optional[int],
+    end: int,
+    tracks: Dict[int, MatroskaTrack],
+    timestamp_scale: int,
+) -> int:
+    """
+    Read the timestamp and the header of every block in the cluster whose
+    data starts at `start`, seeking past the frames. Returns where the
+    cluster ends.
+    """
+    if size is not None:
+        end = min(start + size, end)
+
+    cluster_timestamp = None
+    position = start
+
+    while position < end:
+        header = reader.read(position, min(HEADER_READ_SIZE, end - position))
+
+        try:
+            element_id, element_size, header_length = _read_element_header(header)
+        except IndexError:
+            # The file ends part of the way through an element header.
+            return end
+
+        if size is None and element_id in TOP_LEVEL_IDS:
+            return position
+
+        if element_size is None:
+            raise ValueError(f"Invalid size of the element {element_id:#x} in a cluster")
+
+        data_start = position + header_length
+
+        # The last block of a file that is still being written can be incomplete.
+        if data_start + element_size > reader.file_size:
+            return end
+
+        if element_id == CLUSTER_TIMESTAMP:
+            cluster_timestamp = _uint(
+                _read_element_data(reader, header, header_length, position, element_size)
+            )
+        elif element_id == SIMPLE_BLOCK:
+            _read_block(
+                reader,
+                header[header_length:],
+                data_start,
+                element_size,
+                cluster_timestamp,
+                tracks,
+                timestamp_scale,
+            )
+        elif element_id == BLOCK_GROUP:
+            _read_block_group(
+                reader,
+                data_start,
+                element_size,
+                cluster_timestamp,
+                tracks,
+                timestamp_scale,
+            )
+
+        position = data_start + element_size
+
+    return end
+
+
+def read_tracks(file_path: str) -> Optional[List[MatroskaTrack]]:
+    """
+    Read the frames of every track of a Matroska or WebM file from the
+    headers of its blocks, seeking past the frames themselves. Returns None
+    if the file is not a Matroska or WebM file, and raises ValueError if it
+    cannot be read.
+    """
+    file_size = os.path.getsize(file_path)
+
+    # Unbuffered, so that only the bytes of the headers are read from disk.
+    with open(file_path, "rb", buffering=0) as f, stage("read block headers") as counter:
+        reader = _Reader(f, file_size)
+        header = reader.read(0, HEADER_READ_SIZE)
+
+        if len(header) < 4 or _uint(header[:4]) != EBML:
+            return None
+
+        # The segment follows the EBML header.
+        _, size, header_length = _read_element_header(header)
+        segment_position = header_length + size
+        element_id, segment_size, header_length = _read_element_header(
+            reader.read(segment_position, HEADER_READ_SIZE)
+        )
+        if element_id != SEGMENT:
+            raise ValueError("The file has no segment")
+
+        position = segment_position + header_length
+        segment_end = (
+            file_size
+            if segment_size is None
+            else min(position + segment_size, file_size)
+        )
+
+        timestamp_scale = 1_000_000
+        tracks = None
+        tracks_by_number: Dict[int, MatroskaTrack] = {}
+
+        while position < segment_end:
+            header = reader.read(position, min(HEADER_READ_SIZE, segment_end - position))
+
+            try:
+                element_id, size, header_length = _read_element_header(header)
+            except IndexError:
+                break
+
+            data_start = position + header_length
+
+            if element_id == CLUSTER:
+                if tracks is None:
+                    raise ValueError("A cluster comes before the tracks")
+
+                position = _scan_cluster(
+                    reader, data_start, size, segment_end, tracks_by_number, timestamp_scale
+                )
+                continue
+
+            if size is None:
+                raise ValueError(f"Invalid size of the element {element_id:#x}")
+
+            if element_id == INFO:
+                info = dict(iter_elements(reader.read(data_start, size)))
+                if TIMESTAMP_SCALE in info:
+                    timestamp_scale = _uint(info[TIMESTAMP_SCALE])
+            elif element_id == TRACKS and tracks is None:
+                entries = [
+                    entry
+                    for child_id, entry in iter_elements(reader.read(data_start, size))
+                    if child_id == TRACK_ENTRY
+                ]
+                tracks = [_read_track_entry(index, entry) for index, entry in enumerate(entries)]
+                tracks_by_number = {track.number: track for track in tracks}
+
+            position = data_start + size
+
+        counter.items = reader.bytes_read
+
+    if tracks is None:
+        raise ValueError("The file has no tracks")
+
+    for track in tracks:
+        track.finish(timestamp_scale)
+
+    return tracks
@@ -0,0 +1,112 @@
+from collections import OrderedDict
+import json
+import os
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from profiling import stage
+
+from ffmpeg import probe
+
+DEFAULT_CACHE_FILE = Path.home().joinpath(".cache", "bitrate-plotter", "metadata.json")
+
+
+def file_identity(file_path) -> Tuple[str, int, int]:
+    """Identify a file by its absolute path, size and modification time."""
+    stat = os.stat(file_path)
+    return str(Path(file_path).resolve()), stat.st_size, stat.st_mtime_ns
+
+
+class MetadataCache:
+    """
+    Stores the output of `ffmpeg.probe()` so that every file is only probed once.
+
+    Entries are keyed on (path, size, mtime), so a file that has been modified
+    is probed again. If `cache_file` is specified, entries are also persisted
+    as JSON, which lets repeated runs skip probing entirely. The least recently
+    used entries are evicted once there are more than `max_entries`.
+    """
+
+    def __init__(self, cache_file: Optional[Path] = None, max_entries: int = 512):
+        if max_entries < 1:
+            raise ValueError(f"max_entries must be at least 1, got {max_entries}")
+
+        self._cache_file = Path(cache_file) if cache_file else None
+        self._max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._loaded = False
+
+    @staticmethod
+    def _key(identity: Tuple[str, int, int]) -> str:
+        return "|".join(str(part) for part in identity)
+
+    def _load(self):
+        self._loaded = True
+
+        if not self._cache_file or not self._cache_file.is_file():
+            return
+
+        try:
+            with open(self._cache_file, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            # A corrupt or unreadable cache is treated as an empty one.
+            return
+
+        if isinstance(entries, dict):
+            self._entries.update(entries)
+
+    def _save(self):
+        if not self._cache_file:
+            return
+
+        try:
+            os.makedirs(self._cache_file.parent, exist_ok=True)
+            temp_file = self._cache_file.with_name(
+                f"{self._cache_file.name}.{os.getpid()}.tmp"
+            )
+            with open(temp_file, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f)
+            os.replace(temp_file, self._cache_file)
+        except OSError as e:
+            print(f"Warning: Unable to write the metadata cache: {e}")
+
+    def get(self, file_path) -> Optional[Dict]:
+        """Return the cached metadata of `file_path`, or None if it has not been probed."""
+        if not self._loaded:
+            self._load()
+
+        key = self._key(file_identity(file_path))
+
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+        return None
+
+    def put(self, file_path, metadata: Dict):
+        """Cache the metadata of `file_path`, e.g. after probing it elsewhere."""
+        if not self._loaded:
+            self._load()
+
+        self._entries[self._key(file_identity(file_path))] = metadata
+
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+        self._save()
+
+    def probe(self, file_path) -> Dict:
+        """Return the ffprobe format and stream metadata of `file_path`."""
+        metadata = self.get(file_path)
+
+        if metadata is None:
+            with stage("probe metadata", 1):
+                metadata = probe(file_path)
+            self.put(file_path, metadata)
+
+        return metadata
+
+
+# Used when no cache is passed to FileInfoProvider or VideoInfoProvider.
+in_memory_cache = MetadataCache()
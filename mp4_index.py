@@ -0,0 +1,489 @@
+import os
+import struct
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+
+from profiling import stage
+
+import numpy as np
+
+# The top-level boxes that an MP4/MOV file can start with. Any other start
+# means that the file is in another container, which FFprobe handles.
+LEADING_BOX_TYPES = {b"ftyp", b"moov", b"mdat", b"free", b"skip", b"wide", b"pnot"}
+
+# FFmpeg's codec type for each track handler.
+HANDLER_CODEC_TYPES = {
+    b"vide": "video",
+    b"soun": "audio",
+    b"subt": "subtitle",
+    b"sbtl": "subtitle",
+    b"text": "subtitle",
+}
+
+# Track fragment header (tfhd) flags.
+TFHD_BASE_DATA_OFFSET = 0x1
+TFHD_SAMPLE_DESCRIPTION_INDEX = 0x2
+TFHD_DEFAULT_SAMPLE_DURATION = 0x8
+TFHD_DEFAULT_SAMPLE_SIZE = 0x10
+TFHD_DEFAULT_SAMPLE_FLAGS = 0x20
+TFHD_DEFAULT_BASE_IS_MOOF = 0x20000
+
+# Track run (trun) flags.
+TRUN_DATA_OFFSET = 0x1
+TRUN_FIRST_SAMPLE_FLAGS = 0x4
+TRUN_SAMPLE_DURATION = 0x100
+TRUN_SAMPLE_SIZE = 0x200
+TRUN_SAMPLE_FLAGS = 0x400
+TRUN_SAMPLE_COMPOSITION_TIME_OFFSET = 0x800
+
+# A sample that is not a sync sample, or that depends on other samples.
+SAMPLE_FLAGS_NOT_KEYFRAME = 0x10000 | 0x1000000
+
+
+class Mp4Track:
+    """The sample tables of one trak, and the samples of its fragments."""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.track_id = None
+        self.timescale = None
+        self.codec_type = "data"
+        # MP4 stores the DTS of every sample, and the PTS as an offset from it.
+        self.has_dts = True
+        # Added to every DTS and PTS, in the track's timescale, by the edit list.
+        self.edit_shift = 0
+        # The trex defaults of fragmented files.
+        self.default_duration = 0
+        self.default_size = 0
+        self.default_flags = 0
+        # The DTS, composition offset, size, keyframe flag and position of
+        # every sample, as one array per part: the moov sample tables and
+        # every track run.
+        self.parts: List[Tuple[np.ndarray, ...]] = []
+        # The DTS that the next fragment continues from if it has no tfdt.
+        self.next_dts = 0
+
+
+def _full_box_header(payload: memoryview) -> Tuple[int, int]:
+    """The version and flags of a full box."""
+    return payload[0], int.from_bytes(payload[1:4], "big")
+
+
+def iter_boxes(data: memoryview) -> Iterator[Tuple[bytes, memoryview]]:
+    """Yield the type and payload of every box in `data`."""
+    position = 0
+
+    while position + 8 <= len(data):
+        size, box_type = struct.unpack_from(">I4s", data, position)
+        header_size = 8
+
+        if size == 1:
+            (size,) = struct.unpack_from(">Q", data, position + 8)
+            header_size = 16
+        elif size == 0:
+            size = len(data) - position
+
+        if size < header_size or position + size > len(data):
+            raise ValueError(f"Invalid size of the '{box_type.decode('latin-1')}' box")
+
+        yield box_type, data[position + header_size : position + size]
+        position += size
+
+
+def _iter_top_level_boxes(f: BinaryIO, file_size: int) -> Iterator[Tuple[bytes, int, int, int]]:
+    """
+    Yield the type, position, header size and payload size of every top-level
+    box, seeking past each one instead of reading it.
+    """
+    position = 0
+
+    while position + 8 <= file_size:
+        f.seek(position)
+        header = f.read(16)
+        size, box_type = struct.unpack_from(">I4s", header)
+        header_size = 8
+
+        if size == 1:
+            (size,) = struct.unpack_from(">Q", header, 8)
+            header_size = 16
+        elif size == 0:
+            size = file_size - position
+
+        if size < header_size:
+            raise ValueError(f"Invalid size of the '{box_type.decode('latin-1')}' box")
+
+        # A file that is still being written can end in a partial box.
+        yield box_type, position, header_size, min(size, file_size - position) - header_size
+        position += size
+
+
+def _read_table(payload: memoryview, dtype: str, columns: int, offset: int = 8) -> np.ndarray:
+    """Read the entry count at `offset` - 4 and the table of entries that follows it."""
+    (count,) = struct.unpack_from(">I", payload, offset - 4)
+
+    if offset + count * columns * np.dtype(dtype).itemsize > len(payload):
+        raise ValueError("A sample table is truncated")
+
+    table = np.frombuffer(payload, dtype, count * columns, offset).astype(np.int64)
+    return table.reshape(count, columns) if columns > 1 else table
+
+
+def _expand_runs(counts: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Expand a run-length encoded table, such as stts or ctts, to one value per sample."""
+    return np.repeat(values, counts)
+
+
+def _sample_sizes(box_type: bytes, payload: memoryview) -> np.ndarray:
+    if box_type == b"stsz":
+        sample_size, count = struct.unpack_from(">II", payload, 4)
+        if sample_size:
+            return np.full(count, sample_size, dtype=np.int64)
+
+        return _read_table(payload, ">u4", 1, 12)
+
+    # stz2, where sizes can be 4, 8 or 16 bits long.
+    field_size = payload[7]
+    (count,) = struct.unpack_from(">I", payload, 8)
+
+    if field_size == 4:
+        nibbles = np.frombuffer(payload, np.uint8, (count + 1) // 2, 12)
+        return np.column_stack((nibbles >> 4, nibbles & 0xF)).ravel()[:count].astype(np.int64)
+    if field_size in (8, 16):
+        return np.frombuffer(payload, f">u{field_size // 8}", count, 12).astype(np.int64)
+
+    raise ValueError(f"Invalid stz2 field size: {field_size}")
+
+
+def _sample_positions(
+    sizes: np.ndarray, chunk_offsets: np.ndarray, sample_to_chunk: np.ndarray
+) -> np.ndarray:
+    """
+    The position of every sample: its chunk's offset plus the sizes of the
+    samples before it in the chunk.
+    """
+    chunk_count = len(chunk_offsets)
+    if not len(sizes) or not chunk_count or not len(sample_to_chunk):
+        return np.full(len(sizes), -1, dtype=np.int64)
+
+    # stsc lists the first chunk (1-based) of every run of chunks that have
+    # the same number of samples.
+    first_chunks = np.append(sample_to_chunk[:, 0] - 1, chunk_count)
+    samples_per_chunk = np.repeat(
+        sample_to_chunk[:, 1], np.maximum(np.diff(first_chunks), 0)
+    )[:chunk_count]
+
+    sample_chunks = np.repeat(np.arange(len(samples_per_chunk)), samples_per_chunk)[: len(sizes)]
+    if len(sample_chunks) < len(sizes):
+        raise ValueError("The sample-to-chunk table does not cover every sample")
+
+    chunk_first_samples = np.cumsum(samples_per_chunk) - samples_per_chunk
+    offsets_in_file = np.cumsum(sizes) - sizes
+    offsets_in_chunk = offsets_in_file - offsets_in_file[chunk_first_samples[sample_chunks]]
+
+    return chunk_offsets[sample_chunks] + offsets_in_chunk
+
+
+def _read_sample_tables(track: Mp4Track, stbl: memoryview):
+    boxes = dict(iter_boxes(stbl))
+
+    size_box = b"stsz" if b"stsz" in boxes else b"stz2"
+    if size_box not in boxes or b"stts" not in boxes:
+        raise ValueError("A track has no sample size or time-to-sample table")
+
+    sizes = _sample_sizes(size_box, boxes[size_box])
+    count = len(sizes)
+
+    time_to_sample = _read_table(boxes[b"stts"], ">u4", 2)
+    durations = _expand_runs(time_to_sample[:, 0], time_to_sample[:, 1])[:count]
+    if len(durations) < count:
+        raise ValueError("The time-to-sample table does not cover every sample")
+
+    dts = np.cumsum(durations) - durations
+    track.next_dts = int(dts[-1] + durations[-1]) if count else 0
+
+    # The offsets are signed, as some muxers write negative offsets in version 0 boxes.
+    composition_offsets = np.zeros(count, dtype=np.int64)
+    if b"ctts" in boxes:
+        offsets = _read_table(boxes[b"ctts"], ">i4", 2)
+        expanded = _expand_runs(offsets[:, 0], offsets[:, 1])[:count]
+        composition_offsets[: len(expanded)] = expanded
+
+    # Without a sync sample table, every sample is a keyframe.
+    if b"stss" in boxes:
+        keyframes = np.zeros(count, dtype=np.bool_)
+        sync_samples = _read_table(boxes[b"stss"], ">u4", 1) - 1
+        keyframes[sync_samples[(sync_samples >= 0) & (sync_samples < count)]] = True
+    else:
+        keyframes = np.ones(count, dtype=np.bool_)
+
+    chunk_offsets = np.empty(0, dtype=np.int64)
+    if b"stco" in boxes:
+        chunk_offsets = _read_table(boxes[b"stco"], ">u4", 1)
+    elif b"co64" in boxes:
+        chunk_offsets = _read_table(boxes[b"co64"], ">u8", 1)
+
+    sample_to_chunk = (
+        _read_table(boxes[b"stsc"], ">u4", 3) if b"stsc" in boxes else np.empty((0, 3), np.int64)
+    )
+
+    if count:
+        track.parts.append(
+            (
+                dts,
+                composition_offsets,
+                sizes,
+                keyframes,
+                _sample_positions(sizes, chunk_offsets, sample_to_chunk),
+            )
+        )
+
+
+def _read_edit_list(track: Mp4Track, elst: memoryview, movie_timescale: int):
+    """
+    Work out the shift that the edit list applies to the track's timestamps.
+    Only the common edit lists are supported: any number of empty edits
+    followed by one edit that starts at `media_time`.
+    """
+    version, _ = _full_box_header(elst)
+    entry_dtype = (
+        [("duration", ">u8"), ("media_time", ">i8"), ("rate", ">i4")]
+        if version == 1
+        else [("duration", ">u4"), ("media_time", ">i4"), ("rate", ">i4")]
+    )
+    (count,) = struct.unpack_from(">I", elst, 4)
+    entries = np.frombuffer(elst, entry_dtype, count, 8)
+
+    is_empty = entries["media_time"] == -1
+    if np.count_nonzero(~is_empty) > 1 or (count and is_empty[-1] and count > 1):
+        raise ValueError("Edit lists with more than one edit are not supported")
+
+    empty_duration = int(entries["duration"][is_empty].sum())
+    media_time = int(entries["media_time"][~is_empty][0]) if np.any(~is_empty) else 0
+
+    track.edit_shift = -media_time
+    if movie_timescale:
+        track.edit_shift += empty_duration * (track.timescale or movie_timescale) // movie_timescale
+
+
+def _read_trak(index: int, trak: memoryview, movie_timescale: int) -> Mp4Track:
+    track = Mp4Track(index)
+    boxes = dict(iter_boxes(trak))
+
+    if b"tkhd" in boxes:
+        version, _ = _full_box_header(boxes[b"tkhd"])
+        (track.track_id,) = struct.unpack_from(">I", boxes[b"tkhd"], 20 if version == 1 else 12)
+
+    mdia = dict(iter_boxes(boxes.get(b"mdia", b"")))
+    if b"mdhd" not in mdia:
+        raise ValueError("A track has no media header")
+
+    version, _ = _full_box_header(mdia[b"mdhd"])
+    (track.timescale,) = struct.unpack_from(">I", mdia[b"mdhd"], 20 if version == 1 else 12)
+
+    if b"hdlr" in mdia:
+        track.codec_type = HANDLER_CODEC_TYPES.get(bytes(mdia[b"hdlr"][8:12]), "data")
+
+    minf = dict(iter_boxes(mdia.get(b"minf", b"")))
+    if b"stbl" in minf:
+        _read_sample_tables(track, minf[b"stbl"])
+
+    edts = dict(iter_boxes(boxes.get(b"edts", b"")))
+    if b"elst" in edts:
+        _read_edit_list(track, edts[b"elst"], movie_timescale)
+
+    return track
+
+
+def _read_moov(moov: memoryview) -> List[Mp4Track]:
+    movie_timescale = 0
+    tracks = []
+
+    for box_type, payload in iter_boxes(moov):
+        if box_type == b"mvhd":
+            version, _ = _full_box_header(payload)
+            (movie_timescale,) = struct.unpack_from(">I", payload, 20 if version == 1 else 12)
+        elif box_type == b"trak":
+            tracks.append(_read_trak(len(tracks), payload, movie_timescale))
+        elif box_type == b"mvex":
+            tracks_by_id = {track.track_id: track for track in tracks}
+
+            for child_type, child in iter_boxes(payload):
+                if child_type != b"trex":
+                    continue
+
+                track_id, _, duration, size, flags = struct.unpack_from(">5I", child, 4)
+                if track_id in tracks_by_id:
+                    track = tracks_by_id[track_id]
+                    track.default_duration = duration
+                    track.default_size = size
+                    track.default_flags = flags
+
+    return tracks
+
+
+def _read_trun(
+    trun: memoryview,
+    base_dts: int,
+    data_offset: int,
+    default_duration: int,
+    default_size: int,
+    default_flags: int,
+) -> Tuple[Tuple[np.ndarray, ...], int, int]:
+    """
+    Read the samples of a track run. Returns them with the DTS and position
+    that follow the run.
+    """
+    _, flags = _full_box_header(trun)
+    (count,) = struct.unpack_from(">I", trun, 4)
+    position = 8
+
+    if flags & TRUN_DATA_OFFSET:
+        (relative_offset,) = struct.unpack_from(">i", trun, position)
+        data_offset += relative_offset
+        position += 4
+
+    first_sample_flags = None
+    if flags & TRUN_FIRST_SAMPLE_FLAGS:
+        (first_sample_flags,) = struct.unpack_from(">I", trun, position)
+        position += 4
+
+    present = [
+        flag
+        for flag in (
+            TRUN_SAMPLE_DURATION,
+            TRUN_SAMPLE_SIZE,
+            TRUN_SAMPLE_FLAGS,
+            TRUN_SAMPLE_COMPOSITION_TIME_OFFSET,
+        )
+        if flags & flag
+    ]
+
+    if position + count * 4 * len(present) > len(trun):
+        raise ValueError("A track run is truncated")
+
+    table = np.frombuffer(trun, ">u4", count * len(present), position).reshape(count, len(present))
+
+    def column(flag: int, default: int) -> np.ndarray:
+        if flag in present:
+            return table[:, present.index(flag)].astype(np.int64)
+        return np.full(count, default, dtype=np.int64)
+
+    durations = column(TRUN_SAMPLE_DURATION, default_duration)
+    sizes = column(TRUN_SAMPLE_SIZE, default_size)
+    sample_flags = column(TRUN_SAMPLE_FLAGS, default_flags)
+    if first_sample_flags is not None and count:
+        sample_flags[0] = first_sample_flags
+
+    # The offsets are signed in version 1 boxes, and FFmpeg also reads them
+    # as signed in version 0 boxes.
+    composition_offsets = (
+        table[:, present.index(TRUN_SAMPLE_COMPOSITION_TIME_OFFSET)].view(">i4").astype(np.int64)
+        if TRUN_SAMPLE_COMPOSITION_TIME_OFFSET in present
+        else np.zeros(count, dtype=np.int64)
+    )
+
+    dts = base_dts + np.cumsum(durations) - durations
+    positions = data_offset + np.cumsum(sizes) - sizes
+    keyframes = (sample_flags & SAMPLE_FLAGS_NOT_KEYFRAME) == 0
+
+    return (
+        (dts, composition_offsets, sizes, keyframes, positions),
+        base_dts + int(durations.sum()),
+        data_offset + int(sizes.sum()),
+    )
+
+
+def _read_moof(moof: memoryview, moof_position: int, tracks: List[Mp4Track]):
+    tracks_by_id = {track.track_id: track for track in tracks}
+    # Without a base data offset, a track fragment's data follows that of the
+    # previous one, starting at the moof box.
+    implicit_offset = moof_position
+
+    for box_type, traf in iter_boxes(moof):
+        if box_type != b"traf":
+            continue
+
+        boxes = list(iter_boxes(traf))
+        tfhd = next((payload for child_type, payload in boxes if child_type == b"tfhd"), None)
+        if tfhd is None:
+            raise ValueError("A track fragment has no header")
+
+        _, flags = _full_box_header(tfhd)
+        (track_id,) = struct.unpack_from(">I", tfhd, 4)
+        track = tracks_by_id.get(track_id)
+        if track is None:
+            raise ValueError(f"A track fragment refers to an unknown track: {track_id}")
+
+        position = 8
+        base_data_offset = implicit_offset
+        if flags & TFHD_BASE_DATA_OFFSET:
+            (base_data_offset,) = struct.unpack_from(">Q", tfhd, position)
+            position += 8
+        elif flags & TFHD_DEFAULT_BASE_IS_MOOF:
+            base_data_offset = moof_position
+
+        if flags & TFHD_SAMPLE_DESCRIPTION_INDEX:
+            position += 4
+
+        defaults = []
+        for flag, default in (
+            (TFHD_DEFAULT_SAMPLE_DURATION, track.default_duration),
+            (TFHD_DEFAULT_SAMPLE_SIZE, track.default_size),
+            (TFHD_DEFAULT_SAMPLE_FLAGS, track.default_flags),
+        ):
+            if flags & flag:
+                (default,) = struct.unpack_from(">I", tfhd, position)
+                position += 4
+            defaults.append(default)
+
+        dts = track.next_dts
+        data_offset = base_data_offset
+
+        for child_type, payload in boxes:
+            if child_type == b"tfdt":
+                version, _ = _full_box_header(payload)
+                (dts,) = struct.unpack_from(">Q" if version == 1 else ">I", payload, 4)
+            elif child_type == b"trun":
+                part, dts, data_offset = _read_trun(payload, dts, data_offset, *defaults)
+                if len(part[0]):
+                    track.parts.append(part)
+
+        track.next_dts = dts
+        implicit_offset = data_offset
+
+
+def read_tracks(file_path: str) -> Optional[List[Mp4Track]]:
+    """
+    Read the sample tables of every track of an MP4/MOV file, including the
+    track runs of a fragmented file. Only the moov and moof boxes are read;
+    the media data is skipped over. Returns None if the file is not an MP4
+    or MOV file, and raises ValueError if it cannot be read.
+    """
+    file_size = os.path.getsize(file_path)
+    tracks = None
+
+    with open(file_path, "rb") as f, stage("read sample tables") as counter:
+        if f.read(8)[4:] not in LEADING_BOX_TYPES:
+            return None
+
+        for box_type, position, header_size, payload_size in _iter_top_level_boxes(
+            f, file_size
+        ):
+            if box_type not in (b"moov", b"moof"):
+                continue
+
+            f.seek(position + header_size)
+            payload = memoryview(f.read(payload_size))
+            counter.items += len(payload)
+
+            if box_type == b"moov":
+                tracks = _read_moov(payload)
+            elif tracks is None:
+                raise ValueError("A moof box comes before the moov box")
+            else:
+                _read_moof(payload, position, tracks)
+
+    if tracks is None:
+        raise ValueError("The file has no moov box")
+
+    return tracks
+
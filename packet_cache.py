@@ -0,0 +1,118 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+import shutil
+from typing import Optional
+
+from metadata_cache import file_identity
+from packet_reader import FIELD_ORDER, PacketColumns
+
+import numpy as np
+
+# Every field is extracted when the cache is used, so that one extraction
+# serves PTS and DTS, per-second and GOP analysis.
+CACHED_FIELDS = FIELD_ORDER
+
+CACHE_VERSION = 1
+
+
+class PacketCache:
+    """
+    Stores extracted packet columns as .npy files so that re-runs on an
+    unchanged file can skip FFprobe entirely.
+
+    Each entry is a directory keyed on the file's identity (path, size and
+    mtime) and the stream specifier. Columns are loaded memory-mapped, so
+    only the pages that the analysis touches are read from disk.
+    """
+
+    def __init__(self, cache_dir: Path):
+        self._cache_dir = Path(cache_dir)
+
+    @staticmethod
+    def _selection(stream_specifier: Optional[str]) -> str:
+        return stream_specifier or "all streams"
+
+    def _entry_dir(self, file_path: str, stream_specifier: Optional[str]) -> Path:
+        key = json.dumps(
+            [file_identity(file_path), self._selection(stream_specifier), CACHE_VERSION]
+        )
+        return self._cache_dir.joinpath(hashlib.sha1(key.encode()).hexdigest()[:16])
+
+    def load(
+        self, file_path: str, stream_specifier: Optional[str]
+    ) -> Optional[PacketColumns]:
+        """Return the cached packets, or None if they have not been cached."""
+        entry_dir = self._entry_dir(file_path, stream_specifier)
+        meta_file = entry_dir.joinpath("meta.json")
+
+        if not meta_file.is_file():
+            return None
+
+        try:
+            with open(meta_file, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+
+            columns = {
+                name: np.load(entry_dir.joinpath(f"{name}.npy"), mmap_mode="r")
+                for name in meta["columns"]
+            }
+        except (OSError, ValueError, KeyError):
+            # An incomplete or corrupt entry is treated as a cache miss.
+            return None
+
+        return PacketColumns(columns, meta["rejection_reasons"])
+
+    def save(
+        self, file_path: str, stream_specifier: Optional[str], packets: PacketColumns
+    ):
+        """
+        Cache `packets`, replacing the entries of older versions of the file.
+        The entry is written to a temporary directory and renamed into place,
+        so readers never see a partially written entry.
+        """
+        entry_dir = self._entry_dir(file_path, stream_specifier)
+        temp_dir = entry_dir.with_name(f"{entry_dir.name}.{os.getpid()}.tmp")
+        selection = self._selection(stream_specifier)
+
+        try:
+            self._remove_stale_entries(file_path, selection)
+            os.makedirs(temp_dir, exist_ok=True)
+
+            for name, column in packets.columns.items():
+                np.save(temp_dir.joinpath(f"{name}.npy"), np.ascontiguousarray(column))
+
+            with open(temp_dir.joinpath("meta.json"), "w", encoding="utf-8") as f:
+                json.dump(
+                    {
+                        "file": str(Path(file_path).resolve()),
+                        "stream_selection": selection,
+                        "columns": list(packets.columns),
+                        "rejection_reasons": packets.rejection_reasons,
+                    },
+                    f,
+                )
+
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            os.replace(temp_dir, entry_dir)
+        except OSError as e:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            print(f"Warning: Unable to write the packet cache: {e}")
+
+    def _remove_stale_entries(self, file_path: str, selection: str):
+        if not self._cache_dir.is_dir():
+            return
+
+        resolved_path = str(Path(file_path).resolve())
+
+        for meta_file in self._cache_dir.glob("*/meta.json"):
+            try:
+                with open(meta_file, "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                continue
+
+            if meta.get("file") == resolved_path and meta.get("stream_selection") == selection:
+                shutil.rmtree(meta_file.parent, ignore_errors=True)
+
@@ -0,0 +1,312 @@
+import io
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from profiling import stage
+
+import numpy as np
+
+# FFprobe always outputs the fields of a packet in this order, regardless of
+# the order that they are specified in -show_entries.
+FIELD_ORDER = ("stream_index", "pts_time", "dts_time", "size", "pos", "flags")
+
+# The column that each field is stored in. The flags are reduced to a keyframe mask.
+COLUMN_NAMES = {
+    "stream_index": "stream_index",
+    "pts_time": "pts_time",
+    "dts_time": "dts_time",
+    "size": "size",
+    "pos": "pos",
+    "flags": "keyframe",
+}
+
+FIELD_DTYPES = {
+    "stream_index": np.int64,
+    "pts_time": np.float64,
+    "dts_time": np.float64,
+    "size": np.int64,
+    # The position can be N/A, so it is parsed as a float and converted afterwards.
+    "pos": np.float64,
+    "flags": "S16",
+}
+
+COLUMN_DTYPES = {
+    "stream_index": np.int64,
+    "pts_time": np.float64,
+    "dts_time": np.float64,
+    "size": np.int64,
+    "pos": np.int64,
+    "keyframe": np.bool_,
+}
+
+CHUNK_SIZE = 4 * 1024 * 1024
+
+# A chunk that contains a malformed line is split in half until the halves
+# are this small, and only those are parsed line by line.
+MIN_SPLIT_SIZE = 16 * 1024
+
+
+def order_fields(fields: Sequence[str]) -> List[str]:
+    """Return `fields` in the order that FFprobe outputs them."""
+    unknown = set(fields) - set(FIELD_ORDER)
+    if unknown:
+        raise ValueError(f"Unsupported packet fields: {sorted(unknown)}")
+
+    return [field for field in FIELD_ORDER if field in fields]
+
+
+def show_entries(fields: Sequence[str]) -> str:
+    """The value of FFprobe's -show_entries option for the specified fields."""
+    return f"packet={','.join(order_fields(fields))}"
+
+
+def ffprobe_command(
+    file_path: str,
+    fields: Sequence[str],
+    stream_specifier: Optional[str] = None,
+    threads: Optional[int] = None,
+) -> List[str]:
+    """The FFprobe command that outputs the specified packet fields in CSV format."""
+    cmd = ["ffprobe", "-v", "error"]
+
+    if threads:
+        cmd += ["-threads", str(threads)]
+
+    # Without a stream specifier, the packets of every stream are output.
+    if stream_specifier:
+        cmd += ["-select_streams", stream_specifier]
+
+    return cmd + [
+        "-show_entries",
+        show_entries(fields),
+        "-of",
+        "csv=print_section=0:nk=1",
+        file_path,
+    ]
+
+
+class PacketColumns:
+    """
+    Packet data stored as one NumPy array per column.
+
+    Timestamps that FFprobe reports as N/A are stored as NaN. Lines that could
+    not be parsed are counted in `rejection_reasons`.
+    """
+
+    def __init__(
+        self,
+        columns: Dict[str, np.ndarray],
+        rejection_reasons: Optional[Dict[str, int]] = None,
+    ):
+        lengths = {len(column) for column in columns.values()}
+        if len(lengths) > 1:
+            raise ValueError(f"Columns have different lengths: {lengths}")
+
+        self.columns = columns
+        self.rejection_reasons = rejection_reasons or {}
+
+    def __len__(self) -> int:
+        return len(next(iter(self.columns.values()))) if self.columns else 0
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.columns
+
+    def select(self, mask: np.ndarray) -> "PacketColumns":
+        """Return the packets where `mask` is true."""
+        return PacketColumns(
+            {name: column[mask] for name, column in self.columns.items()},
+            dict(self.rejection_reasons),
+        )
+
+    @classmethod
+    def empty(cls, fields: Sequence[str]) -> "PacketColumns":
+        return cls(
+            {
+                COLUMN_NAMES[field]: np.empty(0, COLUMN_DTYPES[COLUMN_NAMES[field]])
+                for field in order_fields(fields)
+            }
+        )
+
+    @classmethod
+    def concatenate(
+        cls, parts: Sequence["PacketColumns"], fields: Sequence[str]
+    ) -> "PacketColumns":
+        if not parts:
+            return cls.empty(fields)
+
+        rejection_reasons: Dict[str, int] = {}
+        for part in parts:
+            for reason, count in part.rejection_reasons.items():
+                rejection_reasons[reason] = rejection_reasons.get(reason, 0) + count
+
+        return cls(
+            {
+                name: np.concatenate([part[name] for part in parts])
+                for name in parts[0].columns
+            },
+            rejection_reasons,
+        )
+
+
+def _to_columns(table: np.ndarray, fields: List[str]) -> Dict[str, np.ndarray]:
+    columns = {}
+
+    for field in fields:
+        values = table[field]
+
+        if field == "flags":
+            values = np.char.find(values, b"K") >= 0
+        elif field == "pos":
+            values = np.where(np.isnan(values), -1, values).astype(np.int64)
+
+        columns[COLUMN_NAMES[field]] = values
+
+    return columns
+
+
+def _parse_lines(chunk: bytes, fields: List[str]) -> PacketColumns:
+    """Parse a chunk line by line, rejecting the lines that are malformed."""
+    rows = []
+    rejected = 0
+
+    for line in chunk.decode("utf-8", errors="replace").splitlines():
+        if not line.strip():
+            continue
+
+        parts = line.strip().split(",")
+        if len(parts) < len(fields):
+            rejected += 1
+            continue
+
+        try:
+            row = []
+            for field, part in zip(fields, parts):
+                if field == "flags":
+                    row.append(part.encode())
+                elif FIELD_DTYPES[field] is np.int64:
+                    # Raises OverflowError for values that do not fit.
+                    row.append(np.int64(int(part)))
+                else:
+                    row.append(float("nan") if part == "N/A" else float(part))
+        except (ValueError, OverflowError):
+            rejected += 1
+            continue
+
+        rows.append(tuple(row))
+
+    table = np.array(rows, dtype=[(field, FIELD_DTYPES[field]) for field in fields])
+
+    return PacketColumns(
+        _to_columns(table, fields),
+        {"invalid format": rejected} if rejected else {},
+    )
+
+
+def parse_chunk(chunk: bytes, fields: Sequence[str]) -> PacketColumns:
+    """
+    Parse complete lines of FFprobe's CSV output into packet columns.
+
+    The whole chunk is parsed in one go by NumPy. If it contains a line that
+    cannot be parsed, it is split in half at a line break and each half is
+    parsed the same way, so that the lines around a malformed one are still
+    parsed by NumPy. Halves smaller than MIN_SPLIT_SIZE are parsed line by
+    line, rejecting only the malformed lines.
+    """
+    fields = order_fields(fields)
+
+    try:
+        table = np.loadtxt(
+            io.BytesIO(chunk.replace(b"N/A", b"nan")),
+            delimiter=",",
+            dtype=[(field, FIELD_DTYPES[field]) for field in fields],
+            usecols=range(len(fields)),
+            comments=None,
+            ndmin=1,
+        )
+    # An integer that is out of range raises OverflowError.
+    except (ValueError, OverflowError):
+        middle = chunk.find(b"\n", len(chunk) // 2) + 1
+
+        if len(chunk) <= MIN_SPLIT_SIZE or not 0 < middle < len(chunk):
+            return _parse_lines(chunk, fields)
+
+        return PacketColumns.concatenate(
+            [
+                parse_chunk(half, fields)
+                for half in (chunk[:middle], chunk[middle:])
+                if half.strip()
+            ],
+            fields,
+        )
+
+    return PacketColumns(_to_columns(table, fields))
+
+
+def iter_packet_chunks(
+    stream: BinaryIO,
+    fields: Sequence[str],
+    chunk_size: int = CHUNK_SIZE,
+    partial_reads: bool = False,
+) -> Iterator[PacketColumns]:
+    """
+    Read FFprobe's CSV output in large blocks, yielding the packets of each block.
+
+    With `partial_reads`, whatever output is available is parsed straight
+    away instead of waiting for a full block, which suits a live source.
+    """
+    read = stream.read1 if partial_reads else stream.read
+    remainder = b""
+
+    while True:
+        with stage("read pipe") as counter:
+            block = read(chunk_size)
+            counter.items = len(block)
+
+        if not block:
+            break
+
+        chunk, remainder = split_complete_lines(remainder + block)
+
+        if chunk.strip():
+            yield _profiled_parse_chunk(chunk, fields)
+
+    if remainder.strip():
+        yield _profiled_parse_chunk(remainder, fields)
+
+
+def split_complete_lines(block: bytes) -> Tuple[bytes, bytes]:
+    """Split `block` into its complete lines and the partial line after them."""
+    last_newline = block.rfind(b"\n")
+    return block[: last_newline + 1], block[last_newline + 1 :]
+
+
+def _profiled_parse_chunk(chunk: bytes, fields: Sequence[str]) -> PacketColumns:
+    with stage("parse") as counter:
+        packets = parse_chunk(chunk, fields)
+        counter.items = len(packets)
+
+    return packets
+
+
+def read_packets(
+    stream: BinaryIO,
+    fields: Sequence[str],
+    on_chunk: Optional[Callable[[PacketColumns], None]] = None,
+    chunk_size: int = CHUNK_SIZE,
+) -> PacketColumns:
+    """Read all of FFprobe's CSV output into packet columns."""
+    parts = []
+
+    for chunk in iter_packet_chunks(stream, fields, chunk_size):
+        parts.append(chunk)
+
+        if on_chunk:
+            on_chunk(chunk)
+
+    with stage("concatenate packets") as counter:
+        packets = PacketColumns.concatenate(parts, fields)
+        counter.items = len(packets)
+
+    return packets
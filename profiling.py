@@ -0,0 +1,191 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+import json
+import os
+from pathlib import Path
+import platform
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where memory and child CPU time are not reported.
+    resource = None
+
+_active_profiler: ContextVar[Optional["Profiler"]] = ContextVar(
+    "active_profiler", default=None
+)
+_current_stage: ContextVar[Optional[str]] = ContextVar("current_stage", default=None)
+
+
+def peak_rss_mb() -> Optional[float]:
+    """The peak resident memory of this process so far, in MB."""
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere.
+    return peak / (1024 * 1024 if platform.system() == "Darwin" else 1024)
+
+
+def _child_cpu_seconds() -> float:
+    """The CPU time of every child process that has exited, e.g. FFprobe."""
+    if resource is None:
+        return 0.0
+
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class StageCounter:
+    """Yielded by stage(), so that the stage can report how many items it handled."""
+
+    __slots__ = ("items",)
+
+    def __init__(self, items: int = 0):
+        self.items = items
+
+
+class Profiler:
+    """
+    Records the wall time, CPU time, peak memory and item count of every
+    stage that runs while it is active. Stages with the same name and parent
+    stage are summed in the summary, and every call is kept for the trace.
+
+    CPU time is the whole process's, and child CPU time is that of the child
+    processes (FFprobe) that exited during the stage. The wall times of
+    stages that run in parallel, such as shards, are summed.
+    """
+
+    def __init__(self):
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._totals: Dict[Tuple[Optional[str], str], Dict] = {}
+        self._events: List[Dict] = []
+
+    @contextmanager
+    def activate(self) -> Iterator["Profiler"]:
+        """Record the stages of the code run within this block."""
+        token = _active_profiler.set(self)
+        try:
+            yield self
+        finally:
+            _active_profiler.reset(token)
+
+    def _record(
+        self,
+        name: str,
+        parent: Optional[str],
+        start: float,
+        wall_seconds: float,
+        cpu_seconds: float,
+        child_cpu_seconds: float,
+        peak_rss_increase: Optional[float],
+        items: int,
+    ):
+        with self._lock:
+            totals = self._totals.setdefault(
+                (parent, name),
+                {
+                    "name": name,
+                    "parent": parent,
+                    "calls": 0,
+                    "wall_seconds": 0.0,
+                    "cpu_seconds": 0.0,
+                    "child_cpu_seconds": 0.0,
+                    "peak_rss_mb": None,
+                    "peak_rss_increase_mb": None,
+                    "items": 0,
+                },
+            )
+            totals["calls"] += 1
+            totals["wall_seconds"] += wall_seconds
+            totals["cpu_seconds"] += cpu_seconds
+            totals["child_cpu_seconds"] += child_cpu_seconds
+            totals["items"] += items
+            totals["peak_rss_mb"] = peak_rss_mb()
+
+            if peak_rss_increase is not None:
+                totals["peak_rss_increase_mb"] = (
+                    totals["peak_rss_increase_mb"] or 0
+                ) + peak_rss_increase
+
+            self._events.append(
+                {
+                    "name": name,
+                    "cat": "stage",
+                    "ph": "X",
+                    "ts": (start - self._start) * 1_000_000,
+                    "dur": wall_seconds * 1_000_000,
+                    "pid": os.getpid(),
+                    "tid": threading.get_ident(),
+                    "args": {"items": items, "cpu_seconds": cpu_seconds},
+                }
+            )
+
+    def summary(self) -> Dict:
+        """The profile section of data.json."""
+        with self._lock:
+            return {
+                "total_wall_seconds": time.perf_counter() - self._start,
+                "peak_rss_mb": peak_rss_mb(),
+                "stages": [dict(totals) for totals in self._totals.values()],
+            }
+
+    def write_chrome_trace(self, trace_file: Path):
+        """
+        Save every stage call in the Chrome trace event format, which can be
+        opened in chrome://tracing or https://ui.perfetto.dev.
+        """
+        with self._lock:
+            events = list(self._events)
+
+        with open(trace_file, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+@contextmanager
+def stage(name: str, items: int = 0) -> Iterator[StageCounter]:
+    """
+    Measure the code run within this block as a stage of the active profiler.
+    Without an active profiler, this does nothing.
+
+    Example:
+        with stage("parse") as counter:
+            packets = parse_chunk(chunk, fields)
+            counter.items = len(packets)
+    """
+    counter = StageCounter(items)
+    profiler = _active_profiler.get()
+
+    if profiler is None:
+        yield counter
+        return
+
+    parent = _current_stage.get()
+    token = _current_stage.set(name)
+    rss_before = peak_rss_mb()
+    child_cpu_before = _child_cpu_seconds()
+    start_cpu = time.process_time()
+    start = time.perf_counter()
+
+    try:
+        yield counter
+    finally:
+        wall_seconds = time.perf_counter() - start
+        cpu_seconds = time.process_time() - start_cpu
+        rss_after = peak_rss_mb()
+        _current_stage.reset(token)
+
+        profiler._record(
+            name,
+            parent,
+            start,
+            wall_seconds,
+            cpu_seconds,
+            _child_cpu_seconds() - child_cpu_before,
+            None if rss_before is None else rss_after - rss_before,
+            counter.items,
+        )
@@ -0,0 +1,201 @@
+from abc import ABC, abstractmethod
+import json
+import sys
+import time
+from typing import Dict, Optional, TextIO
+
+# The progress sinks that can be chosen with --progress.
+PROGRESS_SINKS = ("rich", "jsonl", "none")
+
+
+class NullProgress:
+    """A progress sink that displays nothing, e.g. in batch mode or headless runs."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def add_task(self, *args, **kwargs):
+        return 0
+
+    def update(self, *args, **kwargs):
+        pass
+
+
+class RateLimitedProgress(ABC):
+    """
+    The base class of progress sinks that have a cost per update.
+
+    It has the same add_task() and update() methods as rich's Progress, so
+    the analysis functions can report to any sink. Updates only record the
+    latest state of a task, which is passed to _emit() at most once every
+    `min_interval` seconds per task, when the task's total changes or it
+    completes, and when the sink is closed.
+    """
+
+    def __init__(self, min_interval: float):
+        self.min_interval = min_interval
+        self._tasks: Dict[int, Dict] = {}
+        self._last_emitted: Dict[int, float] = {}
+        self._emitted_states: Dict[int, tuple] = {}
+        self._pending = set()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        for task_id in sorted(self._pending):
+            self._emit_task(task_id)
+        self._pending.clear()
+        self.stop()
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    @abstractmethod
+    def _emit(self, task_id: int, task: Dict):
+        """Display the current state of a task."""
+
+    def _emit_task(self, task_id: int):
+        task = self._tasks[task_id]
+        self._emit(task_id, task)
+        self._emitted_states[task_id] = (task["total"], task["completed"])
+        self._last_emitted[task_id] = time.monotonic()
+
+    def add_task(self, description: str, total: Optional[float] = None, **kwargs) -> int:
+        task_id = len(self._tasks)
+        self._tasks[task_id] = {
+            "description": description,
+            "total": total,
+            "completed": 0,
+        }
+        self._emit_task(task_id)
+        return task_id
+
+    def update(
+        self,
+        task_id: int,
+        total: Optional[float] = None,
+        completed: Optional[float] = None,
+        advance: Optional[float] = None,
+        **kwargs,
+    ):
+        task = self._tasks[task_id]
+        is_new_total = total is not None and total != task["total"]
+
+        if total is not None:
+            task["total"] = total
+        if completed is not None:
+            task["completed"] = completed
+        if advance is not None:
+            task["completed"] += advance
+
+        if self._emitted_states[task_id] == (task["total"], task["completed"]):
+            return
+
+        is_finished = task["total"] is not None and task["completed"] >= task["total"]
+
+        if (
+            is_new_total
+            or is_finished
+            or time.monotonic() - self._last_emitted[task_id] >= self.min_interval
+        ):
+            self._emit_task(task_id)
+            self._pending.discard(task_id)
+        else:
+            self._pending.add(task_id)
+
+
+class RichProgress(RateLimitedProgress):
+    """Progress bars in the terminal, drawn by rich."""
+
+    def __init__(self, min_interval: float = 0.1):
+        super().__init__(min_interval)
+
+        # rich is only imported when progress bars are shown.
+        from rich.progress import (
+            Progress,
+            SpinnerColumn,
+            TextColumn,
+            BarColumn,
+            TaskProgressColumn,
+        )
+
+        self._progress = Progress(
+            SpinnerColumn(),
+            TextColumn("[progress.description]{task.description}"),
+            BarColumn(),
+            TaskProgressColumn(),
+        )
+        self._rich_task_ids: Dict[int, int] = {}
+
+    def start(self):
+        self._progress.start()
+
+    def stop(self):
+        self._progress.stop()
+
+    def _emit(self, task_id: int, task: Dict):
+        if task_id not in self._rich_task_ids:
+            self._rich_task_ids[task_id] = self._progress.add_task(
+                description=task["description"], total=task["total"]
+            )
+            return
+
+        self._progress.update(
+            self._rich_task_ids[task_id],
+            total=task["total"],
+            completed=task["completed"],
+        )
+
+
+class JsonLinesProgress(RateLimitedProgress):
+    """
+    Writes progress as one JSON object per line, for other programs to read.
+
+    Example line:
+    {"file": "a.mp4", "task": 0, "description": "Retrieving packet data...",
+     "completed": 12.5, "total": 60.0, "time": 1700000000.0}
+    """
+
+    def __init__(
+        self,
+        stream: Optional[TextIO] = None,
+        file_path: Optional[str] = None,
+        min_interval: float = 1.0,
+    ):
+        super().__init__(min_interval)
+        self._stream = stream or sys.stderr
+        self._file_path = file_path
+
+    def _emit(self, task_id: int, task: Dict):
+        event = {
+            "file": self._file_path,
+            "task": task_id,
+            "description": task["description"],
+            "completed": task["completed"],
+            "total": task["total"],
+            "time": time.time(),
+        }
+        # Each line is written in one call, so that the lines of concurrent
+        # processes writing to the same stream do not interleave.
+        self._stream.write(json.dumps(event) + "\n")
+        self._stream.flush()
+
+
+def create_progress(sink: str, file_path: Optional[str] = None):
+    """Create the progress sink called `sink`, one of PROGRESS_SINKS."""
+    if sink == "none":
+        return NullProgress()
+    if sink == "rich":
+        return RichProgress()
+    if sink == "jsonl":
+        return JsonLinesProgress(file_path=file_path)
+
+    raise ValueError(f"Invalid progress sink '{sink}'. Must be one of: {PROGRESS_SINKS}")
@@ -0,0 +1,136 @@
+from pathlib import Path
+from typing import List, NamedTuple, Sequence
+
+import numpy as np
+
+# The bin widths of the levels, in seconds. Every level must be a whole
+# multiple of the first.
+PYRAMID_LEVELS = (0.1, 1, 10, 60, 600, 3600)
+
+# Finer levels with more bins than this are left out, e.g. when an outlier
+# timestamp, such as an MPEG-TS wrap, makes the packets span days.
+MAX_LEVEL_BINS = 1 << 22
+
+
+class PyramidLevel(NamedTuple):
+    """The bitrates of one level, in bits per second, with one element per bin."""
+
+    bin_seconds: float
+    # The start time of the first bin. Bin i starts at start + i * bin_seconds.
+    start: float
+    # The lowest and highest bitrate of the finest level's bins within each bin.
+    mins: np.ndarray
+    maxs: np.ndarray
+    means: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.means)
+
+
+def build_pyramid(
+    timestamps: np.ndarray,
+    sizes: np.ndarray,
+    levels: Sequence[float] = PYRAMID_LEVELS,
+) -> List[PyramidLevel]:
+    """
+    Calculate the min, max and mean bitrate over bins of each width in
+    `levels`, so that any time range can be drawn from the level whose bins
+    are about as wide as a pixel.
+
+    The packets are summed into the finest level's bins, and every coarser
+    level is reduced from those, so its min and max are the extremes of the
+    finest bins within it. Only the finest bins that contain packets are
+    kept, so the memory used does not depend on how far apart the
+    timestamps are. Bins without packets have a bitrate of 0, and packets
+    with a timestamp of N/A are ignored. Levels with more than
+    MAX_LEVEL_BINS bins are left out, apart from the coarsest.
+    """
+    base_seconds = levels[0]
+    ratios = [level / base_seconds for level in levels]
+
+    if base_seconds <= 0 or any(abs(ratio - round(ratio)) > 1e-9 for ratio in ratios):
+        raise ValueError(
+            f"Every level must be a positive multiple of the first, got {list(levels)}"
+        )
+
+    has_timestamp = ~np.isnan(timestamps)
+    timestamps = timestamps[has_timestamp]
+    sizes = sizes[has_timestamp]
+
+    if not len(timestamps):
+        return []
+
+    start = np.floor(timestamps.min() / base_seconds) * base_seconds
+    # The small offset keeps timestamps on a bin boundary in the bin that
+    # they start, despite rounding in the division.
+    bins = np.floor((timestamps - start) / base_seconds + 1e-9).astype(np.int64)
+    bits = sizes.astype(np.float64) * 8
+
+    # The finest bins that contain packets, in ascending order. Counting into
+    # every bin is faster unless the timestamps are far apart.
+    if bins.max() < MAX_LEVEL_BINS:
+        base_bins = np.flatnonzero(np.bincount(bins))
+        base_rates = np.bincount(bins, weights=bits)[base_bins] / base_seconds
+    else:
+        base_bins, inverse = np.unique(bins, return_inverse=True)
+        base_rates = np.bincount(inverse, weights=bits) / base_seconds
+
+    base_bin_count = int(base_bins[-1]) + 1
+
+    pyramid = []
+
+    for index, (level, ratio) in enumerate(zip(levels, ratios)):
+        ratio = round(ratio)
+        bin_count = -(-base_bin_count // ratio)
+
+        if bin_count > MAX_LEVEL_BINS and index < len(levels) - 1:
+            continue
+
+        level_bins = base_bins // ratio
+        # The final bin can cover fewer finest bins than the others.
+        bins_within = np.full(bin_count, ratio)
+        bins_within[-1] = base_bin_count - (bin_count - 1) * ratio
+
+        firsts = np.flatnonzero(np.r_[True, level_bins[1:] != level_bins[:-1]])
+        occupied = level_bins[firsts]
+        mins = np.zeros(bin_count)
+        maxs = np.zeros(bin_count)
+        filled = np.bincount(level_bins, minlength=bin_count)[occupied]
+        # A bin that also covers finest bins without packets has a minimum of 0.
+        mins[occupied] = np.where(
+            filled == bins_within[occupied],
+            np.minimum.reduceat(base_rates, firsts),
+            0,
+        )
+        maxs[occupied] = np.maximum.reduceat(base_rates, firsts)
+        means = np.bincount(level_bins, weights=base_rates, minlength=bin_count) / bins_within
+
+        pyramid.append(
+            PyramidLevel(
+                bin_seconds=float(level),
+                start=float(start),
+                mins=mins,
+                maxs=maxs,
+                means=means,
+            )
+        )
+
+    return pyramid
+
+
+def save_pyramid(pyramid: List[PyramidLevel], pyramid_path: Path):
+    """
+    Save every level in one .npz file, with the arrays of each level named
+    after its bin width, e.g. 0.1s_means, and the start time of its first
+    bin in e.g. 0.1s_start.
+    """
+    arrays = {}
+
+    for level in pyramid:
+        name = f"{level.bin_seconds:g}s"
+        arrays[f"{name}_start"] = np.array(level.start)
+        arrays[f"{name}_mins"] = level.mins
+        arrays[f"{name}_maxs"] = level.maxs
+        arrays[f"{name}_means"] = level.means
+
+    np.savez(pyramid_path, **arrays)
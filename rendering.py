@@ -0,0 +1,173 @@
+from pathlib import Path
+from typing import Dict, Sequence, Tuple
+
+from profiling import stage
+
+import matplotlib
+
+# Graphs are only ever saved to files, so the non-interactive backend is
+# used regardless of the environment, which also avoids GUI start-up costs.
+matplotlib.use("Agg")
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+# Above this many GOPs, a marker per GOP is indistinguishable from the step
+# line and only slows rendering down, so the scatter is skipped.
+GOP_SCATTER_MAX_POINTS = 2000
+
+
+def decimate_min_max(x, y, width: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Reduce a series to at most two points per pixel column: the minimum and
+    maximum of the points that fall in each column, in their original order.
+
+    Every spike and dip is still drawn at its true height, while matplotlib
+    only has to render about 2 * `width` points. `x` must be sorted.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    if len(x) <= 2 * width:
+        return x, y
+
+    span = x[-1] - x[0]
+    if span <= 0:
+        return x, y
+
+    columns = np.minimum(((x - x[0]) / span * width).astype(np.int64), width - 1)
+
+    # Within each column, the first point in this order is the minimum and
+    # the last is the maximum.
+    order = np.lexsort((y, columns))
+    starts = np.flatnonzero(np.diff(columns[order], prepend=-1))
+    ends = np.append(starts[1:], len(order)) - 1
+
+    keep = np.unique(np.concatenate((order[starts], order[ends])))
+    return x[keep], y[keep]
+
+
+def _pixel_width(figure) -> int:
+    return int(figure.get_figwidth() * figure.dpi)
+
+
+def save_bitrates_graph(
+    title: str,
+    x_axis_values,
+    bitrates,
+    unit: str,
+    graph_type: str,
+    graph_path: Path,
+):
+    with stage("plot", len(bitrates)):
+        average_bitrate = round(sum(bitrates) / len(bitrates), 3)
+        min_bitrate = round(min(bitrates), 3)
+        max_bitrate = round(max(bitrates), 3)
+
+        figure = plt.figure()
+        x_axis_values, bitrates = decimate_min_max(
+            x_axis_values, bitrates, _pixel_width(figure)
+        )
+
+        plt.suptitle(
+            f"{title}\nMin: {min_bitrate} | Max: {max_bitrate} | Avg: {average_bitrate} {unit}"
+        )
+        plt.xlabel("Time (s)")
+        plt.ylabel(f"Bitrate ({unit})")
+        if graph_type == "filled":
+            plt.fill_between(x_axis_values, bitrates)
+        plt.plot(x_axis_values, bitrates)
+        plt.savefig(graph_path)
+        plt.close()
+
+
+def save_gop_bitrates_graph(
+    title: str,
+    gop_end_times,
+    gop_bitrates,
+    graph_type: str,
+    graph_path: Path,
+):
+    with stage("plot", len(gop_bitrates)):
+        figure = plt.figure(figsize=(15, 8))
+        show_scatter = len(gop_bitrates) <= GOP_SCATTER_MAX_POINTS
+        gop_end_times, gop_bitrates = decimate_min_max(
+            gop_end_times, gop_bitrates, _pixel_width(figure)
+        )
+
+        plt.suptitle(title)
+        plt.xlabel("GOP end time (s)")
+        plt.ylabel("GOP bitrate (Mbps)")
+
+        if graph_type == "filled":
+            plt.fill_between(gop_end_times, gop_bitrates, step="post", alpha=0.3)
+
+        plt.step(gop_end_times, gop_bitrates, where="post", linestyle="-", linewidth=2)
+        if show_scatter:
+            plt.scatter(
+                gop_end_times, gop_bitrates, marker=".", color="red", s=20, alpha=0.5
+            )
+        plt.grid(True, alpha=0.3)
+        plt.ylim(bottom=0)
+        plt.savefig(graph_path)
+        plt.close()
+
+
+def save_buffer_graph(
+    title: str,
+    times,
+    fullness,
+    bufsize: float,
+    graph_type: str,
+    graph_path: Path,
+):
+    """Plot the fullness of the decoder buffer, in kbit, before each packet is removed."""
+    with stage("plot", len(fullness)):
+        figure = plt.figure(figsize=(15, 8))
+        times, fullness = decimate_min_max(times, fullness, _pixel_width(figure))
+
+        plt.suptitle(title)
+        plt.xlabel("DTS (s)")
+        plt.ylabel("Buffer fullness (kbit)")
+
+        if graph_type == "filled":
+            plt.fill_between(times, fullness, alpha=0.3)
+
+        plt.plot(times, fullness, linewidth=1)
+        plt.axhline(bufsize, color="red", linestyle="--", linewidth=1, label="bufsize")
+        plt.axhline(0, color="black", linewidth=1)
+        plt.legend(loc="upper right")
+        plt.grid(True, alpha=0.3)
+        plt.savefig(graph_path)
+        plt.close()
+
+
+def save_ladder_graph(
+    title: str,
+    series: Dict[str, Tuple[Sequence[float], Sequence[float]]],
+    graph_type: str,
+    graph_path: Path,
+):
+    """Overlay the per-second bitrates (in Mbps) of every rendition, keyed on its label."""
+    with stage("plot", sum(len(bitrates) for _, bitrates in series.values())):
+        figure = plt.figure(figsize=(15, 8))
+        width = _pixel_width(figure)
+
+        plt.suptitle(title)
+        plt.xlabel("Time (s)")
+        plt.ylabel("Bitrate (Mbps)")
+
+        for label, (x_axis_values, bitrates) in series.items():
+            if not len(bitrates):
+                continue
+
+            x_axis_values, bitrates = decimate_min_max(x_axis_values, bitrates, width)
+            if graph_type == "filled":
+                plt.fill_between(x_axis_values, bitrates, alpha=0.2)
+            plt.plot(x_axis_values, bitrates, label=label, linewidth=1)
+
+        plt.legend(loc="upper right", fontsize="small")
+        plt.grid(True, alpha=0.3)
+        plt.ylim(bottom=0)
+        plt.savefig(graph_path)
+        plt.close()
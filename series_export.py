@@ -0,0 +1,104 @@
+import json
+import os
+from pathlib import Path
+from typing import Dict, Sequence
+
+from calculate_bitrates import SecondBuckets, find_complete_seconds
+
+import numpy as np
+
+SERIES_FORMATS = ("npy", "csv", "ndjson")
+
+SERIES_FILENAMES = {
+    # A folder with one .npy file per column.
+    "npy": "bitrate_series",
+    "csv": "bitrate_series.csv",
+    "ndjson": "bitrate_series.ndjson",
+}
+
+# Large enough that network-mounted output volumes see a few big writes.
+BUFFER_SIZE = 1024 * 1024
+
+# The number of rows formatted at once when writing text.
+ROWS_PER_WRITE = 65536
+
+
+def second_series(
+    buckets: SecondBuckets,
+    min_coverage_seconds: float = 0.9,
+    max_gap_seconds: float = 0.1,
+) -> Dict[str, np.ndarray]:
+    """
+    The totals of every second that contains at least one packet, as one
+    array per column. `complete` is whether the second was used for the
+    bitrates, as in calculate_bitrates().
+    """
+    is_complete, _, _ = find_complete_seconds(
+        buckets, min_coverage_seconds, max_gap_seconds
+    )
+
+    return {
+        "second": buckets.seconds.astype(np.int64),
+        "bytes": buckets.bytes.astype(np.int64),
+        "packets": buckets.packets.astype(np.int64),
+        "complete": is_complete,
+    }
+
+
+def write_second_series(
+    buckets: SecondBuckets,
+    output_dir: Path,
+    formats: Sequence[str],
+    min_coverage_seconds: float = 0.9,
+    max_gap_seconds: float = 0.1,
+) -> Dict[str, Path]:
+    """
+    Save the per-second totals in each of `formats`:
+    - npy: one .npy file per column, which np.load() can memory-map.
+    - csv: one row per second.
+    - ndjson: one JSON object per second, per line.
+
+    Returns the path of every file or folder that was written.
+    """
+    unknown = set(formats) - set(SERIES_FORMATS)
+    if unknown:
+        raise ValueError(
+            f"Unsupported series formats: {sorted(unknown)}. Must be one of: {SERIES_FORMATS}"
+        )
+
+    columns = second_series(buckets, min_coverage_seconds, max_gap_seconds)
+    paths = {}
+
+    for series_format in dict.fromkeys(formats):
+        path = Path(output_dir).joinpath(SERIES_FILENAMES[series_format])
+        paths[series_format] = path
+
+        if series_format == "npy":
+            os.makedirs(path, exist_ok=True)
+            for name, values in columns.items():
+                np.save(path.joinpath(f"{name}.npy"), values)
+            continue
+
+        with open(path, "w", buffering=BUFFER_SIZE, encoding="utf-8", newline="") as f:
+            if series_format == "csv":
+                f.write(",".join(columns) + "\n")
+
+            for start in range(0, len(columns["second"]), ROWS_PER_WRITE):
+                rows = zip(
+                    *(
+                        values[start : start + ROWS_PER_WRITE].tolist()
+                        for values in columns.values()
+                    )
+                )
+
+                if series_format == "csv":
+                    f.writelines(
+                        f"{second},{size},{packets},{str(complete).lower()}\n"
+                        for second, size, packets, complete in rows
+                    )
+                else:
+                    f.writelines(
+                        json.dumps(dict(zip(columns, row))) + "\n" for row in rows
+                    )
+
+    return paths
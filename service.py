@@ -0,0 +1,501 @@
+from argparse import ArgumentParser, Namespace, RawTextHelpFormatter
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import itertools
+import json
+import multiprocessing
+import os
+from pathlib import Path
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.error import HTTPError
+from urllib.parse import parse_qs, urlparse
+from urllib.request import Request, urlopen
+
+from analysis import MODES, run_analysis
+from args import build_args
+from metadata_cache import file_identity
+
+DEFAULT_PORT = 8765
+
+# Options that do not change the result, or that a job cannot use.
+IGNORED_OPTIONS = {"file_path", "jobs", "progress"}
+UNSUPPORTED_OPTIONS = {"follow", "ladder"}
+
+# The most times that a job is submitted to a new pool after the pool broke
+# before it started.
+MAX_ATTEMPTS = 3
+
+# Set in each worker process by _warm_up().
+_started_jobs = None
+
+
+def build_job_args(request: Dict) -> Namespace:
+    """
+    The arguments for a job request, with the command line defaults for the
+    options that it does not specify. Raises ValueError or TypeError if the
+    request is invalid.
+    """
+    options = dict(request)
+    file_path = options.pop("file_path", None)
+    mode = options.pop("mode", "per-second")
+    options.pop("output_dir", None)
+    plot = options.pop("plot", True)
+
+    if not isinstance(file_path, str):
+        raise ValueError("The request must have a file_path")
+
+    if mode not in MODES:
+        raise ValueError(f"Invalid mode '{mode}'. Must be one of: {MODES}")
+
+    unsupported = UNSUPPORTED_OPTIONS & set(options)
+    if unsupported:
+        raise ValueError(f"Options not supported by the service: {sorted(unsupported)}")
+
+    return build_args(
+        file_path,
+        dts=options.pop("use_dts", False),
+        gop=mode == "gop",
+        all_streams=mode == "all-streams",
+        stream_specifier=options.pop("stream", None),
+        no_plot=not plot,
+        **options,
+    )
+
+
+def job_output_dir(request: Dict) -> Optional[Path]:
+    """
+    The folder that a job saves its files in: a folder named after its mode
+    within the requested "output_dir", so that jobs with different modes do
+    not overwrite each other's data.json and graphs. None if no "output_dir"
+    is requested.
+    """
+    if not request.get("output_dir"):
+        return None
+
+    return Path(request["output_dir"], request.get("mode", "per-second"))
+
+
+def run_job(
+    job_id: str, file_path: str, args: Namespace, output_dir: Optional[Path]
+) -> Dict:
+    """Run one job in a worker process. Returns the contents of data.json."""
+    if _started_jobs is not None:
+        _started_jobs.put(job_id)
+
+    return run_analysis(file_path, args, output_dir, show_progress=False).data
+
+
+def _warm_up(started_jobs):
+    # NumPy and the analysis modules are imported once per worker, rather
+    # than once per job. matplotlib is imported by the first job that plots.
+    import analysis  # noqa: F401
+
+    # The ID of each job is sent back before it runs, so that if the worker
+    # crashes, the service knows which jobs were running and which were only
+    # queued.
+    global _started_jobs
+    _started_jobs = started_jobs
+
+
+class Job:
+    def __init__(self, job_id: str, file_path: str, key: str):
+        self.id = job_id
+        self.file_path = file_path
+        self.key = key
+        self.status = "queued"
+        self.cached = False
+        self.result: Optional[Dict] = None
+        self.error: Optional[str] = None
+        self.submitted_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.finished = threading.Event()
+        self.future: Optional[Future] = None
+        self.attempts = 0
+
+    def to_dict(self) -> Dict:
+        job = {
+            "id": self.id,
+            "file_path": self.file_path,
+            "status": self.status,
+            "cached": self.cached,
+            "submitted_at": self.submitted_at,
+            "finished_at": self.finished_at,
+        }
+
+        if self.status == "done":
+            job["result"] = self.result
+        elif self.status == "failed":
+            job["error"] = self.error
+
+        return job
+
+
+class AnalysisService:
+    """
+    Schedules jobs on a pool of `workers` processes, runs identical jobs that
+    are in flight at the same time once, and caches up to `cache_size`
+    results, evicting the least recently used. Up to `max_jobs` finished jobs
+    are kept for their status to be looked up.
+
+    If a worker crashes, the pool is replaced. The jobs that were running
+    fail, as the pool cannot tell which of them crashed, and the jobs that
+    were still queued are submitted to the new pool.
+    """
+
+    def __init__(self, workers: int, cache_size: int = 256, max_jobs: int = 1000):
+        if workers < 1:
+            raise ValueError(f"workers must be at least 1, got {workers}")
+        if cache_size < 0:
+            raise ValueError(f"cache_size must not be negative, got {cache_size}")
+
+        self.workers = workers
+        # SimpleQueue writes synchronously, so a job ID is not lost if the
+        # worker crashes straight after sending it.
+        self._started_queue = multiprocessing.SimpleQueue()
+        self._started: Set[str] = set()
+        self._executor = self._new_executor()
+        self._cache_size = cache_size
+        self._max_jobs = max_jobs
+        # Reentrant, as a done callback runs straight away in the thread that
+        # adds it if the pool has already broken.
+        self._lock = threading.RLock()
+        self._job_ids = itertools.count(1)
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._in_flight: Dict[str, Job] = {}
+        # Each result is cached with the paths of the files that its job saved.
+        self._results: "OrderedDict[str, Tuple[Dict, List[Path]]]" = OrderedDict()
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_warm_up,
+            initargs=(self._started_queue,),
+        )
+
+    @staticmethod
+    def _key(file_path: str, args: Namespace, output_dir: Optional[Path]) -> str:
+        options = {
+            name: value for name, value in vars(args).items() if name not in IGNORED_OPTIONS
+        }
+        return json.dumps(
+            [file_identity(file_path), output_dir and str(output_dir), options],
+            sort_keys=True,
+            default=str,
+        )
+
+    def submit(self, request: Dict) -> Job:
+        """
+        Submit a job, returning an in-flight job with the same key or a job
+        that is already done if its result is cached. Raises ValueError or
+        TypeError if the request is invalid, and OSError if the file cannot
+        be found.
+        """
+        args = build_job_args(request)
+        file_path = request["file_path"]
+        output_dir = job_output_dir(request)
+        key = self._key(file_path, args, output_dir)
+
+        with self._lock:
+            if key in self._in_flight:
+                return self._in_flight[key]
+
+            job = Job(str(next(self._job_ids)), file_path, key)
+            self._add_job(job)
+
+            if key in self._results and not all(
+                path.exists() for path in self._results[key][1]
+            ):
+                # The saved files have been deleted since, so run it again.
+                del self._results[key]
+
+            if key in self._results:
+                self._results.move_to_end(key)
+                job.status = "done"
+                job.cached = True
+                job.result = self._results[key][0]
+                job.finished_at = time.time()
+                job.finished.set()
+                return job
+
+            self._in_flight[key] = job
+            self._submit_job(job, args, output_dir)
+
+        return job
+
+    def _submit_job(self, job: Job, args: Namespace, output_dir: Optional[Path]):
+        # Called with the lock held.
+        if self._executor is None:
+            self._executor = self._new_executor()
+
+        executor = self._executor
+        job.attempts += 1
+
+        try:
+            job.future = executor.submit(run_job, job.id, job.file_path, args, output_dir)
+        except BrokenProcessPool:
+            self._executor = None
+            executor.shutdown(wait=False)
+            self._submit_job(job, args, output_dir)
+            return
+
+        job.future.add_done_callback(
+            lambda future: self._finish(job, future, executor, args, output_dir)
+        )
+
+    def _add_job(self, job: Job):
+        self._jobs[job.id] = job
+
+        while len(self._jobs) > self._max_jobs:
+            oldest = next(
+                (job for job in self._jobs.values() if job.status in ("done", "failed")),
+                None,
+            )
+            if oldest is None:
+                break
+            del self._jobs[oldest.id]
+
+    def _finish(
+        self,
+        job: Job,
+        future: Future,
+        executor: ProcessPoolExecutor,
+        args: Namespace,
+        output_dir: Optional[Path],
+    ):
+        with self._lock:
+            while not self._started_queue.empty():
+                self._started.add(self._started_queue.get())
+
+            started = job.id in self._started
+            self._started.discard(job.id)
+
+            if isinstance(future.exception(), BrokenProcessPool):
+                # The first job to see that the pool broke replaces it. Its
+                # futures have all failed, so there is nothing to wait for.
+                if executor is self._executor:
+                    self._executor = None
+                    executor.shutdown(wait=False)
+
+                if not started and job.attempts < MAX_ATTEMPTS:
+                    self._submit_job(job, args, output_dir)
+                    return
+
+            self._in_flight.pop(job.key, None)
+            job.finished_at = time.time()
+
+            try:
+                job.result = future.result()
+            except BrokenProcessPool:
+                job.error = (
+                    "BrokenProcessPool: A worker process crashed while this job "
+                    "or another job was running."
+                )
+                job.status = "failed"
+            except Exception as e:
+                job.error = f"{type(e).__name__}: {e}"
+                job.status = "failed"
+            else:
+                job.status = "done"
+
+                if self._cache_size:
+                    # The files that the job saved, which a cached result
+                    # is only served with while they still exist.
+                    files = list(output_dir.iterdir()) if output_dir is not None else []
+                    self._results[job.key] = (job.result, files)
+                    while len(self._results) > self._cache_size:
+                        self._results.popitem(last=False)
+
+            job.finished.set()
+
+    def get(self, job_id: str, wait_seconds: float = 0) -> Optional[Job]:
+        """The job with the ID `job_id`, waiting up to `wait_seconds` for it to finish."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+
+        if job is None:
+            return None
+
+        if job.future is not None and wait_seconds > 0:
+            job.finished.wait(wait_seconds)
+
+        if job.status == "queued" and job.future is not None and job.future.running():
+            job.status = "running"
+
+        return job
+
+    def health(self) -> Dict:
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+
+        return {
+            "status": "ok",
+            "workers": self.workers,
+            "jobs": {status: statuses.count(status) for status in set(statuses)},
+            "in_flight": len(self._in_flight),
+            "cached_results": len(self._results),
+        }
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    service: AnalysisService
+
+    def _send_json(self, status: int, body: Dict):
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+
+        if url.path == "/health":
+            self._send_json(200, self.service.health())
+            return
+
+        if url.path.startswith("/jobs/"):
+            try:
+                wait_seconds = float(parse_qs(url.query).get("wait", ["0"])[0])
+            except ValueError:
+                self._send_json(400, {"error": "wait must be a number of seconds"})
+                return
+
+            job = self.service.get(url.path[len("/jobs/") :], wait_seconds)
+            if job is None:
+                self._send_json(404, {"error": "No such job"})
+            else:
+                self._send_json(200, job.to_dict())
+            return
+
+        self._send_json(404, {"error": f"Not found: {url.path}"})
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/jobs":
+            self._send_json(404, {"error": f"Not found: {self.path}"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(request, dict):
+                raise ValueError("The request must be a JSON object")
+
+            job = self.service.submit(request)
+        except (ValueError, TypeError, OSError) as e:
+            self._send_json(400, {"error": str(e)})
+            return
+
+        self._send_json(200 if job.status == "done" else 202, job.to_dict())
+
+
+def serve(service: AnalysisService, host: str, port: int) -> ThreadingHTTPServer:
+    """Create an HTTP server for `service`. Call serve_forever() on it to start it."""
+    handler = type("RequestHandler", (_RequestHandler,), {"service": service})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+class ServiceClient:
+    """A client for the service, using only the standard library."""
+
+    def __init__(self, base_url: str = f"http://127.0.0.1:{DEFAULT_PORT}"):
+        self.base_url = base_url.rstrip("/")
+
+    def _request(self, method: str, path: str, body: Optional[Dict] = None) -> Dict:
+        request = Request(
+            f"{self.base_url}{path}",
+            data=json.dumps(body).encode() if body is not None else None,
+            method=method,
+            headers={"Content-Type": "application/json"},
+        )
+
+        try:
+            with urlopen(request) as response:
+                return json.load(response)
+        except HTTPError as e:
+            raise RuntimeError(f"The service returned {e.code}: {e.read().decode()}") from e
+
+    def submit(self, **request) -> Dict:
+        """Submit a job, e.g. submit(file_path="video.mp4", mode="gop"). Returns the job."""
+        return self._request("POST", "/jobs", request)
+
+    def job(self, job_id: str, wait_seconds: float = 0) -> Dict:
+        return self._request("GET", f"/jobs/{job_id}?wait={wait_seconds}")
+
+    def health(self) -> Dict:
+        return self._request("GET", "/health")
+
+    def analyse(self, timeout: Optional[float] = None, **request) -> Dict:
+        """Submit a job and wait for it to finish. Returns the contents of data.json."""
+        job = self.submit(**request)
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while job["status"] not in ("done", "failed"):
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(f"Job {job['id']} did not finish within {timeout}s")
+
+            job = self.job(job["id"], wait_seconds=5)
+
+        if job["status"] == "failed":
+            raise RuntimeError(f"Job {job['id']} failed: {job['error']}")
+
+        return job["result"]
+
+
+def parse_service_args(argv=None):
+    parser = ArgumentParser(
+        description="Run the analysis as a local HTTP service.",
+        formatter_class=RawTextHelpFormatter,
+    )
+    parser.add_argument(
+        "--host",
+        default="127.0.0.1",
+        help="The address to listen on. The default, 127.0.0.1, only accepts local connections.",
+    )
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="The number of worker processes, and so the maximum number of jobs that run at once.\n"
+        "The default is the number of CPU cores.",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=256,
+        help="The number of results to cache. Use 0 to disable the cache. The default is 256.",
+    )
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_service_args()
+    service = AnalysisService(args.jobs, args.cache_size)
+    server = serve(service, args.host, args.port)
+
+    print(f"Listening on http://{args.host}:{server.server_port} with {args.jobs} workers.")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopping...")
+    finally:
+        server.server_close()
+        service.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import subprocess
+from typing import Callable, List, Optional, Sequence
+
+from packet_reader import PacketColumns, ffprobe_command, order_fields, read_packets
+from profiling import stage
+
+import numpy as np
+
+# How far each shard reads past its end. Packets are stored in decode order,
+# so a shard has to keep reading for a while to pick up every packet whose
+# PTS falls inside it before the next shard's seek point.
+DEFAULT_OVERLAP_SECONDS = 5.0
+
+
+def shard_intervals(
+    start_time: float,
+    duration: float,
+    shards: int,
+    overlap_seconds: float = DEFAULT_OVERLAP_SECONDS,
+) -> List[str]:
+    """
+    Split the file into `shards` -read_intervals values of equal duration.
+
+    The first shard starts at the beginning of the file and the last one
+    reads until the end, so no packet is missed if the duration is inaccurate.
+    """
+    if shards < 1:
+        raise ValueError(f"shards must be at least 1, got {shards}")
+
+    boundaries = np.linspace(start_time, start_time + duration, shards + 1)
+    intervals = []
+
+    for i in range(shards):
+        start = "" if i == 0 else f"{boundaries[i]:.6f}"
+        end = "" if i == shards - 1 else f"{boundaries[i + 1] + overlap_seconds:.6f}"
+        intervals.append(f"{start}%{end}")
+
+    return intervals
+
+
+def _read_shard(cmd: List[str], fields: Sequence[str]) -> PacketColumns:
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    packets = read_packets(process.stdout, fields)
+
+    if process.wait() != 0:
+        raise RuntimeError(
+            f"FFprobe exited with code {process.returncode}: {' '.join(cmd)}"
+        )
+
+    return packets
+
+
+def has_positions(packets: PacketColumns) -> bool:
+    """Whether every packet has a byte position, which FFprobe reports as N/A for some containers."""
+    return bool((packets["pos"] >= 0).all())
+
+
+def shards_overlap(parts: Sequence[PacketColumns]) -> bool:
+    """
+    Whether every shard starts at or before the byte position where the
+    previous one ended, so that no packets can be missing between them.
+    Shards without packets are skipped, so the shards either side of one
+    have to overlap instead.
+    """
+    previous_end = None
+
+    for packets in parts:
+        if not len(packets):
+            continue
+
+        positions = packets["pos"]
+        if previous_end is not None and positions.min() > previous_end:
+            return False
+
+        previous_end = positions.max()
+
+    return True
+
+
+def deduplicate(parts: Sequence[PacketColumns], fields: Sequence[str]) -> PacketColumns:
+    """
+    Merge the packets of every shard, removing the packets that were read by
+    more than one shard, and put them back in file order. Every packet must
+    have a byte position.
+
+    Packets are identified by their byte position, stream index and
+    timestamps, but the laced frames of a Matroska block can share all of
+    these. So a packet is only a duplicate if an earlier shard read at least
+    as many packets with the same identity: each identity is kept as many
+    times as the shard that read it most often.
+    """
+    packets = PacketColumns.concatenate(parts, fields)
+
+    if not len(packets):
+        return packets
+
+    if not has_positions(packets):
+        raise ValueError("Packets without a byte position cannot be deduplicated")
+
+    shards = np.repeat(np.arange(len(parts)), [len(part) for part in parts])
+    # Timestamps are compared bit for bit, so that N/A (NaN) equals itself.
+    keys = [packets["pos"], packets["stream_index"]] + [
+        packets[name].view(np.int64)
+        for name in ("pts_time", "dts_time")
+        if name in packets
+    ]
+
+    # By identity, then shard, then the order in which the shard read them.
+    order = np.lexsort([shards] + keys[::-1])
+    is_new_key = np.ones(len(order), dtype=bool)
+    is_new_key[1:] = np.any([key[order][1:] != key[order][:-1] for key in keys], axis=0)
+    is_new_group = is_new_key.copy()
+    is_new_group[1:] |= shards[order][1:] != shards[order][:-1]
+
+    # The number of earlier packets with the same identity in the same shard.
+    positions = np.arange(len(order))
+    occurrence = positions - np.maximum.accumulate(np.where(is_new_group, positions, 0))
+
+    # A packet is kept if no earlier shard read its identity that many times.
+    # Offsetting each identity's occurrences by its index keeps the running
+    # maximum from carrying over between identities.
+    ranked = np.cumsum(is_new_key) * len(order) + occurrence
+    is_kept = np.ones(len(order), dtype=bool)
+    is_kept[1:] = ranked[1:] > np.maximum.accumulate(ranked)[:-1]
+
+    kept = order[is_kept]
+    return packets.select(kept[np.lexsort((kept, packets["pos"][kept]))])
+
+
+def extract_packets_sharded(
+    file_path: str,
+    fields: Sequence[str],
+    stream_specifier: Optional[str],
+    start_time: float,
+    duration: float,
+    shards: int,
+    threads: Optional[int] = None,
+    overlap_seconds: float = DEFAULT_OVERLAP_SECONDS,
+    on_shard_complete: Optional[Callable[[int], None]] = None,
+) -> PacketColumns:
+    """
+    Extract packets with one FFprobe process per time shard, using
+    -read_intervals, and merge them into the same packets as a single pass.
+
+    The byte position and stream index of every packet are always extracted
+    so that packets at shard boundaries can be deduplicated. Malformed lines
+    in the overlap between shards are counted once by each shard that read them.
+
+    -read_intervals seeks inexactly, so a shard can start after the point
+    where the previous one stopped, e.g. if a GOP or the interleaving of the
+    streams spans more than `overlap_seconds`. The packets are then read
+    again in a single pass, as they are if the container does not report
+    byte positions.
+    """
+    shard_fields = order_fields(set(fields) | {"stream_index", "pos"})
+    base_cmd = ffprobe_command(file_path, shard_fields, stream_specifier, threads)
+    commands = [
+        base_cmd[:-1] + ["-read_intervals", interval, base_cmd[-1]]
+        for interval in shard_intervals(start_time, duration, shards, overlap_seconds)
+    ]
+
+    parts = []
+
+    with ThreadPoolExecutor(max_workers=shards) as executor:
+        # Each shard runs in a copy of this context, so that its stages are
+        # recorded by the active profiler.
+        futures = [
+            executor.submit(
+                contextvars.copy_context().run, _read_shard, cmd, shard_fields
+            )
+            for cmd in commands
+        ]
+
+        for i, future in enumerate(futures):
+            parts.append(future.result())
+
+            if on_shard_complete:
+                on_shard_complete(i + 1)
+
+    if not all(has_positions(packets) for packets in parts):
+        print(
+            "Warning: The file's packets have no byte positions, so the shards cannot be merged. "
+            "Reading the packets in a single pass instead."
+        )
+        return _read_shard(base_cmd, shard_fields)
+
+    if not shards_overlap(parts):
+        print(
+            "Warning: There is a gap between the packets of two shards, which a longer overlap would avoid. "
+            "Reading the packets in a single pass instead."
+        )
+        return _read_shard(base_cmd, shard_fields)
+
+    with stage("deduplicate shards") as counter:
+        packets = deduplicate(parts, shard_fields)
+        counter.items = len(packets)
+
+    return packets
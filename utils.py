@@ -1,75 +1,65 @@
-import os
-import subprocess
+import shutil
 
-from ffmpeg import probe
+from metadata_cache import in_memory_cache
 
 
 class FileInfoProvider:
-    def __init__(self, file_path):
+    def __init__(self, file_path, metadata_cache=None):
         self._file_path = file_path
+        self._metadata_cache = metadata_cache or in_memory_cache
+
+    @property
+    def _metadata(self):
+        return self._metadata_cache.probe(self._file_path)
 
     def is_video(self):
-        # This command will information about file's first stream.
-        cmd = [
-            "ffprobe",
-            "-v",
-            "error",
-            "-threads",
-            str(os.cpu_count()),
-            "-show_streams",
-            "-select_streams",
-            "V",
-            self._file_path,
-        ]
-
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-        return process.stdout.read().decode("utf-8")
+        # Attached pictures (e.g. cover art) are not considered to be video streams.
+        return any(
+            stream["codec_type"] == "video"
+            and not stream.get("disposition", {}).get("attached_pic")
+            for stream in self._metadata["streams"]
+        )
 
     def get_duration(self):
-        return float(probe(self._file_path)["format"]["duration"])
-
-    def get_number_of_packets(self, stream_specifier):
-        cmd = [
-            "ffprobe",
-            "-v",
-            "error",
-            "-select_streams",
-            stream_specifier,
-            "-count_packets",
-            "-show_entries",
-            "stream=nb_read_packets",
-            "-of",
-            "default=nokey=1:noprint_wrappers=1",
-            self._file_path,
-        ]
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-        return int(process.stdout.read().decode())
+        return float(self._metadata["format"]["duration"])
+
+    def get_start_time(self):
+        return float(self._metadata["format"].get("start_time", 0))
+
+    def get_codec_types(self):
+        """Map the index of every stream to its codec type, e.g. "video" or "audio"."""
+        return {
+            stream["index"]: stream["codec_type"] for stream in self._metadata["streams"]
+        }
 
 
 class VideoInfoProvider:
-    def __init__(self, video_path):
+    def __init__(self, video_path, metadata_cache=None):
         self._video_path = video_path
+        self._metadata_cache = metadata_cache or in_memory_cache
+
+    @property
+    def _metadata(self):
+        return self._metadata_cache.probe(self._video_path)
+
+    @property
+    def _video_stream(self):
+        return [
+            stream
+            for stream in self._metadata["streams"]
+            if stream["codec_type"] == "video"
+        ][0]
 
     def get_video_bitrate(self):
-        bitrate = probe(self._video_path)["format"]["bit_rate"]
+        bitrate = self._metadata["format"]["bit_rate"]
 
         return f"{(int(bitrate) / 1_000_000)} Mbps"
 
     def get_framerate_fraction(self):
-        r_frame_rate = [
-            stream
-            for stream in probe(self._video_path)["streams"]
-            if stream["codec_type"] == "video"
-        ][0]["r_frame_rate"]
-
-        return r_frame_rate
+        return self._video_stream["r_frame_rate"]
 
     def get_average_framerate(self):
-        return [
-            stream
-            for stream in probe(self._video_path)["streams"]
-            if stream["codec_type"] == "video"
-        ][0]["avg_frame_rate"]
+        return self._video_stream["avg_frame_rate"]
 
     def get_framerate_number(self):
         numerator, denominator = self.get_framerate_fraction().split("/")
@@ -84,21 +74,7 @@ class VideoInfoProvider:
 
 
 def line():
-    width, _ = os.get_terminal_size()
+    # Falls back to 80 columns when stdout is not a terminal, e.g. in batch mode.
+    width, _ = shutil.get_terminal_size()
     print("-" * width)
 
-
-def append_to_file(filename, data):
-    with open(filename, "a") as f:
-        f.write(data)
-
-
-def process_timestamp_and_size(parts):
-    if len(parts) < 2:
-        return None
-    try:
-        timestamp = float(parts[0])
-        packet_size = int(parts[1])
-        return timestamp, packet_size
-    except (ValueError, IndexError, OverflowError):
-        return None
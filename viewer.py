@@ -0,0 +1,299 @@
+import base64
+import html
+import json
+from pathlib import Path
+from typing import List
+
+from calculate_bitrates import UNIT_MULTIPLIERS
+from pyramid import PyramidLevel
+
+import numpy as np
+
+# The page draws the bins of the finest level with at most one bin per pixel,
+# so redrawing costs the same however long the file is. The levels are
+# embedded as base64-encoded little-endian Float32Arrays.
+# Finer levels with more bins than this are not embedded, which keeps the page
+# to a few MB for long files. Zooming in then stops at the finest level left.
+MAX_EMBEDDED_BINS = 1 << 19
+
+VIEWER_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>__TITLE__</title>
+<style>
+body { margin: 0; font-family: sans-serif; background: #fff; color: #222; }
+header { padding: 8px 12px; display: flex; gap: 24px; align-items: baseline; }
+h1 { font-size: 16px; margin: 0; }
+#info, #resolution { font-size: 13px; color: #555; font-variant-numeric: tabular-nums; }
+#graph { display: block; width: 100vw; height: calc(100vh - 40px); cursor: crosshair; }
+</style>
+</head>
+<body>
+<header>
+<h1>__TITLE__</h1>
+<span id="resolution">__RESOLUTION__</span>
+<span id="info">Scroll to zoom, drag to pan, double-click to reset.</span>
+</header>
+<canvas id="graph"></canvas>
+<script>
+"use strict";
+const DATA = __DATA__;
+
+function decode(text) {
+  const bytes = Uint8Array.from(atob(text), (c) => c.charCodeAt(0));
+  return new Float32Array(bytes.buffer);
+}
+
+const levels = DATA.levels.map((level) => ({
+  binSeconds: level.bin_seconds,
+  start: level.start,
+  mins: decode(level.mins),
+  maxs: decode(level.maxs),
+  means: decode(level.means),
+}));
+
+const MARGIN = { left: 70, right: 20, top: 10, bottom: 40 };
+const fullStart = levels[0].start;
+const fullEnd = fullStart + levels[0].means.length * levels[0].binSeconds;
+const minSpan = levels[0].binSeconds * 10;
+const canvas = document.getElementById("graph");
+const context = canvas.getContext("2d");
+const info = document.getElementById("info");
+let view = { start: fullStart, end: fullEnd };
+let hover = null;
+
+function plotWidth() {
+  return canvas.clientWidth - MARGIN.left - MARGIN.right;
+}
+
+function chooseLevel(span, pixels) {
+  for (const level of levels) {
+    if (level.binSeconds >= span / pixels) {
+      return level;
+    }
+  }
+  return levels[levels.length - 1];
+}
+
+function visibleBins(level) {
+  const first = Math.max(0, Math.floor((view.start - level.start) / level.binSeconds));
+  const last = Math.min(level.means.length, Math.ceil((view.end - level.start) / level.binSeconds));
+  return [first, last];
+}
+
+function niceStep(range, count) {
+  const rough = range / count;
+  const power = Math.pow(10, Math.floor(Math.log10(rough)));
+  for (const multiple of [1, 2, 5, 10]) {
+    if (multiple * power >= rough) {
+      return multiple * power;
+    }
+  }
+  return 10 * power;
+}
+
+function formatTime(seconds) {
+  const sign = seconds < 0 ? "-" : "";
+  seconds = Math.abs(seconds);
+  const hours = Math.floor(seconds / 3600);
+  const minutes = Math.floor((seconds % 3600) / 60);
+  const rest = (seconds % 60).toFixed(seconds < 60 ? 1 : 0).padStart(2, "0");
+  if (hours) {
+    return `${sign}${hours}:${String(minutes).padStart(2, "0")}:${rest.padStart(2, "0")}`;
+  }
+  return minutes ? `${sign}${minutes}:${rest.padStart(2, "0")}` : `${sign}${rest}s`;
+}
+
+function draw() {
+  const ratio = window.devicePixelRatio || 1;
+  canvas.width = canvas.clientWidth * ratio;
+  canvas.height = canvas.clientHeight * ratio;
+  context.setTransform(ratio, 0, 0, ratio, 0, 0);
+  context.clearRect(0, 0, canvas.clientWidth, canvas.clientHeight);
+
+  const width = plotWidth();
+  const height = canvas.clientHeight - MARGIN.top - MARGIN.bottom;
+  const span = view.end - view.start;
+  const level = chooseLevel(span, width);
+  const [first, last] = visibleBins(level);
+
+  let top = 0;
+  for (let i = first; i < last; i++) {
+    top = Math.max(top, level.maxs[i]);
+  }
+  top = top > 0 ? top * 1.05 : 1;
+
+  const x = (time) => MARGIN.left + ((time - view.start) / span) * width;
+  const y = (value) => MARGIN.top + height - (value / top) * height;
+
+  context.save();
+  context.beginPath();
+  context.rect(MARGIN.left, MARGIN.top, width, height);
+  context.clip();
+
+  context.fillStyle = "rgba(31, 119, 180, 0.3)";
+  for (let i = first; i < last; i++) {
+    const left = x(level.start + i * level.binSeconds);
+    const right = x(level.start + (i + 1) * level.binSeconds);
+    context.fillRect(left, y(level.maxs[i]), Math.max(right - left, 1), Math.max(y(level.mins[i]) - y(level.maxs[i]), 1));
+  }
+
+  context.strokeStyle = "rgb(31, 119, 180)";
+  context.lineWidth = 1.5;
+  context.beginPath();
+  for (let i = first; i < last; i++) {
+    const middle = x(level.start + (i + 0.5) * level.binSeconds);
+    if (i === first) {
+      context.moveTo(middle, y(level.means[i]));
+    } else {
+      context.lineTo(middle, y(level.means[i]));
+    }
+  }
+  context.stroke();
+  context.restore();
+
+  context.strokeStyle = "#ccc";
+  context.fillStyle = "#444";
+  context.font = "12px sans-serif";
+  context.lineWidth = 1;
+
+  const yStep = niceStep(top, 5);
+  context.textAlign = "right";
+  context.textBaseline = "middle";
+  for (let value = 0; value <= top; value += yStep) {
+    context.beginPath();
+    context.moveTo(MARGIN.left, y(value));
+    context.lineTo(MARGIN.left + width, y(value));
+    context.stroke();
+    context.fillText(value.toPrecision(3), MARGIN.left - 6, y(value));
+  }
+
+  const xStep = niceStep(span, Math.max(2, width / 120));
+  context.textAlign = "center";
+  context.textBaseline = "top";
+  for (let time = Math.ceil(view.start / xStep) * xStep; time <= view.end; time += xStep) {
+    context.beginPath();
+    context.moveTo(x(time), MARGIN.top);
+    context.lineTo(x(time), MARGIN.top + height);
+    context.stroke();
+    context.fillText(formatTime(time), x(time), MARGIN.top + height + 6);
+  }
+
+  context.save();
+  context.translate(14, MARGIN.top + height / 2);
+  context.rotate(-Math.PI / 2);
+  context.fillText(`Bitrate (${DATA.unit})`, 0, 0);
+  context.restore();
+
+  if (hover !== null && hover >= view.start && hover < view.end) {
+    const i = Math.floor((hover - level.start) / level.binSeconds);
+    if (i >= first && i < last) {
+      const binStart = level.start + i * level.binSeconds;
+      context.strokeStyle = "rgba(214, 39, 40, 0.8)";
+      context.beginPath();
+      context.moveTo(x(hover), MARGIN.top);
+      context.lineTo(x(hover), MARGIN.top + height);
+      context.stroke();
+      info.textContent =
+        `${formatTime(binStart)} to ${formatTime(binStart + level.binSeconds)} ` +
+        `(${level.binSeconds}s bins): min ${level.mins[i].toFixed(3)}, ` +
+        `mean ${level.means[i].toFixed(3)}, max ${level.maxs[i].toFixed(3)} ${DATA.unit}`;
+    }
+  }
+}
+
+function timeAt(event) {
+  const rect = canvas.getBoundingClientRect();
+  return view.start + ((event.clientX - rect.left - MARGIN.left) / plotWidth()) * (view.end - view.start);
+}
+
+function setView(start, end) {
+  const span = Math.min(Math.max(end - start, minSpan), fullEnd - fullStart);
+  start = Math.min(Math.max(start, fullStart), fullEnd - span);
+  view = { start, end: start + span };
+  requestAnimationFrame(draw);
+}
+
+canvas.addEventListener("wheel", (event) => {
+  event.preventDefault();
+  const anchor = timeAt(event);
+  const factor = event.deltaY > 0 ? 1.25 : 0.8;
+  setView(anchor - (anchor - view.start) * factor, anchor + (view.end - anchor) * factor);
+}, { passive: false });
+
+let dragFrom = null;
+canvas.addEventListener("mousedown", (event) => {
+  dragFrom = { x: event.clientX, view };
+});
+window.addEventListener("mouseup", () => {
+  dragFrom = null;
+});
+canvas.addEventListener("mousemove", (event) => {
+  if (dragFrom !== null) {
+    const shift = ((dragFrom.x - event.clientX) / plotWidth()) * (dragFrom.view.end - dragFrom.view.start);
+    setView(dragFrom.view.start + shift, dragFrom.view.end + shift);
+  }
+  hover = timeAt(event);
+  requestAnimationFrame(draw);
+});
+canvas.addEventListener("dblclick", () => setView(fullStart, fullEnd));
+window.addEventListener("resize", () => requestAnimationFrame(draw));
+draw();
+</script>
+</body>
+</html>
+"""
+
+
+def _encode(values: np.ndarray) -> str:
+    return base64.b64encode(values.astype("<f4").tobytes()).decode("ascii")
+
+
+def save_viewer(
+    title: str, pyramid: List[PyramidLevel], output_unit: str, viewer_path: Path
+):
+    """
+    Save a self-contained HTML page for zooming into the bitrates of `pyramid`,
+    which works offline. The bitrates are shown in `output_unit`.
+
+    Levels with more than MAX_EMBEDDED_BINS bins are left out, apart from
+    the coarsest. The page header shows the width of the finest bins that
+    were embedded, and a warning is printed if any levels were left out.
+    """
+    multiplier = UNIT_MULTIPLIERS[output_unit]
+    embedded = [level for level in pyramid[:-1] if len(level) <= MAX_EMBEDDED_BINS]
+    embedded += pyramid[-1:]
+    finest = f"{embedded[0].bin_seconds:g}s"
+    resolution = f"Finest bins: {finest}"
+
+    if len(embedded) < len(pyramid):
+        print(
+            f"Warning: The viewer only zooms in to {finest} bins. The finer levels "
+            f"have more than {MAX_EMBEDDED_BINS} bins and were left out to keep the page small."
+        )
+        resolution += " (finer levels left out)"
+
+    data = {
+        "unit": output_unit.capitalize(),
+        "levels": [
+            {
+                "bin_seconds": level.bin_seconds,
+                "start": level.start,
+                "mins": _encode(level.mins * multiplier),
+                "maxs": _encode(level.maxs * multiplier),
+                "means": _encode(level.means * multiplier),
+            }
+            for level in embedded
+        ],
+    }
+
+    page = (
+        VIEWER_TEMPLATE.replace("__TITLE__", html.escape(title))
+        .replace("__RESOLUTION__", resolution)
+        # Escaping "</" keeps the data from closing the script element.
+        .replace("__DATA__", json.dumps(data).replace("</", "<\\/"))
+    )
+
+    with open(viewer_path, "w", encoding="utf-8") as f:
+        f.write(page)
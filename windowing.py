@@ -0,0 +1,99 @@
+from typing import Dict, NamedTuple, Sequence, Tuple
+
+from calculate_bitrates import UNIT_MULTIPLIERS, validate_output_unit
+
+import numpy as np
+
+
+class PacketTimeline(NamedTuple):
+    """Packets sorted by timestamp, with the cumulative bytes before each packet."""
+
+    timestamps: np.ndarray
+    # cumulative_bytes[i] is the total size of packets 0 to i - 1, so the size
+    # of packets i to j - 1 is cumulative_bytes[j] - cumulative_bytes[i].
+    cumulative_bytes: np.ndarray
+
+    @classmethod
+    def from_packets(cls, timestamps: np.ndarray, sizes: np.ndarray) -> "PacketTimeline":
+        """Packets with a timestamp of N/A are ignored."""
+        has_timestamp = ~np.isnan(timestamps)
+        timestamps = timestamps[has_timestamp]
+        sizes = sizes[has_timestamp]
+
+        order = np.argsort(timestamps, kind="stable")
+        cumulative_bytes = np.zeros(len(order) + 1, dtype=np.int64)
+        np.cumsum(sizes[order], out=cumulative_bytes[1:])
+
+        return cls(timestamps[order], cumulative_bytes)
+
+    def bytes_between(self, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+        """The number of bytes in each [start, end) time range."""
+        return (
+            self.cumulative_bytes[np.searchsorted(self.timestamps, ends, side="left")]
+            - self.cumulative_bytes[np.searchsorted(self.timestamps, starts, side="left")]
+        )
+
+    def fixed_window_bits(self, window: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The start time and number of bits of every consecutive window, starting
+        at the first packet. A final window that extends past the last packet
+        is left out because it is incomplete.
+        """
+        first, last = self.timestamps[0], self.timestamps[-1]
+        starts = first + window * np.arange(int((last - first) // window))
+        return starts, self.bytes_between(starts, starts + window) * 8
+
+    def sliding_window_bits(self, window: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The number of bits in the window that starts at each packet. Any
+        window with the maximum number of bits can be moved forward until it
+        starts at a packet, so these windows always include the peak.
+        """
+        starts = self.timestamps
+        return starts, self.bytes_between(starts, starts + window) * 8
+
+
+def window_peaks(
+    timestamps: np.ndarray,
+    sizes: np.ndarray,
+    windows: Sequence[float],
+    output_unit: str,
+) -> Dict[str, Dict]:
+    """
+    Calculate the peak bitrate over fixed and sliding windows of each size.
+
+    The packets are sorted and summed once. Every window size is then
+    answered with binary searches into the cumulative byte totals, which is
+    O(n log n) like the sort, so no window is summed packet by packet.
+    """
+    validate_output_unit(output_unit)
+
+    if any(window <= 0 for window in windows):
+        raise ValueError(f"Window sizes must be positive, got {list(windows)}")
+
+    timeline = PacketTimeline.from_packets(timestamps, sizes)
+    multiplier = UNIT_MULTIPLIERS[output_unit]
+    peaks = {}
+
+    if not len(timeline.timestamps):
+        return peaks
+
+    for window in windows:
+        result = {}
+
+        window_starts, bits = timeline.fixed_window_bits(window)
+        if len(bits):
+            peak = int(np.argmax(bits))
+            result[f"fixed_max_bitrate_{output_unit}"] = (
+                bits[peak] / window * multiplier
+            )
+            result["fixed_max_window_start"] = float(window_starts[peak])
+
+        window_starts, bits = timeline.sliding_window_bits(window)
+        peak = int(np.argmax(bits))
+        result[f"sliding_max_bitrate_{output_unit}"] = bits[peak] / window * multiplier
+        result["sliding_max_window_start"] = float(window_starts[peak])
+
+        peaks[f"{window:g}s"] = result
+
+    return peaks